@@ -23,6 +23,8 @@ from mfem.common.parcsr_extra import ToScipyCoo
 from mfem.common.mpi_debug import nicePrint
 
 from petram.model import Domain, Bdry, Point, Pair
+from petram.helper.phase_profiler import PhaseProfiler, profile_phase
+from petram.helper.operator_block import is_operator_form
 
 import petram.debug
 dprint1, dprint2, dprint3 = petram.debug.init_dprints('Engine')
@@ -46,6 +48,20 @@ def enum_fes(phys, *args):
         yield ([k] + [(None if a[phys] is None else a[phys][k][1])
                       for a in args])
 
+
+def pair_realimag_forms(r_forms, i_forms):
+    '''
+    list (r, c, form) so that the imaginary form follows the real form
+    of the same block
+    '''
+    i_list = [(r, c, form) for r, c, form in i_forms]
+    ret = []
+    for r, c, form in r_forms:
+        ret.append((r, c, form))
+        ret.extend([x for x in i_list if x[0] == r and x[1] == c])
+        i_list = [x for x in i_list if x[0] != r or x[1] != c]
+    return ret + i_list
+
 # Number of matrices to handle.
 #   must be even number.
 #    First half is for time-dependent
@@ -68,6 +84,9 @@ class Engine(object):
         self.data_stack = deque()
         self.set_model(model)
 
+        from petram.mfem_config import get_use_phase_profiler
+        self.profiler = PhaseProfiler(enabled=get_use_phase_profiler())
+
         # mulitlple matrices in equations.
         self._num_matrix = 1
         self._access_idx = -1
@@ -76,6 +95,10 @@ class Engine(object):
         self._num_levels = 1
         self._level_idx = 0
 
+        # partial/element assembly is used only when the linear solver
+        # applies the operator without a matrix (set in run_verify_setting)
+        self.matrix_free_allowed = False
+
         self._dep_vars = []
         self._isFESvar = []
         self._rdep_vars = []
@@ -587,11 +610,13 @@ class Engine(object):
         from petram.mfem_config import use_parallel
 
         if use_parallel:
-            self.run_mesh_serial(skip_refine=True)
+            if not (self.has_partition_cache() and
+                    self.run_preprocess_on_root()):
+                self.run_mesh_serial(skip_refine=True)
+                self.run_preprocess()  # this must run when mesh is serial
         else:
             self.run_mesh_serial()
-
-        self.run_preprocess()  # this must run when mesh is serial
+            self.run_preprocess()  # this must run when mesh is serial
 
         if use_parallel:
             self.initialize_fespaces()
@@ -704,6 +729,11 @@ class Engine(object):
             error, txt, long_txt = mm.verify_setting()
             assert error, mm.fullname() + ":" + long_txt
 
+        if hasattr(solver, 'is_matrix_free_allowed'):
+            self.matrix_free_allowed = solver.is_matrix_free_allowed()
+        else:
+            self.matrix_free_allowed = False
+
     #  mesh manipulation
     #
 
@@ -770,6 +800,7 @@ class Engine(object):
     #
     #  assembly
     #
+    @profile_phase("run_alloc_sol")
     def run_alloc_sol(self, phys_target=None):
         '''
         allocate fespace and gridfunction (unknowns)
@@ -948,6 +979,7 @@ class Engine(object):
             for phys in phys_target:
                 self.apply_essential(phys, update=update)
 
+    @profile_phase("run_assemble_mat")
     def run_assemble_mat(self, phys_target, phys_range, update=False):
         # for phys in phys_target:
         #    self.gather_essential_tdof(phys)
@@ -971,34 +1003,45 @@ class Engine(object):
                 for mm in phys.walk_enabled():
                     mm.compile_coeffs()
 
+        from petram.helper.numba_cache import numba_coeff_cache
+        numba_coeff_cache.report()
+
+        from petram.phys.pycomplex_coefficient import complex_assembly
+
         for j in range(self.n_matrix):
             self.access_idx = j
             if not self.is_matrix_active(j):
                 continue
 
-            for phys in phys_target:
-                self.fill_bf(phys, update)
-                self.fill_mixed(phys, update)
-
-            self.r_a.set_no_allocator()
-            self.i_a.set_no_allocator()
-            self.r_at.set_no_allocator()
-            self.i_at.set_no_allocator()
-
-            rcforms = ([(r, c, form) for r, c, form in self.r_a] +
-                       [(r, c, form) for r, c, form in self.i_a] +
-                       [(r, c, form) for r, c, form in self.r_at] +
-                       [(r, c, form) for r, c, form in self.i_at])
-
-            for r, c, form in rcforms:
-                r1 = self.dep_var_offset(self.fes_vars[r])
-                c1 = self.r_dep_var_offset(self.r_fes_vars[c])
-                if self.mask_M[j, r1, c1]:
-                    try:
-                        form.Assemble(0)
-                    except BaseException:
-                        print("failed to assemble (r, c) = ", r1, c1)
-                        raise
+            with complex_assembly():
+                for phys in phys_target:
+                    with self.profiler.phase("fill:" + phys.name()):
+                        self.fill_bf(phys, update)
+                        self.fill_mixed(phys, update)
+
+                self.r_a.set_no_allocator()
+                self.i_a.set_no_allocator()
+                self.r_at.set_no_allocator()
+                self.i_at.set_no_allocator()
+
+                # real and imaginary forms of the same block are
+                # assembled one after the other to share the complex
+                # coefficient evaluation.
+                rcforms = (pair_realimag_forms(self.r_a, self.i_a) +
+                           pair_realimag_forms(self.r_at, self.i_at))
+
+                for r, c, form in rcforms:
+                    r1 = self.dep_var_offset(self.fes_vars[r])
+                    c1 = self.r_dep_var_offset(self.r_fes_vars[c])
+                    if self.mask_M[j, r1, c1]:
+                        name = ("assemble:" + self.fes_vars[r] + "," +
+                                self.r_fes_vars[c])
+                        try:
+                            with self.profiler.phase(name):
+                                form.Assemble(0)
+                        except BaseException:
+                            print("failed to assemble (r, c) = ", r1, c1)
+                            raise
 
             self.extras = {}
             self.cextras = {}
@@ -1073,6 +1116,7 @@ class Engine(object):
 
         return np.any(self.mask_M) or len(updated_extra) > 0
 
+    @profile_phase("run_assemble_b")
     def run_assemble_b(self, phys_target=None, update=False):
         '''
         assemble only RHS
@@ -1096,24 +1140,23 @@ class Engine(object):
         #    self.gather_essential_tdof(phys)
         # self.collect_all_ess_tdof()
 
-        self.access_idx = 0
-        for phys in phys_target:
-            self.fill_lf(phys, update)
+        from petram.phys.pycomplex_coefficient import complex_assembly
 
-        self.r_b.set_no_allocator()
-        self.i_b.set_no_allocator()
+        self.access_idx = 0
+        with complex_assembly():
+            for phys in phys_target:
+                with self.profiler.phase("fill:" + phys.name()):
+                    self.fill_lf(phys, update)
 
-        for r, c, form in self.r_b:
-            name = self.fes_vars[r]
-            offset = self.dep_var_offset(name)
-            if self.mask_B[offset]:
-                form.Assemble()
+            self.r_b.set_no_allocator()
+            self.i_b.set_no_allocator()
 
-        for r, c, form in self.i_b:
-            name = self.fes_vars[r]
-            offset = self.dep_var_offset(name)
-            if self.mask_B[offset]:
-                form.Assemble()
+            for r, c, form in pair_realimag_forms(self.r_b, self.i_b):
+                name = self.fes_vars[r]
+                offset = self.dep_var_offset(name)
+                if self.mask_B[offset]:
+                    with self.profiler.phase("assemble:" + name):
+                        form.Assemble()
 
         updated_extra = []
         for phys in phys_target:
@@ -1419,6 +1462,8 @@ class Engine(object):
         if init_path is "", then file is read from cwd.
         if file is not found, then it zeroes the gf
         '''
+        from petram.helper.solfile import find_solfile, read_gridfunction
+
         dprint1("apply_init_from_file", phys, init_path)
         emesh_idx = phys.emesh_idx
         names = phys.dep_vars
@@ -1435,14 +1480,14 @@ class Engine(object):
                 igf = None
             fr, fi = self.solfile_name(names[kfes], emesh_idx)
             meshname = 'solmesh_' + str(emesh_idx) + suffix
-            fr = fr + suffix
-            fi = fi + suffix
 
             path = os.path.expanduser(init_path)
             if path == '':
                 path = os.getcwd()
             fr = os.path.join(path, fr)
             fi = os.path.join(path, fi)
+            fr = find_solfile(fr, suffix) or fr + suffix
+            fi = find_solfile(fi, suffix) or fi + suffix
             meshname = os.path.join(path, meshname)
 
             rgf.Assign(0.0)
@@ -1458,12 +1503,12 @@ class Engine(object):
             m = mfem.Mesh(str(meshname), 1, 1)
             # 2021. Nov
             # m.ReorientTetMesh()
-            solr = mfem.GridFunction(m, str(fr))
+            solr = read_gridfunction(m, fr)
             if solr.Size() != rgf.Size():
                 assert False, "Solution file (real) has different length!!!"
             rgf += solr
             if igf is not None:
-                soli = mfem.GridFunction(m, str(fi))
+                soli = read_gridfunction(m, fi)
                 if soli.Size() != igf.Size():
                     assert False, "Solution file (imag) has different length!!!"
                 igf += soli
@@ -1536,9 +1581,11 @@ class Engine(object):
                     continue
                 proj = mm.get_projection()
                 ra = self.r_a[ifes, rifes, proj]
+                self.set_assembly_level(phys, ra, proj)
 
                 mm.set_integrator_realimag_mode(True)
-                mm.add_bf_contribution(self, ra, real=True, kfes=kfes)
+                with self.profiler.phase(mm.fullpath()):
+                    mm.add_bf_contribution(self, ra, real=True, kfes=kfes)
 
         if not is_complex:
             return
@@ -1561,9 +1608,40 @@ class Engine(object):
                     continue
                 proj = mm.get_projection()
                 ia = self.i_a[ifes, rifes, proj]
+                self.set_assembly_level(phys, ia, proj)
 
                 mm.set_integrator_realimag_mode(False)
-                mm.add_bf_contribution(self, ia, real=False, kfes=kfes)
+                with self.profiler.phase(mm.fullpath()):
+                    mm.add_bf_contribution(self, ia, real=False, kfes=kfes)
+
+    def get_assembly_level(self, phys, proj=1):
+        '''
+        assembly level (mfem.AssemblyLevel_*) of BilinearForms of phys.
+        None means the form is assembled as a matrix.
+        '''
+        level = getattr(phys, 'assembly_level', 'full')
+        if level == 'full':
+            return None
+        if not self.matrix_free_allowed:
+            dprint1(phys.name() + ": " + level +
+                    " assembly requires an iterative solver. using full assembly")
+            return None
+        if proj != 1:
+            dprint1(phys.name() + ": " + level +
+                    " assembly is not used for a projected form")
+            return None
+        levels = {'partial': mfem.AssemblyLevel_PARTIAL,
+                  'element': mfem.AssemblyLevel_ELEMENT}
+        return levels[level]
+
+    def set_assembly_level(self, phys, form, proj=1):
+        level = self.get_assembly_level(phys, proj)
+        if level is None:
+            return
+        if getattr(form, '_assembly_level', None) is not None:
+            return
+        form.SetAssemblyLevel(level)
+        form._assembly_level = level
 
     def fill_lf(self, phys, update):
         renewargs = []
@@ -1605,7 +1683,8 @@ class Engine(object):
                     continue
 
                 mm.set_integrator_realimag_mode(True)
-                mm.add_lf_contribution(self, rb, real=True, kfes=kfes)
+                with self.profiler.phase(mm.fullpath()):
+                    mm.add_lf_contribution(self, rb, real=True, kfes=kfes)
 
         if not is_complex:
             return
@@ -1626,7 +1705,8 @@ class Engine(object):
                     continue
 
                 mm.set_integrator_realimag_mode(False)
-                mm.add_lf_contribution(self, ib, real=False, kfes=kfes)
+                with self.profiler.phase(mm.fullpath()):
+                    mm.add_lf_contribution(self, ib, real=False, kfes=kfes)
 
     def fill_mixed(self, phys, update):
 
@@ -1729,8 +1809,9 @@ class Engine(object):
                     bfr = self.r_a[idx1, idx2]
 
                 mm.set_integrator_realimag_mode(True)
-                mm.add_mix_contribution2(
-                    self, bfr, r, c, False, is_conj, real=True)
+                with self.profiler.phase(mm.fullpath()):
+                    mm.add_mix_contribution2(
+                        self, bfr, r, c, False, is_conj, real=True)
 
                 # imag part
                 if is_complex:
@@ -1739,8 +1820,9 @@ class Engine(object):
                     else:
                         bfi = self.i_a[idx1, idx2]
                     mm.set_integrator_realimag_mode(False)
-                    mm.add_mix_contribution2(
-                        self, bfi, r, c, False, is_conj, real=False)
+                    with self.profiler.phase(mm.fullpath()):
+                        mm.add_mix_contribution2(
+                            self, bfi, r, c, False, is_conj, real=False)
 
     def update_bf(self):
         fes_vars = self.fes_vars
@@ -1934,7 +2016,8 @@ class Engine(object):
     def fill_M_B_blocks(self, M, B, update=False):
         from petram.helper.formholder import convertElement
         from mfem.common.chypre import BF2PyMat, LF2PyVec, Array2PyVec
-        from mfem.common.chypre import MfemVec2PyVec, MfemMat2PyMat
+        from mfem.common.chypre import MfemVec2PyVec
+        from petram.helper.operator_block import MatOrForm2PyMat
         from itertools import product
 
         if update:
@@ -1976,13 +2059,13 @@ class Engine(object):
                     continue
 
                 m1 = convertElement(self.r_a, self.i_a,
-                                    i, j, MfemMat2PyMat,
+                                    i, j, MatOrForm2PyMat,
                                     projections=(self.projections, self.projections_hash))
                 if m1 is not None:
                     M[k][r, c] = m1 if M[k][r, c] is None else M[k][r, c] + m1
 
                 m2 = convertElement(self.r_at, self.i_at,
-                                    i, j, MfemMat2PyMat,
+                                    i, j, MatOrForm2PyMat,
                                     projections=(self.projections, self.projections_hash))
 
                 if m2 is not None:
@@ -2102,6 +2185,7 @@ class Engine(object):
         return X
 
     def fill_BCeliminate_matrix(self, A, B, inplace=True, update=False):
+        from petram.helper.operator_block import OperatorBlock
         diagpolicy = self.get_diagpolicy()
 
         nblock1 = A.shape[0]
@@ -2126,7 +2210,8 @@ class Engine(object):
                 # note: this check is necessary, since in parallel environment,
                 # add_empty_square_block could not create any block because
                 # locally number or rows is zero.
-                if self.get_autofill_diag():
+                if (self.get_autofill_diag() and
+                        not isinstance(A[idx1, idx2], OperatorBlock)):
                     self.fill_empty_diag(A[idx1, idx2])
 
                 Aee, A[idx1, idx2], Bnew = A[idx1, idx2].eliminate_RowsCols(B[idx1], ess_tdof1,
@@ -2385,6 +2470,7 @@ class Engine(object):
     #
     #  step4 : matrix finalization (to form a data being passed to a linear solver)
     #
+    @profile_phase("finalize_matrix")
     def finalize_matrix(self, M_block, mask, is_complex, format='coo',
                         verbose=True):
         if verbose:
@@ -2599,10 +2685,16 @@ class Engine(object):
     #  save to file
     #
 
+    @profile_phase("save_sol_to_file")
     def save_sol_to_file(self, phys_target, skip_mesh=False,
                          mesh_only=False,
                          save_parmesh=False,
-                         save_mesh_linkdir=None):
+                         save_mesh_linkdir=None,
+                         writer=None):
+        '''
+        writer : BackgroundWriter. if given, solution files are written
+                 in background (see save_solfile_fespace)
+        '''
         if not skip_mesh:
             m1 = [self.save_mesh0(save_mesh_linkdir), ]
             mesh_filenames = self.save_mesh(phys_target, save_mesh_linkdir)
@@ -2620,7 +2712,8 @@ class Engine(object):
                 ifes = self.r_ifes(name)
                 r_x = self.r_x[ifes]
                 i_x = self.i_x[ifes]
-                self.save_solfile_fespace(name, emesh_idx, r_x, i_x)
+                self.save_solfile_fespace(name, emesh_idx, r_x, i_x,
+                                          writer=writer)
 
     def extrafile_name(self):
         return 'sol_extended.data'
@@ -2649,27 +2742,8 @@ class Engine(object):
         if ll == 0:
             return
 
-        fid = open(extrafile_name, 'w')
-        for name in sol_extra.keys():
-            for k in sol_extra[name].keys():
-                data = sol_extra[name][k]
-                #  data must be NdArray
-                #  dataname : "E1.E_out"
-                fid.write('name : ' + name + '.' + str(k) + '\n')
-                if data.ndim == 0:
-                    fid.write('size : ' + str(data.size) + '\n')
-                    fid.write('dim : ' + str(data.ndim) + '\n')
-                    fid.write('dtype: ' + str(data.dtype) + '\n')
-                    fid.write(str(0) + ' ' + str(data) + '\n')
-                else:
-                    data = data.flatten()
-                    sol_extra[name][k] = data
-                    fid.write('size : ' + str(data.size) + '\n')
-                    fid.write('dim : ' + str(data.ndim) + '\n')
-                    fid.write('dtype: ' + str(data.dtype) + '\n')
-                    for kk, d in enumerate(data):
-                        fid.write(str(kk) + ' ' + str(d) + '\n')
-        fid.close()
+        from petram.helper.extra_data import write_extra_data
+        write_extra_data(extrafile_name, sol_extra)
 
     def load_extra_from_file(self, init_path):
         sol_extra = {}
@@ -2680,27 +2754,8 @@ class Engine(object):
         if not os.path.exists(path):
             return False, None
 
-        fid = open(path, 'r')
-        line = fid.readline()
-        while line:
-            if line.startswith('name'):
-                name, name2 = line.split(':')[1].strip().split('.')
-                if not name in sol_extra:
-                    sol_extra[name] = {}
-            size = long(fid.readline().split(':')[1].strip())
-            dim = long(fid.readline().split(':')[1].strip())
-            dtype = fid.readline().split(':')[1].strip()
-            if dtype.startswith('complex'):
-                data = [complex(fid.readline().split(' ')[1])
-                        for k in range(size)]
-                data = np.array(data, dtype=dtype)
-            else:
-                data = [float(fid.readline().split(' ')[1])
-                        for k in range(size)]
-                data = np.array(data, dtype=dtype)
-            sol_extra[name][name2] = data
-            line = fid.readline()
-        fid.close()
+        from petram.helper.extra_data import read_extra_data
+        sol_extra = read_extra_data(path)
         return True, sol_extra
     #
     #  postprocess
@@ -3171,6 +3226,7 @@ class Engine(object):
         if self.emesh_data is None:
             self.reset_emesh_data()
 
+    @profile_phase("run_mesh_serial")
     def run_mesh_serial(self, meshmodel=None,
                         skip_refine=False):
 
@@ -3327,17 +3383,51 @@ class Engine(object):
                     os.remove(f)
         MPI.COMM_WORLD.Barrier()
 
-    def save_solfile_fespace(self, name, mesh_idx, r_x, i_x):
+    def save_solfile_fespace(self, name, mesh_idx, r_x, i_x, writer=None):
         fnamer, fnamei = self.solfile_name(name, mesh_idx)
         suffix = self.solfile_suffix()
 
         self.clear_solmesh_files(fnamer)
         self.clear_solmesh_files(fnamei)
 
+        solfile_format = self.get_solfile_format()
+        if solfile_format == 'binary (single file)' and self.isParallel:
+            # one file per field. rank k writes piece k.
+            from mpi4py import MPI
+            from petram.helper.solfile import (write_solfile_aggregated,
+                                               aggregated_suffix)
+            write_solfile_aggregated(fnamer + aggregated_suffix, r_x,
+                                     MPI.COMM_WORLD)
+            if i_x is not None:
+                write_solfile_aggregated(fnamei + aggregated_suffix, i_x,
+                                         MPI.COMM_WORLD)
+            return
+
         fnamer = fnamer+suffix
         fnamei = fnamei+suffix
 
-        if self.get_savegz():
+        if writer is None:
+            self.write_solfile_fespace(fnamer, fnamei, r_x, i_x,
+                                       solfile_format, self.get_savegz())
+            return
+
+        # r_x/i_x are overwritten by the next solution. writer gets
+        # copies and absolute paths (cwd may change before it runs).
+        r_x = self.copy_gf(r_x)
+        i_x = self.copy_gf(i_x) if i_x is not None else None
+        writer.submit(self.write_solfile_fespace,
+                      os.path.abspath(fnamer), os.path.abspath(fnamei),
+                      r_x, i_x, solfile_format, self.get_savegz())
+
+    @staticmethod
+    def write_solfile_fespace(fnamer, fnamei, r_x, i_x, solfile_format,
+                              savegz):
+        if solfile_format != 'text':
+            from petram.helper.solfile import write_solfile
+            write_solfile(fnamer, r_x)
+            if i_x is not None:
+                write_solfile(fnamei, i_x)
+        elif savegz:
             r_x.SaveGZ(fnamer, 8)
             if i_x is not None:
                 i_x.SaveGZ(fnamei, 8)
@@ -3346,6 +3436,15 @@ class Engine(object):
             if i_x is not None:
                 i_x.Save(fnamei, 8)
 
+    def copy_gf(self, gf):
+        if hasattr(gf, 'ParFESpace'):
+            fes = gf.ParFESpace()
+        else:
+            fes = gf.FESpace()
+        ret = self.new_gf(fes, init=False)
+        ret.Assign(gf)
+        return ret
+
     def save_mesh0(self, save_mesh_linkdir=None):
         mesh_names = []
         suffix = self.solfile_suffix()
@@ -3761,6 +3860,10 @@ class Engine(object):
             return True
         return False
 
+    def get_solfile_format(self):
+        general = self.model.root()['General']
+        return getattr(general, 'solfile_format', 'text')
+
     def get_partitiong_method(self):
         return self.model.root()['General'].partitioning
 
@@ -3776,6 +3879,7 @@ class SerialEngine(Engine):
         super(SerialEngine, self).__init__(modelfile=modelfile, model=model)
         self.isParallel = False
 
+    @profile_phase("run_mesh")
     def run_mesh(self, meshmodel=None, skip_refine=False):
         '''
         skip_refine is for mfem_viewer
@@ -3905,6 +4009,9 @@ class SerialEngine(Engine):
     '''
 
     def a2A(self, a):  # BilinearSystem to matrix
+        if is_operator_form(a):
+            # partial/element assembly. form is used as an operator
+            return a
         # we dont eliminate essentiaal at this level...
         inta = mfem.intArray()
         m = self.new_matrix()
@@ -4018,11 +4125,76 @@ class ParallelEngine(Engine):
         super(ParallelEngine, self).__init__(modelfile=modelfile, model=model)
         self.isParallel = True
 
+    def has_partition_cache(self):
+        '''
+        True if partitioned meshes of all mesh generators are in the
+        partition cache. must be called on all ranks.
+        '''
+        from mpi4py import MPI
+        from petram.mesh.mesh_model import MFEMMesh
+        from petram.mesh.partition_cache import get_partition_cache
+
+        parent = self.model['Mesh']
+        children = [parent[g] for g in parent.keys()
+                    if isinstance(parent[g], MFEMMesh) and parent[g].enabled]
+        if len(children) == 0:
+            return False
+
+        p_method = self.get_partitiong_method()
+        for child in children:
+            srefines = [child[x]
+                        for x in child if child[x].isSerialRefinement]
+            gens = [child[k] for k in child.keys()
+                    if child[k].enabled and child[k].isMeshGenerator]
+            if len(gens) == 0:
+                return False
+            for o in gens:
+                cache = get_partition_cache(o, srefines, p_method,
+                                            MPI.COMM_WORLD)
+                if cache is None or not cache.exists():
+                    return False
+        return True
+
+    def run_preprocess_on_root(self):
+        '''
+        load serial mesh and run preprocess only on rank 0. other ranks
+        receive model node attributes set by preprocess. If they can not
+        be sent, False is returned on other ranks, which then need to
+        run preprocess by themselves.
+        '''
+        from mpi4py import MPI
+        from petram.mesh.partition_cache import (snapshot_model_state,
+                                                 dumps_preprocess_state,
+                                                 loads_preprocess_state)
+        comm = MPI.COMM_WORLD
+
+        data = None
+        if comm.rank == 0:
+            snapshot = snapshot_model_state(self.model)
+            self.run_mesh_serial(skip_refine=True)
+            self.run_preprocess()  # this must run when mesh is serial
+            extra = (self.emesh_data, self.max_bdrattr, self.max_attr)
+            data = dumps_preprocess_state(self.model, snapshot, extra)
+            snapshot = None
+        data = comm.bcast(data, root=0)
+        if data is None:
+            return comm.rank == 0
+
+        if comm.rank != 0:
+            dprint1("serial mesh is not loaded (using partition cache)")
+            extra = loads_preprocess_state(self.model, data)
+            self.emesh_data, self.max_bdrattr, self.max_attr = extra
+            self.meshes = []
+            self.emeshes = []
+        return True
+
+    @profile_phase("run_mesh")
     def run_mesh(self, meshmodel=None):
         from mpi4py import MPI
         from petram.mesh.mesh_model import MeshFile, MFEMMesh
         from petram.mesh.mesh_extension import MeshExt
         from petram.mesh.mesh_utils import get_extended_connectivity
+        from petram.mesh.partition_cache import get_partition_cache
 
         dprint1("Loading mesh (parallel)")
 
@@ -4052,16 +4224,36 @@ class ParallelEngine(Engine):
                         continue
                     # dprint1(k)
                     if o.isMeshGenerator:
+                        p_method = self.get_partitiong_method()
+
+                        cache = get_partition_cache(o, srefines, p_method,
+                                                    MPI.COMM_WORLD)
+                        if cache is not None and cache.exists():
+                            pmesh, info = cache.load()
+                            self.max_bdrattr = np.max([self.max_bdrattr,
+                                                       info["max_bdrattr"]])
+                            self.max_attr = np.max([self.max_attr,
+                                                    info["max_attr"]])
+                            child.sdim = pmesh.SpaceDimension()
+
+                            self.base_meshes[idx] = pmesh
+                            self.meshes[idx] = self.base_meshes[idx]
+                            target = self.meshes[idx]
+                            continue
+
                         smesh = o.run()
+                        cache_info = {"max_bdrattr": -1, "max_attr": -1}
                         if len(smesh.GetBdrAttributeArray()) > 0:
+                            cache_info["max_bdrattr"] = int(
+                                max(smesh.GetBdrAttributeArray()))
                             self.max_bdrattr = np.max([self.max_bdrattr,
                                                        max(smesh.GetBdrAttributeArray())])
                         if len(smesh.GetAttributeArray()) > 0:
+                            cache_info["max_attr"] = int(
+                                max(smesh.GetAttributeArray()))
                             self.max_attr = np.max([self.max_attr,
                                                     max(smesh.GetAttributeArray())])
 
-                        p_method = self.get_partitiong_method()
-
                         if p_method == 'by attribute':
                             attr = list(smesh.GetAttributeArray()-1)
                             attr_array = mfem.intArray(attr)
@@ -4084,6 +4276,9 @@ class ParallelEngine(Engine):
                         self.meshes[idx] = self.base_meshes[idx]
                         target = self.meshes[idx]
 
+                        if cache is not None:
+                            cache.save(self.base_meshes[idx], cache_info)
+
                         # self.base_meshes[idx] = self.meshes[idx]
                     else:
                         if hasattr(o, 'run') and target is not None:
@@ -4295,6 +4490,9 @@ class ParallelEngine(Engine):
         MPI.COMM_WORLD.Barrier()
 
     def a2A(self, a):   # BilinearSystem to matrix
+        if is_operator_form(a):
+            # partial/element assembly. form is used as an operator
+            return a
         # we dont eliminate essentiaal at this level...
         inta = mfem.intArray()
         m = self.new_matrix()
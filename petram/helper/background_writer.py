@@ -0,0 +1,72 @@
+'''
+   background_writer
+
+   run file writes on a background thread, so that a solver can
+   continue while solution files are written.
+
+   >>> writer = BackgroundWriter()
+   >>> writer.submit(gf.Save, filename, 8)
+   >>> ...
+   >>> writer.wait()     # waits for all writes
+   >>> writer.close()
+
+   tasks are executed in the order of submission. submit blocks when
+   max_pending tasks are waiting, which bounds the memory used by the
+   data kept for pending writes. an exception raised in a task is
+   raised again in the next submit/wait.
+
+   tasks must not make MPI calls (collective MPI-IO etc).
+'''
+import sys
+import threading
+import queue
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('BackgroundWriter')
+
+
+class BackgroundWriter():
+    def __init__(self, max_pending=2):
+        self._queue = queue.Queue(maxsize=max(int(max_pending), 1))
+        self._error = None
+        self._thread = threading.Thread(target=self._run,
+                                        name='petram_writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    func, args, kwargs = task
+                    func(*args, **kwargs)
+            except BaseException:
+                self._error = sys.exc_info()[1]
+                dprint1("background write failed: " + repr(self._error))
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def submit(self, func, *args, **kwargs):
+        self._check_error()
+        if not self._thread.is_alive():
+            assert False, "background writer is closed"
+        self._queue.put((func, args, kwargs))
+
+    def wait(self):
+        self._queue.join()
+        self._check_error()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check_error()
@@ -4,6 +4,8 @@ from functools import reduce
 Utility class to handle BlockMatrix made from scipy-sparse and
 Hypre with the same interface
 '''
+import weakref
+
 import numpy as np
 import scipy
 from scipy.sparse import coo_matrix, spmatrix, lil_matrix, csc_matrix
@@ -22,6 +24,8 @@ else:
     default_kind = 'scipy'
 
 from petram.solver.solver_utils import make_numpy_coo_matrix
+from petram.helper.operator_block import (OperatorBlock,
+                                          EliminatedOperatorBlock)
 from petram.helper.matrix_file import write_coo_matrix, write_vector
 
 import petram.debug as debug
@@ -85,67 +89,106 @@ class ScipyCoo(coo_matrix):
 
     def __add__(self, other):
         ret = super(ScipyCoo, self).__add__(other)
+        if ret is NotImplemented:
+            return ret
         return convert_to_ScipyCoo(ret)
 
     def __sub__(self, other):
         ret = super(ScipyCoo, self).__sub__(other)
+        if ret is NotImplemented:
+            return ret
         return convert_to_ScipyCoo(ret)
 
-    def setDiag(self, idx, value=1.0):
+    def _positions(self, kind, dofs):
+        '''
+        positions (in data) of entries in rows/columns given by dofs.
+          kind = 'row' : row in dofs
+                 'col' : col in dofs
+                 'diag' : row in dofs and col == row
+                 'col0' : row in dofs and col == 0
+
+        The result is cached while the sparsity pattern (row/col
+        arrays) is unchanged, so repeated BC elimination does not
+        search the matrix again.
+        '''
+        cache = self.__dict__.get('_pos_cache', None)
+        if (cache is None or cache[0][0]() is not self.row or
+                cache[0][1]() is not self.col):
+            cache = ((weakref.ref(self.row), weakref.ref(self.col)), {})
+            self._pos_cache = cache
+        key = (kind, dofs.tobytes())
+        if key in cache[1]:
+            return cache[1][key]
+
+        if kind == 'col':
+            flag = np.zeros(self.shape[1], dtype=bool)
+            flag[dofs] = True
+            mask = flag[self.col]
+        else:
+            flag = np.zeros(self.shape[0], dtype=bool)
+            flag[dofs] = True
+            mask = flag[self.row]
+            if kind == 'diag':
+                mask = np.logical_and(mask, self.row == self.col)
+            elif kind == 'col0':
+                mask = np.logical_and(mask, self.col == 0)
+        pos = np.flatnonzero(mask)
+
+        if len(cache[1]) > 8:
+            cache[1].clear()
+        cache[1][key] = pos
+        return pos
+
+    def _assign(self, kind, rows, value):
+        '''
+        set value to (rows, rows) (kind='diag') or (rows, 0) (kind='col0').
+        existing entries are overwritten in place. entries not in the
+        sparsity pattern are appended.
+        '''
+        if not self.has_canonical_format:
+            self.sum_duplicates()
+
+        rows = np.asarray(rows, dtype=int).ravel()
+        value = np.broadcast_to(np.asarray(value).ravel(), rows.shape)
+        if np.iscomplexobj(value) and not np.iscomplexobj(self.data):
+            self.data = self.data.astype(np.result_type(self.data, value))
+
+        pos = self._positions(kind, rows)
+
+        table = np.zeros(self.shape[0], dtype=self.data.dtype)
+        table[rows] = value
+        self.data[pos] = table[self.row[pos]]
+
+        found = np.zeros(self.shape[0], dtype=bool)
+        found[self.row[pos]] = True
+        missing = np.unique(rows[np.logical_not(found[rows])])
+        if len(missing) > 0:
+            if kind == 'diag':
+                cols = missing
+            else:
+                cols = np.zeros(len(missing), dtype=missing.dtype)
+            self.data = np.hstack((self.data, table[missing]))
+            self.row = np.hstack((self.row, missing.astype(self.row.dtype)))
+            self.col = np.hstack((self.col, cols.astype(self.col.dtype)))
+            self.has_canonical_format = False
 
-        ret = self.tolil()
-        idx = np.array(idx, dtype=int, copy=False)
-        ret[idx, idx] = value
-        # for i in idx:
-        #   ret[i,i] = value
-        ret = ret.tocoo()
-        self.data = ret.data
-        self.row = ret.row
-        self.col = ret.col
-    '''
-    def resetDiagImag(self, idx):
-        ret = self.tolil()
-
-        for i in idx:
-           ret[i,i] = ret[i,i].real
-        ret = ret.tocoo()
-        self.data = ret.data
-        self.row  = ret.row
-        self.col  = ret.col
-    '''
+    def setDiag(self, idx, value=1.0):
+        self._assign('diag', idx, value)
 
     def resetRow(self, rows, inplace=True):
-        rows = np.array(rows, dtype=int, copy=False)
-        #ret = self.tolil()
-        #ret[rows, :] = 0.0
-        #ret.data[np.in1d(ret.row in rows)] = 0.0
-        ret = self.tocsr()
-        ret[rows, :] = ret[rows, :] * 0.0
-        ret = ret.tocoo()
-
-        if inplace:
-            self.data = ret.data
-            self.row = ret.row
-            self.col = ret.col
-            return self
-        else:
-            return ret
+        rows = np.asarray(rows, dtype=int)
+        pos = self._positions('row', rows)
+        ret = self if inplace else self.copy()
+        # entries are kept as explicit zeros (sparsity does not change)
+        ret.data[pos] = 0.0
+        return ret
 
     def resetCol(self, cols, inplace=True):
-        cols = np.array(cols, dtype=int, copy=False)
-        #ret.data[np.in1d(ret.col in cols)] = 0.0
-        #ret = self.tolil()
-        ret = self.tocsc()
-        ret[:, cols] = ret[:, cols] * 0.0
-        ret = ret.tocoo()
-
-        if inplace:
-            self.data = ret.data
-            self.row = ret.row
-            self.col = ret.col
-            return self
-        else:
-            return ret
+        cols = np.asarray(cols, dtype=int)
+        pos = self._positions('col', cols)
+        ret = self if inplace else self.copy()
+        ret.data[pos] = 0.0
+        return ret
 
     def selectRows(self, nonzeros):
         m = self.tocsr()
@@ -256,10 +299,10 @@ class ScipyCoo(coo_matrix):
 
         Note: policy is controled from engine::filL_BCeliminate_matrix
         '''
-        print("inplace flag off copying matrix")
         # A + Ae style elimination
-        idx = np.in1d(self.col, tdof)
-        idx2 = np.in1d(self.row, tdof)
+        tdof = np.asarray(tdof, dtype=int)
+        if not self.has_canonical_format:
+            self.sum_duplicates()
 
         if diagpolicy == 0:
             diagAe = self.diagonal()[tdof] - 1
@@ -268,66 +311,42 @@ class ScipyCoo(coo_matrix):
             diagAe = 0
             diagA = self.diagonal()[tdof]
 
-        aidx = np.logical_or(idx, idx2)
-        #aidx = []
-        AeCol = self.col[aidx]
-        AeRow = self.row[aidx]
-        AeData = self.data[aidx]
-        Ae2 = coo_matrix((AeData, (AeRow, AeCol)),
-                         shape=self.shape, dtype=self.dtype)
-        Ae2c = Ae2.tocsr()
-        Ae2c[tdof, tdof] = diagAe
-        Ae2 = Ae2c.tocoo()
+        aidx = np.union1d(self._positions('row', tdof),
+                          self._positions('col', tdof))
+        Ae2 = ScipyCoo((self.data[aidx], (self.row[aidx], self.col[aidx])),
+                       shape=self.shape, dtype=self.dtype)
+        Ae2.has_canonical_format = True
+        Ae2.setDiag(tdof, diagAe)
 
-        if inplace:
-            target = self
-            target_b = B.tolil()
-        else:
-            target = self.copy()
-            target_b = B.copy().tolil()
-
-        target.data[idx] = 0
-        target.data[idx2] = 0
-        target.eliminate_zeros()
-        lil2 = target.tolil()
-        lil2[tdof, tdof] = diagA
-
-        # if diagpolicy == 1:
-        # target_b[tdof, 0] = target_b[tdof, 0].toarray().flatten() * diagA
-        target_b[tdof, 0] = diagA
+        target = self if inplace else self.copy()
+        # eliminated entries are kept as explicit zeros, so that the
+        # sparsity pattern (and _positions cache) survives the update
+        target.data[aidx] = 0
+        target.setDiag(tdof, diagA)
 
-        coo = lil2.tocoo()
-        target.data = coo.data
-        target.row = coo.row
-        target.col = coo.col
+        target_b = convert_to_ScipyCoo(coo_matrix(B, copy=True))
+        target_b._assign('col0', tdof, diagA)
 
-        coo_b = convert_to_ScipyCoo(target_b)
-
-        return Ae2, target, coo_b
+        return Ae2, target, target_b
 
     def get_elements(self, tdof):
-        slil = self.tolil()
-        value = slil[tdof, :].toarray()
-        return value
+        tdof = np.asarray(tdof, dtype=int)
+        pos = self._positions('row', tdof)
+        uniq, inv = np.unique(tdof, return_inverse=True)
+        lookup = np.zeros(self.shape[0], dtype=int)
+        lookup[uniq] = np.arange(len(uniq))
+        value = np.zeros((len(uniq), self.shape[1]), dtype=self.dtype)
+        np.add.at(value, (lookup[self.row[pos]], self.col[pos]),
+                  self.data[pos])
+        return value[inv.ravel()]
 
     def set_elements(self, tdof, m):
-        slil = self.tolil()
-        slil[tdof, :1] = m
-        coo = slil.tocoo()
-        self.data = coo.data
-        self.row = coo.row
-        self.col = coo.col
+        self._assign('col0', tdof, np.asarray(m)[:, 0]
+                     if np.ndim(m) == 2 else m)
 
     def copy_element(self, tdof, m):
-        mlil = m.tolil()
-        value = mlil[tdof, 0].toarray()
-
-        slil = self.tolil()
-        slil[tdof, :1] = value
-        coo = slil.tocoo()
-        self.data = coo.data
-        self.row = coo.row
-        self.col = coo.col
+        value = convert_to_ScipyCoo(coo_matrix(m)).get_elements(tdof)
+        self._assign('col0', tdof, value[:, 0])
 
 
 def convert_to_ScipyCoo(mat):
@@ -399,6 +418,9 @@ class BlockMatrix(object):
             elif isinstance(v, chypre.CHypreVec):
                 if v.isComplex():
                     self.complex = True
+            elif isinstance(v, (OperatorBlock, EliminatedOperatorBlock)):
+                if v.isComplex():
+                    self.complex = True
             elif v is None:
                 pass
             else:
@@ -1057,7 +1079,7 @@ class BlockMatrix(object):
                         assert False, 'row partitioning is not consistent'
                     roffset[i] = rp[1] - rp[0]
                     if use_parallel and not isinstance(
-                            self[i, j], chypre.CHypreMat):
+                            self[i, j], (chypre.CHypreMat, OperatorBlock)):
                         from mpi4py import MPI
                         myid = MPI.COMM_WORLD.rank
                         if myid != 0:
@@ -1071,7 +1093,7 @@ class BlockMatrix(object):
                         assert False, 'col partitioning is not consistent'
                     coffset[j] = cp[1] - cp[0]
                     if use_parallel and not isinstance(
-                            self[i, j], chypre.CHypreMat):
+                            self[i, j], (chypre.CHypreMat, OperatorBlock)):
                         if myid != 0:
                             coffset[i] = 0
 
@@ -1205,7 +1227,13 @@ class BlockMatrix(object):
             jj = 0
             for j in range(self.shape[1]):
                 if self[i, j] is not None:
-                    if use_parallel:
+                    if isinstance(self[i, j], OperatorBlock):
+                        # partial assembly (FormOperator)
+                        gcsr = self[i, j].get_mfem_operator()
+                        if gcsr[1] is not None:
+                            gcsrm = mfem.ScaledOperator(gcsr[1], -1.)
+                            gcsrm._opr = gcsr[1]
+                    elif use_parallel:
                         if isinstance(self[i, j], chypre.CHypreMat):
                             gcsr = self[i, j]
                             cp = self[i, j].GetColPartArray()
@@ -1326,7 +1354,12 @@ class BlockMatrix(object):
             jfirst = True
             for i in range(self.shape[0]):
                 if self[i, j] is not None:
-                    if use_parallel:
+                    if isinstance(self[i, j], OperatorBlock):
+                        # partial assembly (FormOperator)
+                        gcsa, gcsb = self[i, j].get_mfem_operator()
+                        if gcsb is None:
+                            gcsb = self[i, j].zero_operator()
+                    elif use_parallel:
                         if isinstance(self[i, j], chypre.CHypreMat):
                             gcsr = self[i, j]
                             cp = self[i, j].GetColPartArray()
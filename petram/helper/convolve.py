@@ -100,6 +100,436 @@ def profile_stop(pr, sortby='cumulative'):
     ps.print_stats()
     print((s.getvalue()))
 
+#
+#  spatially indexed assembly
+#
+#  trial quadrature points are stored in a k-d tree, and for each test
+#  element only the trial points within the kernel support are visited.
+#  kernel/coeff are evaluated for all point pairs of a test element at
+#  once and the result is accumulated in COO triplets.
+#
+#  In parallel, each rank sends its trial quadrature data only to the
+#  ranks whose test points (expanded by the support) overlap with it,
+#  and the triplets are sent to the rank owning the test true DoF.
+#
+use_kdtree_assembly = True
+use_batch_kernel = True
+
+
+def _pair_arg(x, sdim):
+    # argument of kernel for one point (old calling convention)
+    return x[0] if sdim == 1 else x
+
+
+def _batch_arg(x, sdim):
+    # argument of kernel for many points (point axis last)
+    return x[:, 0] if sdim == 1 else x.transpose()
+
+
+def eval_on_pairs(func, args, kwargs, sdim):
+    '''
+    evaluate func for many points at once.
+
+    args : list of (npoints, sdim) arrays
+    kwargs : dict of (npoints,) arrays
+
+    func is first called with the point axis as the last axis. The
+    result is spot-checked against the per-point call. If it does
+    not agree (or func can not handle arrays), func is called point
+    by point. None returned from func means no contribution (0).
+
+    returns an array whose first axis is the point axis
+    '''
+    size = len(args[0])
+
+    def eval_one(i):
+        kw = {k: v[i] for k, v in kwargs.items()}
+        ret = func(*[_pair_arg(a[i], sdim) for a in args], **kw)
+        return None if ret is None else np.asarray(ret)
+
+    if use_batch_kernel and size > 1:
+        try:
+            with np.errstate(all='ignore'):
+                val = func(*[_batch_arg(a, sdim) for a in args], **kwargs)
+            val = np.asarray(val)
+            if val.ndim > 0 and val.shape[-1] == size:
+                val = np.moveaxis(val, -1, 0)
+                checks = sorted(set([0, size//2, size-1]))
+                refs = [eval_one(i) for i in checks]
+                if all(ref is not None and ref.shape == val[i].shape and
+                       np.allclose(ref, val[i])
+                       for i, ref in zip(checks, refs)):
+                    return val
+        except Exception:
+            pass
+
+    vals = [eval_one(i) for i in range(size)]
+    ref = [v for v in vals if v is not None]
+    if len(ref) == 0:
+        return np.zeros(size)
+    zero = np.zeros_like(ref[0])
+    return np.array([zero if v is None else v for v in vals])
+
+
+def _kernel_matrix(val, vdim2, vdim1):
+    '''
+    reshape kernel value to (npairs, vdim2, vdim1)
+       scalar : identity (vdim1 == vdim2)
+       vector : vertical (vdim1 == 1) or horizontal (vdim2 == 1)
+    '''
+    if val.ndim == 1:
+        if vdim1 != vdim2:
+            assert False, "scalar kernel needs the same test/trial dimension"
+        return val[:, None, None] * np.eye(vdim1)
+    if val.ndim == 2:
+        if vdim1 == 1:
+            return val[:, :, None]
+        if vdim2 == 1:
+            return val[:, None, :]
+        assert False, "vector kernel needs a scalar test or trial space"
+    return val
+
+
+def collect_quadrature_data(fes, order, domain='all', VDoFtoGTDoF=None):
+    '''
+    quadrature data of elements in fes
+
+    returns dict of
+       X : (N, sdim) points,  W : (N,) weight * detJ
+       E : (N,) element index (0, 1, 2...) in this data
+       S : (N, nd, vdim) shape functions (dof sign applied)
+       dofs : (ne, nd) vdofs (global TrueDoF in parallel). -1 is padding
+    '''
+    mesh = fes.GetMesh()
+    sdim = mesh.SpaceDimension()
+    is_vector = fes.FEColl().Name()[:2] in ['RT', 'ND']
+    vdim = sdim if is_vector else 1
+
+    attrs = mesh.GetAttributeArray()
+    ielements = [i for i in range(fes.GetNE())
+                 if domain == 'all' or attrs[i] in domain]
+
+    nd_max = max([fes.GetFE(i).GetDof() for i in ielements] + [0])
+
+    X = []
+    W = []
+    E = []
+    S = []
+    dofs = np.zeros((len(ielements), nd_max), dtype=int) - 1
+
+    if is_vector:
+        shape = mfem.DenseMatrix()
+    else:
+        shape = mfem.Vector()
+
+    for k, i in enumerate(ielements):
+        fe = fes.GetFE(i)
+        nd = fe.GetDof()
+        eltrans = fes.GetElementTransformation(i)
+        ir = mfem.IntRules.Get(fe.GetGeomType(), order)
+
+        vdofs = np.array(fes.GetElementVDofs(i))
+        sign = np.where(vdofs >= 0, 1, -1)
+        vdofs = np.where(vdofs >= 0, vdofs, -1 - vdofs)
+        if VDoFtoGTDoF is not None:
+            vdofs = VDoFtoGTDoF[vdofs]
+        dofs[k, :nd] = vdofs
+
+        if is_vector:
+            shape.SetSize(nd, vdim)
+        else:
+            shape.SetSize(nd)
+
+        for ii in range(ir.GetNPoints()):
+            ip = ir.IntPoint(ii)
+            eltrans.SetIntPoint(ip)
+            X.append(np.atleast_1d(eltrans.Transform(ip)).copy())
+            W.append(eltrans.Weight() * ip.weight)
+            E.append(k)
+            if is_vector:
+                fe.CalcVShape(eltrans, shape)
+            else:
+                fe.CalcShape(ip, shape)
+            ss = np.zeros((nd_max, vdim))
+            ss[:nd, :] = shape.GetDataArray().reshape(nd, vdim) * sign[:, None]
+            S.append(ss)
+
+    return {"X": np.array(X).reshape(-1, sdim),
+            "W": np.array(W),
+            "E": np.array(E, dtype=int),
+            "S": np.array(S).reshape(-1, nd_max, vdim),
+            "dofs": dofs,
+            "vdim": vdim}
+
+
+def _select_elements(data, isel):
+    '''
+    subset of quadrature data (isel: element index)
+    '''
+    mask = np.isin(data["E"], isel)
+    renum = np.zeros(len(data["dofs"]), dtype=int) - 1
+    renum[isel] = np.arange(len(isel))
+    return {"X": data["X"][mask],
+            "W": data["W"][mask],
+            "E": renum[data["E"][mask]],
+            "S": data["S"][mask],
+            "dofs": data["dofs"][isel],
+            "vdim": data["vdim"]}
+
+
+def _merge_quadrature_data(data_list, sdim, vdim):
+    data_list = [d for d in data_list if d is not None and len(d["W"]) > 0]
+    if len(data_list) == 0:
+        return {"X": np.zeros((0, sdim)), "W": np.zeros(0),
+                "E": np.zeros(0, dtype=int), "S": np.zeros((0, 0, vdim)),
+                "dofs": np.zeros((0, 0), dtype=int), "vdim": vdim}
+
+    nd_max = max([d["dofs"].shape[1] for d in data_list])
+    X = []
+    W = []
+    E = []
+    S = []
+    dofs = []
+    offset = 0
+    for d in data_list:
+        nd = d["dofs"].shape[1]
+        X.append(d["X"])
+        W.append(d["W"])
+        E.append(d["E"] + offset)
+        ss = np.zeros((len(d["W"]), nd_max, vdim), dtype=d["S"].dtype)
+        ss[:, :nd, :] = d["S"]
+        S.append(ss)
+        dd = np.zeros((len(d["dofs"]), nd_max), dtype=int) - 1
+        dd[:, :nd] = d["dofs"]
+        dofs.append(dd)
+        offset = offset + len(d["dofs"])
+    return {"X": np.vstack(X), "W": np.hstack(W), "E": np.hstack(E),
+            "S": np.vstack(S), "dofs": np.vstack(dofs), "vdim": vdim}
+
+
+def _element_bbox(data):
+    '''
+    bounding box of each element (ne, sdim) x 2
+    '''
+    ne = len(data["dofs"])
+    sdim = data["X"].shape[1]
+    bmin = np.zeros((ne, sdim)) + np.inf
+    bmax = np.zeros((ne, sdim)) - np.inf
+    np.minimum.at(bmin, data["E"], data["X"])
+    np.maximum.at(bmax, data["E"], data["X"])
+    return bmin, bmax
+
+
+def _element_supports(data, support):
+    '''
+    support radius of each element evaluated at its center.
+    negative value means the support is not limited.
+    '''
+    ne = len(data["dofs"])
+    if support is None:
+        return -np.ones(ne)
+    sdim = data["X"].shape[1]
+    center = np.zeros((ne, sdim))
+    np.add.at(center, data["E"], data["X"])
+    center = center / np.bincount(data["E"], minlength=ne)[:, None]
+    return np.array([support(_pair_arg(c, sdim)) for c in center],
+                    dtype=float)
+
+
+def convolve_kdtree(fes1, fes2, kernel=delta, support=None,
+                    orderinc=5, is_complex=False,
+                    trial_domain='all',
+                    test_domain='all',
+                    verbose=False, coeff=None):
+    '''
+    fill linear operator for convolution
+    \\int phi_test(x) func(x-x', (x+x')/2) phi_trial(x') dx dx'
+
+    (spatially indexed version of convolve1d/convolve2d)
+    '''
+    from scipy.spatial import cKDTree
+    from scipy.sparse import coo_matrix, csr_matrix
+
+    mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex)
+    dtype = mat.dtype
+    shape = mat.shape
+    del mat
+
+    if fes1.GetNE() == 0:
+        assert False, "FESpace does not have element"
+    eltrans1 = fes1.GetElementTransformation(0)
+    fe1 = fes1.GetFE(0)
+    fe2 = fes2.GetFE(0)
+    if (fe1.Space() == mfem.FunctionSpace.rQk):
+        assert False, "not supported"
+    order = fe1.GetOrder() + fe2.GetOrder() + eltrans1.OrderW() + orderinc
+    sdim = fes1.GetMesh().SpaceDimension()
+
+    if USE_PARALLEL:
+        #this is global TrueDoF (offset is not subtracted)
+        P = fes1.Dof_TrueDof_Matrix()
+        P = ToScipyCoo(P).tocsr()
+        VDoFtoGTDoF1 = P.indices
+        P = fes2.Dof_TrueDof_Matrix()
+        P = ToScipyCoo(P).tocsr()
+        VDoFtoGTDoF2 = P.indices
+    else:
+        VDoFtoGTDoF1 = None
+        VDoFtoGTDoF2 = None
+
+    test = collect_quadrature_data(fes2, order, domain=test_domain,
+                                   VDoFtoGTDoF=VDoFtoGTDoF2)
+    trial = collect_quadrature_data(fes1, order, domain=trial_domain,
+                                    VDoFtoGTDoF=VDoFtoGTDoF1)
+    vdim1 = trial["vdim"]
+    vdim2 = test["vdim"]
+    supports = _element_supports(test, support)
+
+    if USE_PARALLEL:
+        # (1) exchange bounding box of test points expanded by support
+        if len(test["W"]) == 0:
+            box = None
+        elif np.any(supports < 0):
+            box = (np.zeros(sdim) - np.inf, np.zeros(sdim) + np.inf)
+        else:
+            bmin, bmax = _element_bbox(test)
+            box = (np.min(bmin - supports[:, None], 0),
+                   np.max(bmax + supports[:, None], 0))
+        boxes = comm.allgather(box)
+
+        # (2) send trial data only to ranks which need it
+        bmin, bmax = _element_bbox(trial)
+        senddata = []
+        for box in boxes:
+            if box is None or len(trial["W"]) == 0:
+                senddata.append(None)
+                continue
+            flag = np.logical_and(np.all(bmax >= box[0], 1),
+                                  np.all(bmin <= box[1], 1))
+            isel = np.where(flag)[0]
+            senddata.append(_select_elements(trial, isel)
+                            if len(isel) > 0 else None)
+        trial = _merge_quadrature_data(comm.alltoall(senddata), sdim, vdim1)
+
+    # (3) compute elmats for each test element
+    if verbose:
+        dprint1("number of test/trial points",
+                len(test["W"]), len(trial["W"]))
+
+    rows = []
+    cols = []
+    data = []
+    npairs = 0
+
+    if len(trial["W"]) > 0:
+        tree = cKDTree(trial["X"])
+        scale = np.max(np.abs(trial["X"])) + 1.0
+        X1 = trial["X"]
+        W1 = trial["W"]
+        E1 = trial["E"]
+        S1 = trial["S"]
+        dofs1 = trial["dofs"]
+        N1 = len(W1)
+
+        test_idx = np.argsort(test["E"], kind='stable')
+        starts = np.searchsorted(test["E"][test_idx],
+                                 np.arange(len(test["dofs"])+1))
+
+        for k in range(len(test["dofs"])):
+            ip2 = test_idx[starts[k]:starts[k+1]]
+            X2 = test["X"][ip2]
+            S2 = test["S"][ip2] * test["W"][ip2][:, None, None]
+            dofs2 = test["dofs"][k]
+            su = supports[k]
+
+            if su >= 0:
+                near = tree.query_ball_point(X2, su + 1e-12*scale)
+                p = np.hstack([np.zeros(len(x), dtype=int) + i
+                               for i, x in enumerate(near)])
+                q = np.hstack([np.array(x, dtype=int) for x in near])
+            else:
+                p = np.repeat(np.arange(len(X2)), N1)
+                q = np.tile(np.arange(N1), len(X2))
+            if len(q) == 0:
+                continue
+            npairs = npairs + len(q)
+
+            x2 = X2[p]
+            x1 = X1[q]
+            mid = (x2 + x1)/2.0
+            val = eval_on_pairs(kernel, [x2 - x1, mid], {"w": W1[q]}, sdim)
+            val = _kernel_matrix(val.astype(dtype, copy=False), vdim2, vdim1)
+            if coeff is not None:
+                c = eval_on_pairs(coeff, [mid], {}, sdim)
+                val = val * c.reshape(-1, 1, 1)
+            val = val * W1[q][:, None, None]
+
+            # (npairs, nd1, vdim2) -> (npairs, nd2, nd1)
+            G = np.einsum('pik,pbk->pbi', val, S1[q])
+            C = np.einsum('pai,pbi->pab', S2[p], G)
+
+            # sum over pairs sharing the same trial element
+            e1 = E1[q]
+            order1 = np.argsort(e1, kind='stable')
+            e1 = e1[order1]
+            ee, seg = np.unique(e1, return_index=True)
+            C = np.add.reduceat(C[order1], seg, axis=0)
+
+            r = np.broadcast_to(dofs2[None, :, None], C.shape)
+            c = np.broadcast_to(dofs1[ee][:, None, :], C.shape)
+            flag = np.logical_and(np.logical_and(r >= 0, c >= 0), C != 0)
+            rows.append(r[flag])
+            cols.append(c[flag])
+            data.append(C[flag])
+
+    if verbose:
+        dprint1("number of point pairs", npairs)
+
+    if len(rows) > 0:
+        rows = np.hstack(rows)
+        cols = np.hstack(cols)
+        data = np.hstack(data).astype(dtype, copy=False)
+    else:
+        rows = np.zeros(0, dtype=int)
+        cols = np.zeros(0, dtype=int)
+        data = np.zeros(0, dtype=dtype)
+
+    if USE_PARALLEL:
+        # (4) send triplets to the rank owning the test TrueDoF
+        myoffset = fes2.GetMyTDofOffset()
+        offsets = np.array(comm.allgather(myoffset))
+        owner = np.searchsorted(offsets, rows, side='right') - 1
+        senddata = []
+        for i in range(nprc):
+            idx = np.where(owner == i)[0]
+            senddata.append((rows[idx], cols[idx], data[idx]))
+        recvdata = comm.alltoall(senddata)
+        rows = np.hstack([x[0] for x in recvdata]) - myoffset
+        cols = np.hstack([x[1] for x in recvdata])
+        data = np.hstack([x[2] for x in recvdata]).astype(dtype, copy=False)
+
+        mat = coo_matrix((data, (rows, cols)), shape=shape).tocsr()
+        if is_complex:
+            m1 = csr_matrix(mat.real, dtype=float)
+            m2 = csr_matrix(mat.imag, dtype=float)
+        else:
+            m1 = csr_matrix(mat.real, dtype=float)
+            m2 = None
+        from mfem.common.chypre import CHypreMat
+        start_col = fes1.GetMyTDofOffset()
+        end_col = fes1.GetMyTDofOffset() + fes1.GetTrueVSize()
+        col_starts = [start_col, end_col, shape[1]]
+        M = CHypreMat(m1, m2, col_starts=col_starts)
+    else:
+        from petram.helper.block_matrix import convert_to_ScipyCoo
+
+        mat = coo_matrix((data, (rows, cols)), shape=shape, dtype=dtype)
+        mat.sum_duplicates()
+        M = convert_to_ScipyCoo(mat)
+
+    return M
+
+
 def convolve1d(fes1, fes2, kernel=delta, support=None,
                orderinc=5, is_complex=False,
                trial_domain='all',
@@ -109,6 +539,13 @@ def convolve1d(fes1, fes2, kernel=delta, support=None,
     fill linear operator for convolution
     \int phi_test(x) func(x-x') phi_trial(x') dx
     '''
+    if use_kdtree_assembly:
+        return convolve_kdtree(fes1, fes2, kernel=kernel, support=support,
+                               orderinc=orderinc, is_complex=is_complex,
+                               trial_domain=trial_domain,
+                               test_domain=test_domain,
+                               verbose=verbose, coeff=coeff)
+
     mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex)
 
     eltrans1 = fes1.GetElementTransformation(0)
@@ -401,6 +838,13 @@ def convolve2d(fes1, fes2, kernel=delta, support=None,
         ScalarFE, VectorFE   : func is vector (horizontal)
         VectorFE, VectorFE   : func matrix
     '''
+    if use_kdtree_assembly:
+        return convolve_kdtree(fes1, fes2, kernel=kernel, support=support,
+                               orderinc=orderinc, is_complex=is_complex,
+                               trial_domain=trial_domain,
+                               test_domain=test_domain,
+                               verbose=verbose, coeff=coeff)
+
     mat, rstart = get_empty_map(fes2, fes1, is_complex=is_complex)
 
     if fes1.GetNE() == 0:
@@ -358,6 +358,63 @@ def redistribute_external_entry(external_entry, rstart):
     external_entry = sum(comm.alltoall(data), [])
     return np.array(external_entry)
 
+class DofPointMatcher(object):
+    '''
+    find DoF points of destination element matching with source DoF
+    points.
+
+    destination points of all elements are stored in a k-d tree, and
+    points within tol * (typical element size) are queried at once.
+    among the candidates on the mapped element, the closest ones are
+    returned (more than one when DoFs sit at the same place). If no
+    candidate is found in the tolerance, all points on the element
+    are checked.
+    '''
+
+    def __init__(self, pt1all, pt2all, map_1_2, tol):
+        from scipy.spatial import cKDTree
+
+        pts = [np.atleast_2d(x) for x in pt2all if len(x) > 0]
+        self.owner = np.hstack([np.zeros(len(x), dtype=int) + i
+                                for i, x in enumerate(pt2all)] +
+                               [np.zeros(0, dtype=int)])
+        self.local = np.hstack([np.arange(len(x)) for x in pt2all] +
+                               [np.zeros(0, dtype=int)])
+        if len(pts) == 0:
+            self.candidates = [[] for x in pt1all]
+            return
+
+        pts = np.vstack(pts)
+        size = np.median([np.max(np.ptp(np.atleast_2d(x), 0))
+                          for x in pt2all if len(x) > 0])
+        radius = tol * size if size > 0 else tol
+
+        tree = cKDTree(pts)
+        pt1 = [np.atleast_2d(x) for x in pt1all if len(x) > 0]
+        if len(pt1) > 0:
+            found = tree.query_ball_point(np.vstack(pt1), radius)
+        else:
+            found = []
+
+        self.candidates = []
+        jj = 0
+        for k0, x in enumerate(pt1all):
+            k2 = map_1_2[k0]
+            cc = []
+            for j in range(len(x)):
+                idx = np.array(found[jj], dtype=int)
+                cc.append(self.local[idx[self.owner[idx] == k2]])
+                jj = jj + 1
+            self.candidates.append(cc)
+
+    def match(self, k0, k, p, pt2):
+        cand = self.candidates[k0][k]
+        if len(cand) == 0:
+            cand = np.arange(len(pt2))
+        dist = np.sum((pt2[cand]-p)**2, 1)
+        return cand[np.where(dist == np.min(dist))[0]]
+
+
 def map_dof_scalar(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
                    k1all, k2all, sh1all, sh2all, map_1_2,
                    trans1, trans2, tol, tdof, rstart):
@@ -365,9 +422,15 @@ def map_dof_scalar(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
     dprint1("map_dof_scalar1", debug.format_memory_usage())
 
     pt = []
-    subvdofs1 = []
     subvdofs2 = []
 
+    # rows already filled (visited) and rows to skip (tdof)
+    visited = np.zeros(map.shape[0], dtype=bool)
+    tdof = set(tdof)
+    rows = []
+    cols = []
+    values = []
+
     num_entry = 0
     num_pts = 0
 
@@ -380,7 +443,9 @@ def map_dof_scalar(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
         # this is global TrueDoF (offset is not subtracted)
         VDoFtoGTDoF = P.indices
         external_entry = []
-        gtdof_check = []
+        gtdof_check = set()
+
+    matcher = DofPointMatcher(pt1all, pt2all, map_1_2, tol)
 
     for k0 in range(len(pt1all)):
         k2 = map_1_2[k0]
@@ -395,20 +460,13 @@ def map_dof_scalar(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
         for k, p in enumerate(pt1):
             num_pts = num_pts + 1
 
-            # if newk1[k,2] in tdof: continue
-            iii = bisect.bisect_left(tdof, newk1[k, 2])
-            if iii != len(tdof) and tdof[iii] == newk1[k, 2]:
+            if newk1[k, 2] in tdof:
                 continue
-
-            # if newk1[k,2] in subvdofs1: continue
-            iii = bisect.bisect_left(subvdofs1, newk1[k, 2])
-            if iii != len(subvdofs1) and subvdofs1[iii] == newk1[k, 2]:
+            if newk1[k, 2] != -1 and visited[newk1[k, 2]-rstart]:
                 continue
+
             #print("maping points", pt1, pt2)
-            dist = np.sum((pt2-p)**2, 1)
-            d = np.where(dist == np.min(dist))[0]
-            if myid == 1:
-                dprint2('min_dist', np.min(dist))
+            d = matcher.match(k0, k, p, pt2)
 
             if len(d) == 1:
                 d = d[0]
@@ -427,11 +485,11 @@ def map_dof_scalar(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
                     # where the edge segment is randomly oriented....
                     if (newk2[d][1]+0.5)*(newk1[k][1]+0.5) < 0:
                         value *= -1
-                    map[newk1[k][2]-rstart,
-                        newk2[d][2]] = value
+                    rows.append(newk1[k][2]-rstart)
+                    cols.append(newk2[d][2])
+                    values.append(value)
                     num_entry = num_entry + 1
-                    bisect.insort_left(subvdofs1, newk1[k][2])
-                    # subvdofs1.append(newk1[k][2])
+                    visited[newk1[k][2]-rstart] = True
                 else:
                     # for scalar, this is perhaps not needed
                     # rr = newk1[k][1]] if newk1[k][1]] >= 0 else -1-newk1[k][1]]
@@ -440,7 +498,7 @@ def map_dof_scalar(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
                     gtdof = VDoFtoGTDoF[newk1[k][1]]
                     if not gtdof in gtdof_check:
                         external_entry.append((gtdof, newk2[d][2], value))
-                        gtdof_check.append(gtdof)
+                        gtdof_check.add(gtdof)
             else:
                 print("failed to map points", pt1, pt2)
                 raise AssertionError(
@@ -448,6 +506,10 @@ def map_dof_scalar(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
         #subvdofs1.extend([s for k, v, s in newk1])
         subvdofs2.extend([s for k, v, s in newk2])
 
+    if len(rows) > 0:
+        map[rows, cols] = values
+    subvdofs1 = np.where(visited)[0] + rstart
+
     dprint1("map_dof_scalar2", debug.format_memory_usage())
 
     if use_parallel:
@@ -504,9 +566,14 @@ def map_dof_vector(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
     dprint1("map_dof_vector1", debug.format_memory_usage())
 
     pt = []
-    subvdofs1 = []
     subvdofs2 = []
 
+    # rows already filled (visited)
+    visited = np.zeros(map.shape[0], dtype=bool)
+    rows = []
+    cols = []
+    values = []
+
     num1 = 0
     num2 = 0
     num_pts = 0
@@ -519,17 +586,18 @@ def map_dof_vector(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
         P1mat = ToScipyCoo(P).tocsr()
         # this is global TrueDoF (offset is not subtracted)
         external_entry = []
-        gtdof_check = []
+        gtdof_check = set()
 
     def make_entry(r, c, value, num_entry):
         value = np.around(value, decimals)
         if value == 0:
             return num_entry
         if r[1] != -1:
-            map[r[1]-rstart, c] = value
+            rows.append(r[1]-rstart)
+            cols.append(c)
+            values.append(value)
             num_entry = num_entry + 1
-            bisect.insort_left(subvdofs1, r[1])
-            # subvdofs1.append(r[1])
+            visited[r[1]-rstart] = True
         else:
             rr = r[0] if r[0] >= 0 else -1-r[0]
             gtdofs = P1mat.indices[P1mat.indptr[rr]:P1mat.indptr[rr+1]]
@@ -537,11 +605,12 @@ def map_dof_vector(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
             for gtdof, w in zip(gtdofs, weights):
                 if not gtdof in gtdof_check:
                     external_entry.append((gtdof, c, value*w))
-                    gtdof_check.append(gtdof)
+                    gtdof_check.add(gtdof)
 
         return num_entry
 
-    tdof = sorted(tdof)
+    tdof = set(tdof)
+    matcher = DofPointMatcher(pt1all, pt2all, map_1_2, tol)
 
     for k0 in range(len(pt1all)):
         k2 = map_1_2[k0]
@@ -559,18 +628,12 @@ def map_dof_vector(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
             # if idx[k]: continue
             num_pts = num_pts + 1
 
-            # if newk1[k,2] in tdof: continue
-            iii = bisect.bisect_left(tdof, newk1[k, 2])
-            if iii != len(tdof) and tdof[iii] == newk1[k, 2]:
+            if newk1[k, 2] in tdof:
                 continue
-
-            # if newk1[k,2] in subvdofs1: continue
-            iii = bisect.bisect_left(subvdofs1, newk1[k, 2])
-            if iii != len(subvdofs1) and subvdofs1[iii] == newk1[k, 2]:
+            if newk1[k, 2] != -1 and visited[newk1[k, 2]-rstart]:
                 continue
 
-            dist = np.sum((pt2-p)**2, 1)
-            d = np.where(dist == np.min(dist))[0]
+            d = matcher.match(k0, k, p, pt2)
 
             #if myid == 1: dprint1('min_dist', np.min(dist))
             if len(d) == 1:
@@ -768,6 +831,10 @@ def map_dof_vector(map, fes1, fes2, pt1all, pt2all, pto1all, pto2all,
                 raise AssertionError("more than three dofs at same place")
         subvdofs2.extend([s for k, v, s in newk2])
 
+    if len(rows) > 0:
+        map[rows, cols] = values
+    subvdofs1 = np.where(visited)[0] + rstart
+
     dprint1("map_dof_vector2", debug.format_memory_usage())
     num_entry = num1 + num2
 
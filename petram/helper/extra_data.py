@@ -0,0 +1,160 @@
+'''
+   extra_data
+
+   read/write extra data (Lagrange multipliers and other extra DoFs,
+   sol_extra[name][key] = ndarray) saved together with solution.
+
+   version 2 (binary):
+      #PetraM extra data : 2\n
+      {"entries": [{"name":, "key":, "dtype":, "shape":, "offset":}]}\n
+      (padding) followed by raw arrays. offset is measured from the
+      first array, which starts at a multiple of data_alignment.
+
+   version 1 (text):
+      name : <name>.<key>
+      size : <size>
+      dim : <ndim>
+      dtype: <dtype>
+      0 <value>
+      1 <value>
+      ...
+'''
+import os
+import json
+
+import numpy as np
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('ExtraData')
+
+magic = '#PetraM extra data'
+extra_data_version = 2
+data_alignment = 64
+
+
+def _aligned(x):
+    return ((x + data_alignment - 1) // data_alignment) * data_alignment
+
+
+def write_extra_data(filename, sol_extra, version=extra_data_version):
+    '''
+    write sol_extra to file. the file is written to a temporary file
+    and renamed, so that arrays memory-mapped from the old file stay
+    valid.
+    '''
+    if version == 1:
+        return write_extra_data_text(filename, sol_extra)
+
+    entries = []
+    arrays = []
+    offset = 0
+    for name in sol_extra.keys():
+        for k in sol_extra[name].keys():
+            # (ascontiguousarray would turn 0-dim array to 1-dim)
+            data = np.require(sol_extra[name][k], requirements="C")
+            entries.append({"name": name,
+                            "key": str(k),
+                            "dtype": data.dtype.str,
+                            "shape": list(data.shape),
+                            "offset": offset})
+            arrays.append(data)
+            offset = _aligned(offset + data.nbytes)
+
+    header = (magic + ' : ' + str(version) + '\n' +
+              json.dumps({"entries": entries}) + '\n').encode()
+
+    tmp = filename + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'wb') as fid:
+        fid.write(header)
+        start = _aligned(len(header))
+        for e, data in zip(entries, arrays):
+            fid.write(b'\0' * (start + e["offset"] - fid.tell()))
+            fid.write(data.tobytes())
+    os.replace(tmp, filename)
+
+
+def write_extra_data_text(filename, sol_extra):
+    fid = open(filename, 'w')
+    for name in sol_extra.keys():
+        for k in sol_extra[name].keys():
+            data = sol_extra[name][k]
+            #  data must be NdArray
+            #  dataname : "E1.E_out"
+            fid.write('name : ' + name + '.' + str(k) + '\n')
+            fid.write('size : ' + str(data.size) + '\n')
+            fid.write('dim : ' + str(data.ndim) + '\n')
+            fid.write('dtype: ' + str(data.dtype) + '\n')
+            if data.ndim == 0:
+                fid.write(str(0) + ' ' + str(data) + '\n')
+            else:
+                for kk, d in enumerate(data.flatten()):
+                    fid.write(str(kk) + ' ' + str(d) + '\n')
+    fid.close()
+
+
+def read_extra_data(filename, mmap=True):
+    '''
+    read extra data file (binary or text)
+
+    in the binary format, arrays are memory-mapped copy-on-write
+    (mmap=True), so that they can be modified without affecting the
+    file.
+    '''
+    with open(filename, 'rb') as fid:
+        line = fid.readline()
+        if not line.startswith(magic.encode()):
+            return read_extra_data_text(filename)
+
+        version = int(line.decode().split(':')[-1])
+        if version > extra_data_version:
+            assert False, ("unsupported extra data version " + str(version))
+        header = json.loads(fid.readline().decode())
+        start = _aligned(fid.tell())
+
+    sol_extra = {}
+    entries = header["entries"]
+    if len(entries) == 0:
+        return sol_extra
+
+    if mmap:
+        buf = np.memmap(filename, dtype=np.uint8, mode='c')
+    else:
+        with open(filename, 'rb') as fid:
+            buf = np.frombuffer(fid.read(), dtype=np.uint8)
+
+    for e in entries:
+        dtype = np.dtype(e["dtype"])
+        shape = tuple(e["shape"])
+        nbytes = int(np.prod(shape, dtype=int)) * dtype.itemsize
+        st = start + e["offset"]
+        data = buf[st:st + nbytes].view(dtype).reshape(shape)
+        if e["name"] not in sol_extra:
+            sol_extra[e["name"]] = {}
+        sol_extra[e["name"]][e["key"]] = data
+    return sol_extra
+
+
+def read_extra_data_text(filename):
+    sol_extra = {}
+    fid = open(filename, 'r')
+    line = fid.readline()
+    while line:
+        if line.startswith('name'):
+            name, name2 = line.split(':')[1].strip().split('.')
+            if not name in sol_extra:
+                sol_extra[name] = {}
+        size = int(fid.readline().split(':')[1].strip())
+        dim = int(fid.readline().split(':')[1].strip())
+        dtype = fid.readline().split(':')[1].strip()
+        if dtype.startswith('complex'):
+            data = [complex(fid.readline().split(' ')[1])
+                    for k in range(size)]
+            data = np.array(data, dtype=dtype)
+        else:
+            data = [float(fid.readline().split(' ')[1])
+                    for k in range(size)]
+            data = np.array(data, dtype=dtype)
+        sol_extra[name][name2] = data
+        line = fid.readline()
+    fid.close()
+    return sol_extra
@@ -0,0 +1,412 @@
+'''
+   numba_cache
+
+   content-addressed cache of NumbaCoefficients generated from
+   expression text (see _expr_to_numba_coeff)
+
+   key is made from
+      expression text, ind_vars, return type, dependency signature,
+      scale, conj and extra options given to jitter.
+
+   memory cache:
+      keeps the NumbaCoefficient for the same key and the same
+      dependency objects. Entries are weakly referenced and go away
+      together with the coefficient (and its dependencies).
+
+   disk cache:
+      per-user store (mfem_config.numba_cache_dir). The generated
+      _func_ wrapper and the C caller are written to a module file
+      named by the key, and compiled with numba cache=True. numba
+      keeps the machine code next to it (__pycache__), so later runs,
+      MPI ranks and evaluator workers load it instead of compiling.
+      Dependency coefficients are passed to the compiled caller at run
+      time, so the same code is bound to the dependency objects of
+      each process when it is loaded.
+'''
+import os
+import sys
+import types
+import hashlib
+from weakref import WeakValueDictionary as WVD
+
+import numpy as np
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('NumbaCache')
+
+cache_version = 2
+
+
+def simple_value_signature(v):
+    '''
+    hashable signature of a plain value (number, string, array and
+    list/tuple of them). returns None for other objects.
+    '''
+    if v is None or isinstance(v, (bool, int, float, complex, str)):
+        return repr(v)
+    if isinstance(v, np.ndarray):
+        return ("ndarray", v.dtype.str, v.shape,
+                hashlib.sha1(np.ascontiguousarray(v).tobytes()).hexdigest())
+    if isinstance(v, (np.integer, np.floating, np.complexfloating)):
+        return repr(v.item())
+    if isinstance(v, (list, tuple)):
+        ret = [simple_value_signature(x) for x in v]
+        if any([x is None for x in ret]):
+            return None
+        return tuple(ret)
+    return None
+
+
+def dependency_signature(dep):
+    '''
+    signature of a dependency passed to jitter.
+    returns (signature used in key, objects identifying it in memory)
+    '''
+    if isinstance(dep, tuple):
+        sigs = [dependency_signature(x) for x in dep]
+        return (tuple([x[0] for x in sigs]),
+                sum([x[1] for x in sigs], ()))
+
+    sig = [dep.__class__.__name__]
+    for m in ('IsOutComplex', 'GetNDim', 'GetVDim', 'GetHeight', 'GetWidth'):
+        if hasattr(dep, m):
+            try:
+                sig.append(getattr(dep, m)())
+            except BaseException:
+                pass
+    return tuple(sig), (dep,)
+
+
+def _version_signature():
+    ret = [sys.version.split()[0]]
+    for mod in ('numba', 'mfem'):
+        try:
+            m = __import__(mod)
+            ret.append(getattr(m, '__version__', ''))
+        except ImportError:
+            ret.append('')
+    return tuple(ret)
+
+
+def content_key(*items):
+    '''
+    sha256 of items (repr) together with cache version and versions of
+    python, numba and mfem
+    '''
+    text = repr((cache_version, items, _version_signature()))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _is_library_object(v):
+    '''
+    True if v is a function of numpy/math/cmath which can be found by
+    its module and name (such as sin imported from numpy)
+    '''
+    mod = getattr(v, '__module__', None)
+    name = getattr(v, '__name__', None)
+    if not isinstance(mod, str) or not isinstance(name, str):
+        return False
+    if mod.split('.')[0] not in ('numpy', 'math', 'cmath'):
+        return False
+    return getattr(sys.modules.get(mod, None), name, None) is v
+
+
+def module_globals(names, skip, g, l):
+    '''
+    globals of the generated module: values of names referred in the
+    expression. they are frozen in the compiled code, and the key
+    covers their values.
+    returns None if a name refers an object which can not be part of
+    the key (such as a user function) or a name in l, which the key
+    and the compiled code would see differently. such expression is
+    not stored.
+    '''
+    ret = {}
+    for n in names:
+        if n in skip:
+            continue
+        if n in l and (n not in g or l[n] is not g[n]):
+            return None
+        if n not in g:
+            continue
+        v = g[n]
+        if isinstance(v, types.ModuleType) or _is_library_object(v):
+            ret[n] = v
+        elif simple_value_signature(v) is not None:
+            ret[n] = v
+        else:
+            return None
+    return ret
+
+
+def get_cache_dir():
+    from petram.mfem_config import get_numba_cache_dir
+    path = get_numba_cache_dir()
+    if path is None or path == '':
+        return None
+    return os.path.expanduser(path)
+
+
+def _write_source(path, src):
+    '''
+    write module file. it is rewritten only when the content differs,
+    since numba invalidates its cache when the file is touched.
+    '''
+    if os.path.exists(path):
+        with open(path, 'r') as fid:
+            if fid.read() == src:
+                return
+    # other MPI ranks may read it. never show a partial file.
+    tmp = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'w') as fid:
+        fid.write(src)
+    os.replace(tmp, path)
+
+
+def _load_module(path, modname, namespace):
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(modname, path)
+    mod = importlib.util.module_from_spec(spec)
+    mod.__dict__.update(namespace)
+    # numba imports the module by name when it loads cached code
+    sys.modules[modname] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class NumbaCoeffCache():
+    def __init__(self):
+        self.memory = WVD()
+        self.compiled = {}    # key -> cfunc (without dependency)
+        self.hits = 0
+        self.cold = 0
+        self.cold_time = 0.0
+        self.warm = 0
+        self.warm_time = 0.0
+        self._reported = None
+
+    def make_key(self, txt, ind_vars, return_type, names, g, l,
+                 dependency, conj, scale, kwargs):
+        '''
+        returns memory key. the first element is the content key used
+        for the disk cache.
+        None is returned if the expression refers a value
+        which can not be used to make a key (such as a user object)
+        '''
+        values = []
+        objs = []
+        for n in names:
+            if n in ind_vars:
+                continue
+            if n in l:
+                v = l[n]
+            elif n in g:
+                v = g[n]
+            else:
+                continue
+            sig = simple_value_signature(v)
+            if sig is None:
+                # modules, functions, Variables.... Variables are covered
+                # by dependency signature. others are identified by name
+                sig = (v.__class__.__name__,
+                       getattr(v, '__module__', ''),
+                       getattr(v, '__qualname__', getattr(v, '__name__', '')))
+                objs.append(v)
+            values.append((n, sig))
+
+        dep_sig = []
+        for d in dependency:
+            sig, o = dependency_signature(d)
+            dep_sig.append(sig)
+            objs.extend(o)
+
+        opts = []
+        for k in sorted(kwargs):
+            sig = simple_value_signature(kwargs[k])
+            if sig is None:
+                return None
+            opts.append((k, sig))
+
+        key = content_key(txt.strip(), tuple(ind_vars), return_type,
+                          tuple(values), tuple(dep_sig), bool(conj),
+                          repr(scale), tuple(opts))
+        return (key, tuple([id(x) for x in objs]))
+
+    def get(self, memory_key):
+        if memory_key is None:
+            return None
+        ret = self.memory.get(memory_key, None)
+        if ret is not None:
+            self.hits += 1
+        return ret
+
+    def put(self, memory_key, coeff):
+        if memory_key is None or coeff is None:
+            return
+        self.memory[memory_key] = coeff
+
+    def compile(self, key, kind, func_txt, namespace, sdim, complex,
+                dependency, shape=None, interface="simple", params=None,
+                debug=False):
+        '''
+        make mfem NumbaCoefficient (kind = scalar, vector or matrix) of
+        _func_ in func_txt through the disk cache. this follows
+        mfem.jit.scalar/vector/matrix, except that the functions are
+        compiled with cache=True.
+
+        returns (coeff, warm). warm is True when the machine code was
+        loaded from the disk. (None, False) when the disk cache is not
+        available.
+        '''
+        cache_dir = get_cache_dir()
+        if cache_dir is None or key is None:
+            return None, False
+
+        from numba import njit, cfunc, carray, farray
+        from numba import types as nbtypes
+        from mfem.common.numba_coefficient_utils import (
+            get_setting,
+            generate_caller_scalar,
+            generate_caller_array,
+            generate_caller_array_oldstyle,
+            generate_signature_scalar,
+            generate_signature_array,
+            generate_signature_array_oldstyle)
+        from petram.mfem_config import use_parallel
+        if use_parallel:
+            import mfem.par as mfem
+        else:
+            import mfem.ser as mfem
+
+        params = {} if params is None else params.copy()
+        params["sdim"] = sdim
+        if kind == 'scalar':
+            outsize = 1
+        else:
+            outsize = shape
+            params["shape"] = shape
+            if kind == 'vector':
+                params["vdim"] = shape[0]
+            else:
+                params["width"] = shape[0]
+                params["height"] = shape[1]
+
+        setting = get_setting(outsize, complex, dependency, False)
+        if kind == 'scalar':
+            sig = generate_signature_scalar(setting)
+            caller_txt = generate_caller_scalar(setting)
+        elif interface == "c++":
+            sig = generate_signature_array_oldstyle(setting)
+            caller_txt = generate_caller_array_oldstyle(setting)
+        else:
+            sig = generate_signature_array(setting)
+            caller_txt = generate_caller_array(setting)
+
+        outtype = nbtypes.complex128 if complex else nbtypes.double
+        if kind == 'scalar':
+            caller_sig = outtype(nbtypes.CPointer(nbtypes.double),
+                                 nbtypes.int32,
+                                 nbtypes.CPointer(nbtypes.voidptr))
+        else:
+            caller_sig = nbtypes.void(nbtypes.CPointer(nbtypes.double),
+                                      nbtypes.int32,
+                                      nbtypes.CPointer(nbtypes.voidptr),
+                                      nbtypes.CPointer(outtype))
+
+        if debug:
+            print("(DEBUG) signature for function:", sig)
+            print("(DEBUG) generated caller function:\n", caller_txt)
+
+        warm = True
+        ff = self.compiled.get(key, None)
+        if ff is None:
+            src = ("# generated by petram.helper.numba_cache. do not edit.\n" +
+                   func_txt + "\n\n\n" + caller_txt + "\n")
+            path = os.path.join(cache_dir, "nbc_" + key + ".py")
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                _write_source(path, src)
+            except OSError:
+                dprint1("numba cache directory is not writable: " + cache_dir)
+                return None, False
+
+            namespace = namespace.copy()
+            namespace.update(params)
+            namespace.update({"np": np, "carray": carray, "farray": farray})
+            mod = _load_module(path, "petram_nbc_" + key, namespace)
+
+            inner = njit(sig, cache=True)(mod._func_)
+            mod.inner_func = inner
+            ff = cfunc(caller_sig, cache=True)(mod._caller)
+            warm = (sum(inner.stats.cache_hits.values()) > 0 and
+                    ff.cache_hits > 0)
+            self.compiled[key] = ff
+
+        if kind == 'scalar':
+            def generate(mode):
+                return mfem.GenerateScalarNumbaCoefficient(ff, False, mode)
+        elif kind == 'vector':
+            def generate(mode):
+                return mfem.GenerateVectorNumbaCoefficient(ff, shape[0],
+                                                           False, mode)
+        else:
+            def generate(mode):
+                return mfem.GenerateMatrixNumbaCoefficient(ff, shape[0],
+                                                           shape[1],
+                                                           False, mode)
+        if complex:
+            coeff = generate(1)
+            coeff.real = generate(1)
+            coeff.imag = generate(2)
+            coeffs = (coeff, coeff.real, coeff.imag)
+        else:
+            coeff = generate(0)
+            coeffs = (coeff, )
+        coeff.SetOutComplex(setting["output"])
+
+        # bind dependency of this process
+        for c in coeffs:
+            c.SetIsDepComplex(setting["isdepcomplex"])
+            c.SetKinds(setting["kinds"])
+            mfem.SetNumbaCoefficientDependency(c,
+                                               setting["s_coeffs"],
+                                               setting["v_coeffs"],
+                                               setting["m_coeffs"],
+                                               setting["ns_coeffs"],
+                                               setting["nv_coeffs"],
+                                               setting["nm_coeffs"])
+            c._dependency_link = dependency
+        return coeff, warm
+
+    def add_compile_time(self, elapsed, warm=False):
+        if warm:
+            self.warm += 1
+            self.warm_time += elapsed
+        else:
+            self.cold += 1
+            self.cold_time += elapsed
+
+    def format_stats(self):
+        return ("numba coefficient cache: hits=" + str(self.hits) +
+                " cold=" + str(self.cold) +
+                " (" + "{:.3f}".format(self.cold_time) + "s)" +
+                " warm=" + str(self.warm) +
+                " (" + "{:.3f}".format(self.warm_time) + "s)")
+
+    def report(self):
+        '''
+        print the stats if they changed since the last report
+        '''
+        stats = (self.hits, self.cold, self.warm)
+        if stats == self._reported or sum(stats) == 0:
+            return
+        self._reported = stats
+        dprint1(self.format_stats())
+
+    def clear(self):
+        self.memory = WVD()
+        self.compiled = {}
+
+
+numba_coeff_cache = NumbaCoeffCache()
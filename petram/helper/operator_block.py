@@ -0,0 +1,490 @@
+'''
+   operator_block
+
+   block element of BlockMatrix for bilinear forms which are not
+   assembled into a matrix (partial assembly (PA) or element assembly
+   (EA)).
+
+   OperatorBlock keeps a sum of c_k * T_k, where T_k is a real operator
+   on true DoFs (BilinearForm, SparseMatrix or HypreParMatrix) and c_k
+   is a complex coefficient (forms of the imaginary part are kept with
+   c_k = 1j). Essential BC elimination is recorded as rows/cols to be
+   reset and diagonal entries to be replaced, and applied when the
+   operator is used.
+
+   It provides the subset of the ScipyCoo/CHypreMat interface used
+   between fill_M_B_blocks and finalize_matrix (+, -, scalar *, dot,
+   eliminate_RowsCols, resetRow, resetCol, setDiag).
+   get_global_blkmat_interleave/merged place FormOperator (a
+   mfem.PyOperator) in the BlockOperator. FormOperator.get_diagonal
+   gives the diagonal used by Jacobi/Chebyshev smoothers.
+'''
+import numpy as np
+
+from petram.mfem_config import use_parallel
+if use_parallel:
+    import mfem.par as mfem
+else:
+    import mfem.ser as mfem
+
+import mfem.common.chypre as chypre
+
+import petram.debug as debug
+dprint1, dprint2, dprint3 = debug.init_dprints('OperatorBlock')
+
+
+def is_operator_form(form):
+    '''
+    True if form is assembled as an operator (PA/EA), not as a matrix
+    '''
+    return getattr(form, '_assembly_level', None) is not None
+
+
+def MatOrForm2PyMat(M1, M2=None):
+    '''
+    MfemMat2PyMat, which also accepts forms assembled as an operator
+    '''
+    from mfem.common.chypre import MfemMat2PyMat
+
+    if ((M1 is not None and is_operator_form(M1)) or
+            (M2 is not None and is_operator_form(M2))):
+        return OperatorBlock.from_forms(M1, M2)
+    return MfemMat2PyMat(M1, M2)
+
+
+def _split_matrix(m):
+    '''
+    ScipyCoo/CHypreMat to [(real operator, coefficient)]
+    '''
+    if isinstance(m, chypre.CHypreMat):
+        ret = []
+        if m[0] is not None:
+            ret.append((m[0], 1.0))
+        if m[1] is not None:
+            ret.append((m[1], 1j))
+        return ret
+
+    from scipy.sparse import csr_matrix
+
+    def sparsemat(csr):
+        mat = mfem.SparseMatrix(csr)
+        mat._linked_csr = csr
+        return mat
+
+    ret = [(sparsemat(csr_matrix(m.real)), 1.0)]
+    if np.iscomplexobj(m):
+        ret.append((sparsemat(csr_matrix(m.imag)), 1j))
+    return ret
+
+
+def _local_array(v):
+    '''
+    local data of a column vector (ScipyCoo/CHypreVec)
+    '''
+    if isinstance(v, chypre.CHypreVec):
+        x = v[0].GetDataArray().copy()
+        if v[1] is not None:
+            x = x + 1j * v[1].GetDataArray()
+        return x
+    return np.asarray(v.toarray()).flatten()
+
+
+def _wrap_array(y):
+    '''
+    column vector (same kind as X in engine) from local data
+    '''
+    if use_parallel:
+        from mfem.common.parcsr_extra import ToHypreParVec
+        if np.iscomplexobj(y):
+            return chypre.CHypreVec(ToHypreParVec(np.ascontiguousarray(y.real)),
+                                    ToHypreParVec(np.ascontiguousarray(y.imag)))
+        return chypre.CHypreVec(ToHypreParVec(np.ascontiguousarray(y)), None)
+
+    from scipy.sparse import coo_matrix
+    from petram.helper.block_matrix import convert_to_ScipyCoo
+    return convert_to_ScipyCoo(coo_matrix(y.reshape(-1, 1)))
+
+
+class FormOperator(mfem.PyOperator):
+    '''
+    real operator on true DoFs
+
+       y = sum_k s_k T_k x, with columns (cols) of x and rows (rows) of
+       y reset, and diagonal entries at didx replaced by dval.
+
+    a form is applied through the prolongation of its FE space.
+    '''
+
+    def __init__(self, terms, size, rows=None, cols=None,
+                 didx=None, dval=None):
+        mfem.PyOperator.__init__(self, size)
+        self._size = size
+        self._terms = []
+        for op, scale in terms:
+            if isinstance(op, mfem.BilinearForm):
+                P = op.FESpace().GetProlongationMatrix()
+                if P is not None:
+                    xl = mfem.Vector(P.Height())
+                    yl = mfem.Vector(P.Height())
+                else:
+                    xl = None
+                    yl = None
+                self._terms.append((op, scale, P, xl, yl))
+            else:
+                self._terms.append((op, scale, None, None, None))
+
+        empty = np.zeros(0, dtype=int)
+        self._rows = empty if rows is None else rows
+        self._cols = empty if cols is None else cols
+        self._didx = empty if didx is None else didx
+        dval = np.zeros(0) if dval is None else dval
+
+        self._x = mfem.Vector(size)    # input of apply
+        self._xc = mfem.Vector(size)   # x with cols reset (x is kept)
+        self._y = mfem.Vector(size)
+        self._diag = None
+
+        if len(self._didx) > 0:
+            current = self._reset_diagonal()
+            self._dcorr = dval - current[self._didx]
+        else:
+            self._dcorr = np.zeros(0)
+
+    def _term_diagonal(self, op, out):
+        if isinstance(op, mfem.BilinearForm):
+            op.AssembleDiagonal(out)
+        else:
+            op.GetDiag(out)
+
+    def _reset_diagonal(self):
+        '''
+        diagonal of terms after rows/cols are reset
+        '''
+        d = np.zeros(self._size)
+        for op, scale, _P, _xl, _yl in self._terms:
+            self._term_diagonal(op, self._y)
+            d += scale * self._y.GetDataArray()
+        d[self._rows] = 0.0
+        d[self._cols] = 0.0
+        return d
+
+    def get_diagonal(self):
+        '''
+        diagonal (mfem.Vector) of this operator
+        '''
+        if self._diag is None:
+            d = self._reset_diagonal()
+            d[self._didx] += self._dcorr
+            self._diag = mfem.Vector(self._size)
+            self._diag.Assign(d)
+        return self._diag
+
+    def AssembleDiagonal(self, diag):
+        diag.Assign(self.get_diagonal())
+
+    def Mult(self, x, y):
+        src = x
+        if len(self._cols) > 0:
+            self._xc.Assign(x)
+            self._xc.GetDataArray()[self._cols] = 0.0
+            src = self._xc
+
+        y.Assign(0.0)
+        for op, scale, P, xl, yl in self._terms:
+            if P is None:
+                op.Mult(src, self._y)
+            else:
+                P.Mult(src, xl)
+                op.Mult(xl, yl)
+                P.MultTranspose(yl, self._y)
+            y.Add(scale, self._y)
+
+        yy = y.GetDataArray()
+        yy[self._rows] = 0.0
+        if len(self._didx) > 0:
+            yy[self._didx] += self._dcorr * x.GetDataArray()[self._didx]
+
+    def apply(self, x):
+        '''
+        numpy (real) version of Mult
+        '''
+        self._x.Assign(np.ascontiguousarray(x, dtype=float))
+        out = mfem.Vector(self._size)
+        self.Mult(self._x, out)
+        return out.GetDataArray().copy()
+
+
+def diagonal_smoother(opr, smoother_type="Jacobi", order=2):
+    '''
+    smoother of FormOperator, which uses only its diagonal.
+       Jacobi, l1Jacobi, lumpedJacobi : OperatorJacobiSmoother
+       Chebyshev : OperatorChebyshevSmoother
+    essential DoFs are already in the diagonal of opr.
+    '''
+    diag = opr.get_diagonal()
+    ess_tdof = mfem.intArray()
+    if smoother_type in ("Jacobi", "l1Jacobi", "lumpedJacobi"):
+        smoother = mfem.OperatorJacobiSmoother(diag, ess_tdof)
+    elif smoother_type == "Chebyshev":
+        if use_parallel:
+            from mpi4py import MPI
+            smoother = mfem.OperatorChebyshevSmoother(opr, diag, ess_tdof,
+                                                      order, MPI.COMM_WORLD)
+        else:
+            smoother = mfem.OperatorChebyshevSmoother(opr, diag, ess_tdof,
+                                                      order)
+    else:
+        assert False, (smoother_type +
+                       " smoother needs an assembled matrix (use Jacobi or Chebyshev)")
+    smoother._linked_data = (opr, diag, ess_tdof)
+    return smoother
+
+
+class OperatorBlock():
+    def __init__(self, terms, size, row0=0, gsize=None):
+        self.terms = list(terms)    # [(real operator, complex coeff.)]
+        self._size = size
+        self._row0 = row0
+        self._gsize = size if gsize is None else gsize
+
+        self.rows = np.zeros(0, dtype=int)
+        self.cols = np.zeros(0, dtype=int)
+        self.didx = np.zeros(0, dtype=int)
+        self.dval = np.zeros(0, dtype=complex)
+
+    @classmethod
+    def from_forms(cls, rform, iform):
+        terms = []
+        if rform is not None:
+            terms.append((rform, 1.0))
+        if iform is not None:
+            terms.append((iform, 1j))
+        form = rform if rform is not None else iform
+
+        if use_parallel:
+            fes = form.ParFESpace()
+            return cls(terms, fes.GetTrueVSize(),
+                       row0=fes.GetMyTDofOffset(),
+                       gsize=fes.GlobalTrueVSize())
+        fes = form.FESpace()
+        return cls(terms, fes.GetTrueVSize())
+
+    def __repr__(self):
+        return "OperatorBlock" + str(self.shape)
+
+    @property
+    def shape(self):
+        # global size, as CHypreMat
+        return (self._gsize, self._gsize)
+
+    @property
+    def isHypre(self):
+        return use_parallel
+
+    def isComplex(self):
+        return (any([np.imag(c) != 0 for _op, c in self.terms]) or
+                np.any(np.imag(self.dval) != 0))
+
+    def GetRowPartArray(self):
+        return (self._row0, self._row0 + self._size, self._gsize)
+    GetColPartArray = GetRowPartArray
+    GetPartitioningArray = GetRowPartArray
+
+    def copy(self):
+        ret = OperatorBlock(self.terms, self._size, row0=self._row0,
+                            gsize=self._gsize)
+        ret.rows = self.rows.copy()
+        ret.cols = self.cols.copy()
+        ret.didx = self.didx.copy()
+        ret.dval = self.dval.copy()
+        return ret
+
+    def _is_modified(self):
+        return len(self.rows) + len(self.cols) + len(self.didx) > 0
+
+    #
+    #  arithmetic (before BC elimination)
+    #
+    def __add__(self, other):
+        assert not self._is_modified(), "can not add to eliminated operator"
+        ret = self.copy()
+        if isinstance(other, OperatorBlock):
+            assert not other._is_modified(), "can not add eliminated operator"
+            ret.terms.extend(other.terms)
+        else:
+            ret.terms.extend(_split_matrix(other))
+        return ret
+
+    __radd__ = __add__
+
+    def __mul__(self, other):
+        assert not self._is_modified(), "can not scale eliminated operator"
+        ret = self.copy()
+        ret.terms = [(op, c * other) for op, c in self.terms]
+        return ret
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return self * -1
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def transpose(self):
+        assert False, "transpose is not supported for partial assembly"
+
+    def conj(self, inplace=False):
+        assert False, "conj is not supported for partial assembly"
+
+    def rap(self, P):
+        assert False, "global DoF coupling (periodic BC etc.) is not supported for partial assembly"
+
+    #
+    #  essential BC
+    #
+    def _local(self, idx):
+        idx = np.asarray(idx, dtype=int).flatten() - self._row0
+        return idx[np.logical_and(idx >= 0, idx < self._size)]
+
+    def _reset(self, rows=None, cols=None):
+        if rows is not None:
+            self.rows = np.union1d(self.rows, rows)
+        if cols is not None:
+            self.cols = np.union1d(self.cols, cols)
+
+    def _set_diag(self, idx, value):
+        value = np.broadcast_to(np.asarray(value, dtype=complex), idx.shape)
+        keep = np.logical_not(np.isin(self.didx, idx))
+        self.didx = np.hstack((self.didx[keep], idx))
+        self.dval = np.hstack((self.dval[keep], value))
+
+    def resetRow(self, idx, inplace=True):
+        target = self if inplace else self.copy()
+        target._reset(rows=target._local(idx))
+        return target
+
+    def resetCol(self, idx, inplace=True):
+        target = self if inplace else self.copy()
+        target._reset(cols=target._local(idx))
+        return target
+
+    def setDiag(self, idx, value=1.0):
+        idx = np.asarray(idx, dtype=int).flatten()
+        value = np.broadcast_to(np.asarray(value), idx.shape)
+        local = idx - self._row0
+        flag = np.logical_and(local >= 0, local < self._size)
+        self._set_diag(local[flag], value[flag])
+
+    def eliminate_RowsCols(self, B, tdof, inplace=True, diagpolicy=1):
+        '''
+        daigpolicy = 0  # DiagOne
+        daigpolicy = 1  # DiagKeep
+
+        tdof is local. returns (Ae, A, B) as ScipyCoo/CHypreMat.
+        '''
+        tdof = np.asarray(tdof, dtype=int)
+        before = self.copy()
+
+        if diagpolicy == 0:
+            diagA = np.ones(len(tdof))
+        else:
+            diagA = self.get_diagonal()[tdof]
+
+        target = self if inplace else self.copy()
+        target._reset(rows=tdof, cols=tdof)
+        target._set_diag(tdof, diagA)
+
+        Ae = EliminatedOperatorBlock(before, target.copy())
+
+        if use_parallel:
+            B.set_elements(list(tdof + self._row0), diagA)
+            target_b = B
+        else:
+            from scipy.sparse import coo_matrix
+            from petram.helper.block_matrix import convert_to_ScipyCoo
+            target_b = convert_to_ScipyCoo(coo_matrix(B, copy=True))
+            target_b._assign('col0', tdof, diagA)
+
+        return Ae, target, target_b
+
+    #
+    #  conversion to mfem.Operator
+    #
+    def _part(self, imag):
+        terms = [(op, np.imag(c) if imag else np.real(c))
+                 for op, c in self.terms]
+        terms = [(op, s) for op, s in terms if s != 0.0]
+        dval = np.imag(self.dval) if imag else np.real(self.dval)
+        return FormOperator(terms, self._size, rows=self.rows,
+                            cols=self.cols, didx=self.didx, dval=dval)
+
+    def get_mfem_operator(self):
+        '''
+        (real part, imaginary part). imaginary part is None for real
+        operator.
+        '''
+        rop = self._part(False)
+        iop = self._part(True) if self.isComplex() else None
+        return rop, iop
+
+    def zero_operator(self):
+        return FormOperator([], self._size)
+
+    def get_diagonal(self):
+        rop, iop = self.get_mfem_operator()
+        d = rop.get_diagonal().GetDataArray().copy()
+        if iop is not None:
+            d = d + 1j * iop.get_diagonal().GetDataArray()
+        return d
+
+    def _dot_array(self, x):
+        rop, iop = self.get_mfem_operator()
+        y = rop.apply(np.real(x))
+        if np.iscomplexobj(x):
+            y = y + 1j * rop.apply(np.imag(x))
+        if iop is not None:
+            y = y + 1j * iop.apply(np.real(x))
+            if np.iscomplexobj(x):
+                y = y - iop.apply(np.imag(x))
+        return y
+
+    def dot(self, other):
+        return _wrap_array(self._dot_array(_local_array(other)))
+
+
+class EliminatedOperatorBlock():
+    '''
+    Ae = A (original) - A (eliminated) of OperatorBlock. it is used only
+    to correct RHS (Ae.dot(X)).
+    '''
+
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+
+    def __repr__(self):
+        return "EliminatedOperatorBlock" + str(self.shape)
+
+    @property
+    def shape(self):
+        return self.before.shape
+
+    @property
+    def isHypre(self):
+        return use_parallel
+
+    def isComplex(self):
+        return self.before.isComplex() or self.after.isComplex()
+
+    def GetRowPartArray(self):
+        return self.before.GetRowPartArray()
+    GetColPartArray = GetRowPartArray
+
+    def dot(self, other):
+        x = _local_array(other)
+        return _wrap_array(self.before._dot_array(x) -
+                           self.after._dot_array(x))
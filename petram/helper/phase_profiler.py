@@ -0,0 +1,232 @@
+'''
+   phase_profiler
+
+   wall/cpu time and memory of Engine phases (run_mesh, run_alloc_sol,
+   run_assemble_mat, SetOperator, Mult, save_sol_to_file...).
+
+   >>> with engine.profiler.phase("fill_bf"):
+   >>>     ...
+   or
+   >>> @profile_phase("run_alloc_sol")
+   >>> def run_alloc_sol(self, ...):
+
+   Phases are nested. A record is kept for each path of phase names
+   ("run_assemble_mat/fill:EM3D1/assemble"), and holds
+      count  : number of calls
+      wall   : wall clock time (s)
+      cpu    : process time (s)
+      mem    : max increase of RSS during a call (MB)
+      rss    : RSS at the end of the last call (MB)
+      peak   : peak RSS at the end of the last call (MB)
+
+   write_report gathers records over MPI ranks and writes min/avg/max
+   as JSON and CSV.
+'''
+import os
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('PhaseProfiler')
+
+metrics = ('wall', 'cpu', 'mem', 'rss', 'peak')
+
+
+def current_rss():
+    '''
+    resident set size (MB)
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as fid:
+            pages = int(fid.read().split()[1])
+        return pages * resource.getpagesize() / 1024. / 1024.
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    '''
+    peak resident set size (MB)
+    '''
+    rusage_denom = 1024.
+    if sys.platform == 'darwin':
+        rusage_denom = rusage_denom * rusage_denom
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rusage_denom
+
+
+class PhaseRecord():
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.mem = 0.0
+        self.rss = 0.0
+        self.peak = 0.0
+
+    def add(self, wall, cpu, mem, rss, peak):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.mem = max(self.mem, mem)
+        self.rss = rss
+        self.peak = peak
+
+    def todict(self):
+        return {"count": self.count,
+                "wall": self.wall,
+                "cpu": self.cpu,
+                "mem": self.mem,
+                "rss": self.rss,
+                "peak": self.peak}
+
+
+class PhaseProfiler():
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = {}
+        self._order = []
+        self._stack = []
+
+    def reset(self):
+        self.records = {}
+        self._order = []
+        self._stack = []
+
+    def phase(self, name):
+        '''
+        context manager to measure a phase. a phase with the same name
+        as the current one (such as a method calling the base class
+        method) is not counted twice.
+        '''
+        if not self.enabled:
+            return nullcontext()
+        if len(self._stack) > 0 and self._stack[-1] == name:
+            return nullcontext()
+        return self._phase(name)
+
+    @contextmanager
+    def _phase(self, name):
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        if path not in self.records:
+            self.records[path] = PhaseRecord()
+            self._order.append(path)
+
+        rss0 = current_rss()
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+            rss = current_rss()
+            self._stack.pop()
+            self.records[path].add(wall, cpu, max(rss - rss0, 0.0),
+                                   rss, peak_rss())
+
+    def gather(self):
+        '''
+        collect records over MPI ranks. returns (nprocs, list of
+        (path, count, {metric: (min, avg, max)})) on root, and
+        (nprocs, None) on other ranks.
+        '''
+        local = {p: self.records[p].todict() for p in self._order}
+        order = list(self._order)
+
+        from petram.mfem_config import use_parallel
+        if use_parallel:
+            from mpi4py import MPI
+            comm = MPI.COMM_WORLD
+            nprocs = comm.size
+            data = comm.gather((order, local), root=0)
+            if comm.rank != 0:
+                return nprocs, None
+        else:
+            nprocs = 1
+            data = [(order, local)]
+
+        paths = []
+        for o, _l in data:
+            for p in o:
+                if p not in paths:
+                    paths.append(p)
+
+        ret = []
+        for p in paths:
+            values = [l[p] for _o, l in data if p in l]
+            stats = {}
+            for m in metrics:
+                x = [v[m] for v in values]
+                stats[m] = (min(x), sum(x) / len(x), max(x))
+            ret.append((p, max([v["count"] for v in values]), stats))
+        return nprocs, ret
+
+    def format_report(self, records):
+        txt = ["phase profile (wall time: min/avg/max over ranks)"]
+        for path, count, stats in records:
+            txt.append("  " + path + " (" + str(count) + ") : " +
+                       "/".join(["{:.3f}".format(x) for x in stats["wall"]]) +
+                       "s, mem +{:.1f}MB".format(stats["mem"][2]))
+        return "\n".join(txt)
+
+    def write_report(self, basename="profile", dir=None):
+        '''
+        write basename.json and basename.csv. this must be called on all
+        ranks.
+        '''
+        if not self.enabled:
+            return
+        nprocs, records = self.gather()
+        if records is None:
+            return
+        if dir is None:
+            dir = os.getcwd()
+
+        phases = []
+        for path, count, stats in records:
+            d = {"name": path, "count": count}
+            for m in metrics:
+                d[m] = dict(zip(("min", "avg", "max"), stats[m]))
+            phases.append(d)
+        report = {"nprocs": nprocs,
+                  "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "units": {"wall": "s", "cpu": "s", "mem": "MB",
+                            "rss": "MB", "peak": "MB"},
+                  "phases": phases}
+
+        with open(os.path.join(dir, basename + '.json'), 'w') as fid:
+            json.dump(report, fid, indent=1)
+
+        header = ["name", "count"]
+        for m in metrics:
+            header.extend([m + "_min", m + "_avg", m + "_max"])
+        with open(os.path.join(dir, basename + '.csv'), 'w') as fid:
+            fid.write(",".join(header) + "\n")
+            for path, count, stats in records:
+                row = ['"' + path + '"', str(count)]
+                for m in metrics:
+                    row.extend(["{:.6g}".format(x) for x in stats[m]])
+                fid.write(",".join(row) + "\n")
+
+        dprint1(self.format_report(records))
+
+
+def profile_phase(name):
+    '''
+    decorator to measure an Engine method (uses self.profiler)
+    '''
+    def decorator(method):
+        @wraps(method)
+        def wrapped(self, *args, **kwargs):
+            profiler = getattr(self, 'profiler', None)
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            with profiler.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapped
+    return decorator
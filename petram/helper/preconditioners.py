@@ -87,6 +87,8 @@ if use_parallel:
 else:
     import mfem.ser as mfem
 
+from petram.helper.operator_block import FormOperator, diagonal_smoother
+
 import petram.debug
 dprint1, dprint2, dprint3 = petram.debug.init_dprints('Preconditioner')
 
@@ -273,6 +275,9 @@ SparseSmootherCls = {"Jacobi": (mfem.DSmoother, 0),
 
 
 def _create_smoother(name, mat):
+    if isinstance(mat, FormOperator):
+        # partial assembly: only diagonal is available
+        return diagonal_smoother(mat, name)
     if use_parallel:
         smoother = mfem.HypreSmoother(mat)
         smoother.SetType(getattr(mfem.HypreSmoother, name))
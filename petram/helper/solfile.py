@@ -0,0 +1,218 @@
+'''
+   solfile
+
+   binary solution (GridFunction) files.
+
+   format (version 1):
+      #PetraM solution : 1\n
+      {"fec":, "vdim":, "ordering":, "dtype":,
+       "pieces": [{"rank":, "size":, "offset":}]}\n
+      (padding) followed by raw arrays. offset is measured from the
+      first array, which starts at a multiple of data_alignment.
+
+   A file holds either the data of one rank (one piece, written next to
+   the rank's solmesh file), or the data of all ranks (single file per
+   field, named <solr/soli name>.all), in which piece k corresponds to
+   solmesh_*.<k>.
+
+   Text files written by GridFunction.Save/SaveGZ are read by MFEM as
+   before.
+'''
+import os
+import json
+
+import numpy as np
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('Solfile')
+
+magic = '#PetraM solution'
+solfile_version = 1
+data_alignment = 64
+aggregated_suffix = '.all'
+
+
+def _aligned(x):
+    return ((x + data_alignment - 1) // data_alignment) * data_alignment
+
+
+class SolfilePiece(str):
+    '''
+    path of a solution file. piece is the rank index in a single file
+    containing all ranks (None for a per-rank file).
+    '''
+    def __new__(cls, path, piece=None):
+        obj = str.__new__(cls, path)
+        obj.piece = piece
+        return obj
+
+
+def _fes_info(gf):
+    fes = gf.FESpace()
+    return {"fec": fes.FEColl().Name(),
+            "vdim": fes.GetVDim(),
+            "ordering": fes.GetOrdering()}
+
+
+def _make_header(info, sizes, dtype):
+    pieces = []
+    offset = 0
+    for rank, size in enumerate(sizes):
+        pieces.append({"rank": rank, "size": size, "offset": offset})
+        offset = _aligned(offset + size * dtype.itemsize)
+    header = dict(info)
+    header["dtype"] = dtype.str
+    header["pieces"] = pieces
+    header = (magic + ' : ' + str(solfile_version) + '\n' +
+              json.dumps(header) + '\n').encode()
+    return header, pieces
+
+
+def write_solfile(filename, gf):
+    '''
+    write GridFunction (local data) to a binary file
+    '''
+    data = np.ascontiguousarray(gf.GetDataArray(), dtype=np.float64)
+    header, _pieces = _make_header(_fes_info(gf), [data.size], data.dtype)
+
+    tmp = filename + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp, 'wb') as fid:
+        fid.write(header)
+        fid.write(b'\0' * (_aligned(len(header)) - len(header)))
+        fid.write(data.tobytes())
+    os.replace(tmp, filename)
+
+
+def write_solfile_aggregated(filename, gf, comm):
+    '''
+    write distributed GridFunction into one file (collective).
+    each rank writes its local data at its offset using MPI-IO.
+    '''
+    from mpi4py import MPI
+
+    data = np.ascontiguousarray(gf.GetDataArray(), dtype=np.float64)
+    sizes = comm.allgather(data.size)
+    info = comm.bcast(_fes_info(gf), root=0)
+
+    # header is identical on all ranks
+    header, pieces = _make_header(info, sizes, data.dtype)
+    offset = _aligned(len(header)) + pieces[comm.rank]["offset"]
+
+    if comm.rank == 0 and os.path.exists(filename):
+        os.remove(filename)
+    comm.Barrier()
+
+    fh = MPI.File.Open(comm, filename, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+    if comm.rank == 0:
+        fh.Write_at(0, header)
+    fh.Write_at_all(offset, data)
+    fh.Close()
+
+
+def is_binary_solfile(filename):
+    try:
+        with open(filename, 'rb') as fid:
+            return fid.read(len(magic)) == magic.encode()
+    except OSError:
+        return False
+
+
+def read_solfile_header(filename):
+    with open(filename, 'rb') as fid:
+        line = fid.readline()
+        if not line.startswith(magic.encode()):
+            return None, 0
+        version = int(line.decode().split(':')[-1])
+        if version > solfile_version:
+            assert False, ("unsupported solution file version " +
+                           str(version))
+        header = json.loads(fid.readline().decode())
+        start = _aligned(fid.tell())
+    return header, start
+
+
+def read_solfile_data(filename, piece=None, mmap=True):
+    '''
+    returns (header, data) of a binary solution file. data is
+    memory-mapped if mmap is True (read-only) or 'c' (copy-on-write).
+    '''
+    header, start = read_solfile_header(filename)
+    if header is None:
+        assert False, "not a binary solution file: " + filename
+
+    pieces = header["pieces"]
+    if piece is None:
+        if len(pieces) != 1:
+            assert False, "piece must be specified: " + filename
+        piece = 0
+    p = pieces[piece]
+    dtype = np.dtype(header["dtype"])
+
+    if mmap:
+        mode = 'c' if mmap == 'c' else 'r'
+        data = np.memmap(filename, dtype=dtype, mode=mode,
+                         offset=start + p["offset"], shape=(p["size"],))
+    else:
+        with open(filename, 'rb') as fid:
+            fid.seek(start + p["offset"])
+            data = np.fromfile(fid, dtype=dtype, count=p["size"])
+    return header, data
+
+
+def _mfem_module(mesh):
+    '''
+    mfem.par or mfem.ser, which mesh belongs to
+    '''
+    if type(mesh).__module__.startswith('mfem._par'):
+        import mfem.par as mfem
+    else:
+        import mfem.ser as mfem
+    return mfem
+
+
+def read_gridfunction(mesh, filename, piece=None):
+    '''
+    read GridFunction on mesh from either a text (GridFunction.Save) or
+    a binary solution file.
+
+    binary data is memory-mapped (copy-on-write) and used by the
+    GridFunction without copying. The file must not be modified
+    while the GridFunction is used.
+    '''
+    mfem = _mfem_module(mesh)
+
+    if piece is None:
+        piece = getattr(filename, 'piece', None)
+
+    if not is_binary_solfile(filename):
+        return mfem.GridFunction(mesh, str(filename))
+
+    header, data = read_solfile_data(filename, piece=piece, mmap='c')
+    fec = mfem.FiniteElementCollection.New(str(header["fec"]))
+    fes = mfem.FiniteElementSpace(mesh, fec, header["vdim"],
+                                  header["ordering"])
+    if fes.GetVSize() != data.size:
+        assert False, ("solution size does not match the mesh: " +
+                       str(filename))
+    if data.dtype == np.float64:
+        vec = mfem.Vector(data)
+        gf = mfem.GridFunction(fes, vec, 0)
+        gf._data_link = (data, vec)
+    else:
+        gf = mfem.GridFunction(fes)
+        gf.Assign(np.asarray(data, dtype=np.float64))
+    gf._fes_link = (fec, fes)
+    return gf
+
+
+def find_solfile(path, suffix):
+    '''
+    path of solution file for a rank. suffix is the rank suffix
+    ('.000003' or ''). returns SolfilePiece or None.
+    '''
+    if os.path.exists(path + suffix):
+        return SolfilePiece(path + suffix)
+    if os.path.exists(path + aggregated_suffix):
+        piece = int(suffix[1:]) if suffix != '' else 0
+        return SolfilePiece(path + aggregated_suffix, piece)
+    return None
@@ -276,6 +276,65 @@ def check_vectorfe_in_lowdim(gf):
         assert False, "Nodal evaluator does not work for low dimenstional vector field (try without averaging)"
 
 
+# when elements to be evaluated are more than this fraction of mesh,
+# nodal values are computed by a single GetNodalValues call on the
+# entire mesh
+nodal_values_full_mesh_ratio = 0.1
+
+
+def el2v_scatter_index(el2v):
+    '''
+    flatten element->(element's vert index, iverts_f index) map
+
+    returns (position of element, element's vert index, iverts_f index)
+    '''
+    counts = [len(m) for m in el2v]
+    pairs = np.array([p for m in el2v for p in m], dtype=int).reshape(-1, 2)
+    epos = np.repeat(np.arange(len(el2v)), counts)
+    return epos, pairs[:, 0], pairs[:, 1]
+
+
+def gather_nodal_values(gf, iele, el2v_index, comp, size, iverts_f=None):
+    '''
+    collect element nodal values at vertices
+
+    returns (sum of values, number of elements contributing)
+    '''
+    iele = np.asarray(iele)
+    epos, lidx, vidx = el2v_index
+    valid = iele >= 0
+
+    mesh = gf.FESpace().GetMesh()
+    if (iverts_f is not None and np.all(valid) and
+            len(iele) > mesh.GetNE() * nodal_values_full_mesh_ratio):
+        # iele has all elements sharing iverts_f. Thus, averaging
+        # over the entire mesh gives the same result.
+        nval = mfem.Vector()
+        gf.GetNodalValues(nval, comp)
+        return nval.GetDataArray()[iverts_f], np.ones(size)
+
+    data = []
+    values = mfem.doubleArray()
+    nvalues = np.zeros(len(iele), dtype=int)
+    for p in np.where(valid)[0]:
+        gf.GetNodalValues(int(iele[p]), values, comp)
+        data.append(values.ToList())
+        nvalues[p] = len(data[-1])
+
+    if len(data) == 0:
+        return np.zeros(size), np.zeros(size)
+
+    flat = np.hstack(data)
+    offsets = np.hstack(([0], np.cumsum(nvalues)[:-1]))
+
+    mask = valid[epos]
+    vidx = vidx[mask]
+    ret = np.bincount(vidx, weights=flat[offsets[epos[mask]] + lidx[mask]],
+                      minlength=size)
+    counts = np.bincount(vidx, minlength=size)
+    return ret, counts
+
+
 class Variables(dict):
     def __repr__(self):
         txt = []
@@ -1651,7 +1710,7 @@ class GridFunctionVariable(Variable):
 
         complex = not (gf_imag is None)
         super(GridFunctionVariable, self).__init__(complex=complex)
-        self.dim = gf_real.VectorDim()
+        self._dim = None
         self.comp = comp
         self.isGFSet = False
         self.isDerived = False
@@ -1662,6 +1721,33 @@ class GridFunctionVariable(Variable):
         self._curl_gf = None
         self._div_gf = None
 
+    @property
+    def dim(self):
+        if self._dim is None:
+            self._dim = self.deriv_args[0].VectorDim()
+        return self._dim
+
+    @dim.setter
+    def dim(self, value):
+        self._dim = value
+
+    @property
+    def deriv_args(self):
+        '''
+        GridFunctions given to deriv. GridFunctions of Solsets are
+        loaded here when they are used first (see petram.sol.solsets)
+        '''
+        if self._loaded_deriv_args is None:
+            self._loaded_deriv_args = tuple(
+                [x.load() if getattr(type(x), 'is_lazy_gridfunction', False)
+                 else x for x in self._deriv_args])
+        return self._loaded_deriv_args
+
+    @deriv_args.setter
+    def deriv_args(self, value):
+        self._deriv_args = value
+        self._loaded_deriv_args = None
+
     def _def_deriv(self, *args):
         return args[0], args[1], None
 
@@ -1814,7 +1900,8 @@ class GridFunctionVariable(Variable):
     def get_emesh_idx(self, idx=None, g=None):
         if idx is None:
             idx = []
-        gf_real, gf_imag = self.deriv_args
+        # (_emesh_idx is known without loading GridFunction)
+        gf_real, gf_imag = self._deriv_args
 
         if gf_real is not None:
             if not gf_real._emesh_idx in idx:
@@ -1905,27 +1992,17 @@ class GFScalarVariable(GridFunctionVariable):
         check_vectorfe_in_lowdim(gf)
 
         size = len(wverts)
-        if self.gfi is None:
-            ret = np.zeros(size, dtype=np.float64)
-        else:
-            ret = np.zeros(size, dtype=np.complex128)
-        wverts = np.zeros(size)
-
-        for kk, m in zip(iele, el2v):
-            if kk < 0:
-                continue
-            values = mfem.doubleArray()
-
-            self.gfr.GetNodalValues(kk, values, self.comp)
-
-            for k, idx in m:
-                ret[idx] = ret[idx] + values[k]
-                wverts[idx] += 1
-            if self.gfi is not None:
-                arr = mfem.doubleArray()
-                self.gfi.GetNodalValues(kk, arr, self.comp)
-                for k, idx in m:
-                    ret[idx] = ret[idx] + arr[k] * 1j
+        el2v_index = kwargs.get('el2v_index', None)
+        if el2v_index is None:
+            el2v_index = el2v_scatter_index(el2v)
+        iverts_f = kwargs.get('iverts_f', None)
+
+        ret, wverts = gather_nodal_values(self.gfr, iele, el2v_index,
+                                          self.comp, size, iverts_f)
+        if self.gfi is not None:
+            reti, _wverts = gather_nodal_values(self.gfi, iele, el2v_index,
+                                                self.comp, size, iverts_f)
+            ret = ret + 1j * reti
 
         ret = ret / wverts
 
@@ -2235,27 +2312,20 @@ class GFVectorVariable(GridFunctionVariable):
         gf = self.gfr if self.gfr is not None else self.gfi
         check_vectorfe_in_lowdim(gf)
 
+        el2v_index = kwargs.get('el2v_index', None)
+        if el2v_index is None:
+            el2v_index = el2v_scatter_index(el2v)
+        iverts_f = kwargs.get('iverts_f', None)
+
         ans = []
         for comp in range(self.dim):
-            if self.gfi is None:
-                ret = np.zeros(size, dtype=np.float64)
-            else:
-                ret = np.zeros(size, dtype=np.complex128)
-
-            wverts = np.zeros(size)
-            for kk, m in zip(iele, el2v):
-                if kk < 0:
-                    continue
-                values = mfem.doubleArray()
-                self.gfr.GetNodalValues(kk, values, comp + 1)
-                for k, idx in m:
-                    ret[idx] = ret[idx] + values[k]
-                    wverts[idx] += 1
-                if self.gfi is not None:
-                    arr = mfem.doubleArray()
-                    self.gfi.GetNodalValues(kk, arr, comp + 1)
-                    for k, idx in m:
-                        ret[idx] = ret[idx] + arr[k] * 1j
+            ret, wverts = gather_nodal_values(self.gfr, iele, el2v_index,
+                                              comp + 1, size, iverts_f)
+            if self.gfi is not None:
+                reti, _wverts = gather_nodal_values(self.gfi, iele,
+                                                    el2v_index, comp + 1,
+                                                    size, iverts_f)
+                ret = ret + 1j * reti
             # print(list(wverts))
             ans.append(ret / wverts)
         ret = np.transpose(np.vstack(ans))
@@ -0,0 +1,351 @@
+'''
+   partition_cache
+
+   cache of partitioned parallel meshes. ParallelEngine.run_mesh loads
+   the serial mesh, applies serial refinements and partitions it on
+   every rank. When mfem_config.partition_cache_dir is set, the
+   resulting ParMesh is saved (ParPrint format, one file per rank) and
+   later runs load only the local piece.
+
+   layout:
+      <cache_dir>/<key>/pmesh.<rank>
+      <cache_dir>/<key>/info.json    (written last. marks a complete entry)
+
+   key is made from
+      sha256 of mesh file, mesh generator settings, serial refinement
+      settings, partitioning method, number of MPI ranks and MFEM
+      version.
+
+   sha256 of mesh file is kept in <cache_dir>/file_hash.json for
+   (path, size, mtime), so that the file is read only when it changed.
+
+   When all meshes are found in the cache, preprocess_modeldata loads
+   the serial mesh and runs preprocess only on rank 0. Model node
+   attributes set in preprocess are sent to other ranks (see
+   dumps_preprocess_state).
+
+   A cache can be made offline (with the same number of ranks as the
+   run) by
+      mpirun -np 512 python -m petram.mesh.partition_cache model.pmfm \
+             -d /path/to/cache
+'''
+import os
+import io
+import json
+import pickle
+import hashlib
+
+import petram.debug
+dprint1, dprint2, dprint3 = petram.debug.init_dprints('PartitionCache')
+
+cache_version = 1
+
+
+def file_hash(path, blocksize=1 << 24):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fid:
+        while True:
+            data = fid.read(blocksize)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+_file_hash_memo = {}
+
+
+def cached_file_hash(path, cache_dir):
+    '''
+    file_hash using the record of (path, size, mtime) in cache_dir
+    '''
+    st = os.stat(path)
+    stat_key = repr((os.path.abspath(path), st.st_size, st.st_mtime_ns))
+    if stat_key in _file_hash_memo:
+        return _file_hash_memo[stat_key]
+
+    index_path = os.path.join(cache_dir, 'file_hash.json')
+    try:
+        with open(index_path, 'r') as fid:
+            index = json.load(fid)
+    except (OSError, ValueError):
+        index = {}
+
+    if stat_key in index:
+        value = index[stat_key]
+    else:
+        value = file_hash(path)
+        index[stat_key] = value
+        tmp = index_path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(tmp, 'w') as fid:
+                json.dump(index, fid)
+            os.replace(tmp, index_path)
+        except OSError:
+            dprint1("can not write " + index_path)
+    _file_hash_memo[stat_key] = value
+    return value
+
+
+def make_key(gen, srefines, p_method, nprocs, cache_dir):
+    '''
+    key of partitioned mesh made by mesh generator (gen) followed by
+    serial refinements
+    '''
+    import mfem
+
+    path = gen.get_real_path()
+    text = repr((cache_version,
+                 cached_file_hash(path, cache_dir),
+                 gen.__class__.__name__,
+                 repr(gen.get_panel1_value()),
+                 [(s.__class__.__name__, repr(s.get_panel1_value()))
+                  for s in srefines],
+                 p_method,
+                 nprocs,
+                 getattr(mfem, '__version__', '')))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_partition_cache(gen, srefines, p_method, comm):
+    '''
+    returns PartitionCache for mesh generator gen, or None if the
+    cache is disabled or can not be used for this generator.
+    must be called on all ranks.
+    '''
+    from petram.mfem_config import get_partition_cache_dir
+
+    cache_dir = get_partition_cache_dir()
+    if cache_dir is None or cache_dir == '':
+        return None
+    # only meshes read from file are cached. ParPrint does not support
+    # non-conforming meshes.
+    if not hasattr(gen, 'get_real_path'):
+        return None
+    if getattr(gen, 'enforce_ncmesh', False):
+        return None
+
+    cache_dir = os.path.expanduser(cache_dir)
+    key = None
+    if comm.rank == 0:
+        try:
+            key = make_key(gen, srefines, p_method, comm.size, cache_dir)
+        except (OSError, AssertionError):
+            dprint1("can not make partition cache key for " + repr(gen))
+    key = comm.bcast(key, root=0)
+    if key is None:
+        return None
+
+    path = os.path.join(cache_dir, key)
+    return PartitionCache(path, comm)
+
+
+class PartitionCache():
+    def __init__(self, path, comm):
+        self.path = path
+        self.comm = comm
+
+    def piece_path(self, rank=None):
+        if rank is None:
+            rank = self.comm.rank
+        return os.path.join(self.path, 'pmesh.' + '{:0>6d}'.format(rank))
+
+    @property
+    def info_path(self):
+        return os.path.join(self.path, 'info.json')
+
+    def exists(self):
+        ret = False
+        if self.comm.rank == 0:
+            ret = os.path.exists(self.info_path)
+        ret = self.comm.bcast(ret, root=0)
+        if not ret:
+            return False
+        from mpi4py import MPI
+        ret = os.path.exists(self.piece_path())
+        return self.comm.allreduce(ret, op=MPI.LAND)
+
+    def load(self):
+        '''
+        returns (ParMesh of this rank, info)
+        '''
+        import mfem.par as mfem
+
+        info = None
+        if self.comm.rank == 0:
+            with open(self.info_path, 'r') as fid:
+                info = json.load(fid)
+        info = self.comm.bcast(info, root=0)
+        assert info["nprocs"] == self.comm.size, "wrong partition cache"
+
+        dprint1("Loading partitioned mesh from cache " + self.path)
+        pmesh = mfem.ParMesh(self.comm, self.piece_path())
+        return pmesh, info
+
+    def save(self, pmesh, info):
+        '''
+        save ParMesh. info is a dictionary (json) stored with it.
+        failure to write is not an error.
+        '''
+        from mpi4py import MPI
+
+        ok = True
+        if self.comm.rank == 0:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+            except OSError:
+                ok = False
+        ok = self.comm.bcast(ok, root=0)
+        if not ok:
+            dprint1("can not create partition cache " + self.path)
+            return False
+
+        if pmesh.Nonconforming():
+            dprint1("non-conforming mesh is not cached")
+            return False
+
+        try:
+            pmesh.ParPrint(self.piece_path(), 16)
+        except BaseException:
+            ok = False
+        ok = self.comm.allreduce(ok, op=MPI.LAND)
+
+        if ok and self.comm.rank == 0:
+            info = dict(info)
+            info["nprocs"] = self.comm.size
+            info["version"] = cache_version
+            tmp = self.info_path + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp, 'w') as fid:
+                json.dump(info, fid)
+            os.replace(tmp, self.info_path)
+
+        if ok:
+            dprint1("partitioned mesh is saved in cache " + self.path)
+        else:
+            dprint1("failed to save partitioned mesh in cache " + self.path)
+        return ok
+
+
+class _StatePickler(pickle.Pickler):
+    '''
+    model nodes are sent as their position in model.walk()
+    '''
+
+    def __init__(self, fid, node_index):
+        pickle.Pickler.__init__(self, fid, protocol=pickle.HIGHEST_PROTOCOL)
+        self.node_index = node_index
+
+    def persistent_id(self, obj):
+        return self.node_index.get(id(obj), None)
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, fid, nodes):
+        pickle.Unpickler.__init__(self, fid)
+        self.nodes = nodes
+
+    def persistent_load(self, pid):
+        return self.nodes[pid]
+
+
+def _dumps(value, node_index):
+    fid = io.BytesIO()
+    _StatePickler(fid, node_index).dump(value)
+    return fid.getvalue()
+
+
+def snapshot_model_state(model):
+    '''
+    attributes of model nodes before preprocess.
+    returns a list of {name: (value, pickled value or None)}
+    '''
+    nodes = list(model.walk())
+    node_index = {id(n): k for k, n in enumerate(nodes)}
+    snapshot = []
+    for n in nodes:
+        attrs = {}
+        for name, value in n.__dict__.items():
+            try:
+                data = _dumps(value, node_index)
+            except Exception:
+                data = None
+            attrs[name] = (value, data)
+        snapshot.append(attrs)
+    return snapshot
+
+
+def dumps_preprocess_state(model, snapshot, extra):
+    '''
+    pickle attributes of model nodes which are set or changed after
+    snapshot, together with extra (engine data). model nodes referred
+    in the values are sent as references. returns None if a value
+    can not be pickled (such as mfem objects).
+    '''
+    nodes = list(model.walk())
+    node_index = {id(n): k for k, n in enumerate(nodes)}
+    changed = []
+    try:
+        for k, n in enumerate(nodes):
+            before = snapshot[k]
+            for name, value in n.__dict__.items():
+                if name in before:
+                    value0, data0 = before[name]
+                    if value0 is value and data0 is None:
+                        continue
+                    data = _dumps(value, node_index)
+                    if value0 is value and data == data0:
+                        continue
+                changed.append((k, name, value))
+        return _dumps((changed, extra), node_index)
+    except Exception:
+        import traceback
+        dprint1("preprocess state can not be sent\n" +
+                traceback.format_exc())
+        return None
+
+
+def loads_preprocess_state(model, data):
+    '''
+    set node attributes pickled by dumps_preprocess_state.
+    returns extra.
+    '''
+    nodes = list(model.walk())
+    changed, extra = _StateUnpickler(io.BytesIO(data), nodes).load()
+    for k, name, value in changed:
+        setattr(nodes[k], name, value)
+    return extra
+
+
+def generate_partition_cache(modelfile, cache_dir=None):
+    '''
+    load model and write partitioned mesh to cache.
+    this must run with the number of MPI ranks used in the simulation.
+    '''
+    import petram.mfem_config as mfem_config
+    mfem_config.use_parallel = True
+    if cache_dir is not None:
+        mfem_config.partition_cache_dir = cache_dir
+    if mfem_config.get_partition_cache_dir() == '':
+        assert False, "partition cache directory is not given"
+
+    from petram.engine import ParallelEngine
+
+    modelfile = os.path.abspath(modelfile)
+    engine = ParallelEngine(modelfile=modelfile)
+    engine.run_build_ns(dir=os.path.dirname(modelfile))
+    engine.prep_emesh_data_ifneeded()
+    engine.run_mesh()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='generate partitioned mesh cache for parallel run')
+    parser.add_argument('model', help='model file (.pmfm)')
+    parser.add_argument('-d', '--cache-dir', default=None,
+                        help='cache directory (default: mfem_config.partition_cache_dir)')
+    args = parser.parse_args()
+
+    generate_partition_cache(args.model, cache_dir=args.cache_dir)
@@ -1,6 +1,12 @@
 use_parallel = False
 numba_debug = False
 allow_python_function_coefficient = "warn"
+# per-user store of numba compiled coefficients ('' to disable)
+numba_cache_dir = "~/.petram/numba_cache"
+# record time/memory of engine phases (see petram.helper.phase_profiler)
+use_phase_profiler = False
+# cache of partitioned parallel meshes ('' to disable)
+partition_cache_dir = ""
 
 '''
 config parameter can be manipulated during a run
@@ -12,6 +18,12 @@ def get_numba_debug():
     return globals()['numba_debug']
 def get_allow_python_function_coefficient():
     return globals()['allow_python_function_coefficient']
+def get_numba_cache_dir():
+    return globals()['numba_cache_dir']
+def get_use_phase_profiler():
+    return globals()['use_phase_profiler']
+def get_partition_cache_dir():
+    return globals()['partition_cache_dir']
 
 
    
@@ -38,6 +38,7 @@ class MFEM_GeneralRoot(Model, NS_mixin):
         v['submeshpartitioning'] = 'auto'
         v['autofilldiag'] = 'off'
         v['savegz'] = 'on'
+        v['solfile_format'] = 'text'
         v['allow_fallback_nonjit'] = 'allow'
         v['debug_numba_jit'] = 'off'
         v['trim_debug_print'] = 'on'
@@ -92,12 +93,15 @@ class MFEM_GeneralRoot(Model, NS_mixin):
                 ["Warning control", None,
                     1, {"values": ["default", "error", "ignore", "always",
                                    "module", "once"]}],
+                ["Solution file format", None,
+                    1, {"values": ["text", "binary", "binary (single file)"]}],
                 ]
 
     def get_panel2_value(self):
         return (self.diagpolicy, self.savegz, self.partitioning, self.submeshpartitioning,
                 self.autofilldiag, self.allow_fallback_nonjit, self.debug_numba_jit,
-                self.trim_debug_print, self.warning_control)
+                self.trim_debug_print, self.warning_control,
+                self.solfile_format)
 
     def import_panel2_value(self, v):
         self.diagpolicy = v[0]
@@ -109,6 +113,7 @@ class MFEM_GeneralRoot(Model, NS_mixin):
         self.debug_numba_jit = v[6]
         self.trim_debug_print = v[7]
         self.warning_control = v[8]
+        self.solfile_format = v[9]
 
     def run(self):
         import petram.debug
@@ -123,6 +128,8 @@ class MFEM_GeneralRoot(Model, NS_mixin):
 
         if not hasattr(self, "warning_control"):
             self.warning_control = 'once'
+        if not hasattr(self, "solfile_format"):
+            self.solfile_format = 'text'
 
         self.root()._parameters = {}
         self.root()._init_done = True
@@ -4,6 +4,8 @@
 
 '''
 from petram.debug import handle_allow_python_function_coefficient
+import functools
+import inspect
 import numpy as np
 
 from petram.mfem_config import use_parallel
@@ -30,12 +32,56 @@ from petram.phys.pycomplex_coefficient import (CC_Matrix,
                                                PyComplexConstant,
                                                PyComplexVectorConstant,
                                                PyComplexMatrixConstant,
-                                               complex_coefficient_from_real_and_imag)
+                                               complex_coefficient_from_real_and_imag,
+                                               shared_complex_coefficient)
 
 import petram.debug
 dprint1, dprint2, dprint3 = petram.debug.init_dprints('Coefficient')
 
 
+def share_complex(func):
+    '''
+    complex coefficients generated with the same arguments are shared
+    in complex_assembly scope. real/imag does not change a complex
+    coefficient, so the real and imaginary forms get the same object.
+    '''
+    from petram.helper.numba_cache import simple_value_signature
+
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        import petram.phys.pycomplex_coefficient as pcc
+        if pcc._shared_coeffs is None:
+            return func(*args, **kwargs)
+
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        options = arguments.pop('kwargs', {})
+        if not arguments['return_complex']:
+            return func(*args, **kwargs)
+
+        key = [func.__name__]
+        for name, value in arguments.items():
+            if name in ('l', 'g'):
+                key.append((name, id(value)))
+            else:
+                key.append((name, simple_value_signature(value)))
+        for name in sorted(options):
+            if name == 'real':
+                continue
+            key.append((name, simple_value_signature(options[name])))
+        if any([x[1] is None for x in key[1:]]):
+            key = None
+        else:
+            key = tuple(key)
+
+        return shared_complex_coefficient(key,
+                                          lambda: func(*args, **kwargs))
+    return wrapped
+
+
 def call_nativegen(v, l, g, real, conj, scale):
     vv = v(l, g)
     if real:
@@ -55,6 +101,7 @@ def call_nativegen(v, l, g, real, conj, scale):
             return coeff
 
 
+@share_complex
 def MCoeff(dim, exprs, ind_vars, l, g, return_complex=False,
            return_mfem_constant=False, **kwargs):
     if isinstance(exprs, str):
@@ -175,6 +222,7 @@ def MCoeff(dim, exprs, ind_vars, l, g, return_complex=False,
                 return PhysMatrixConstant(e)
 
 
+@share_complex
 def DCoeff(dim, exprs, ind_vars, l, g, return_complex=False,
            return_mfem_constant=False, **kwargs):
     if isinstance(exprs, str):
@@ -288,6 +336,7 @@ def DCoeff(dim, exprs, ind_vars, l, g, return_complex=False,
             return PhysMatrixConstant(e)
 
 
+@share_complex
 def VCoeff(dim, exprs, ind_vars, l, g, return_complex=False,
            return_mfem_constant=False, **kwargs):
     if isinstance(exprs, str):
@@ -409,6 +458,7 @@ def VCoeff(dim, exprs, ind_vars, l, g, return_complex=False,
                 return PhysVectorConstant(e)
 
 
+@share_complex
 def SCoeff(exprs, ind_vars, l, g, return_complex=False,
            return_mfem_constant=False, **kwargs):
     if isinstance(exprs, str):
@@ -5,6 +5,7 @@
    utility to use NumbaCoefficient more easily
 
 '''
+import time
 import traceback
 
 from numpy.linalg import inv, det
@@ -843,10 +844,13 @@ def _expr_to_numba_coeff(txt, jitter, ind_vars, conj, scale, g, l,
         dep_names.append(n)
 
     if jitter == mfem.jit.scalar:
+        kind = "scalar"
         return_type = "complex128" if return_complex else "float64"
     elif jitter == mfem.jit.vector:
+        kind = "vector"
         return_type = "complex128[:]" if return_complex else "float64[:]"
     elif jitter == mfem.jit.matrix:
+        kind = "matrix"
         return_type = "complex128[:,:]" if return_complex else "float64[:,:]"
     else:
         assert False, "unknown jitter: " + str(type(jitter))
@@ -894,15 +898,62 @@ def _expr_to_numba_coeff(txt, jitter, ind_vars, conj, scale, g, l,
                 func_txt.append("   return _out_.astype(np.float64)")
         return func_txt
 
-    func_txt = "\n".join(create_func())
+    from petram.helper.numba_cache import numba_coeff_cache, module_globals
+
+    opts = kwargs.copy()
+    opts["diag_mode"] = diag_mode
+    memory_key = numba_coeff_cache.make_key(txt, ind_vars, return_type,
+                                            names, g, l, dependency,
+                                            conj, scale, opts)
+    coeff = numba_coeff_cache.get(memory_key)
+    if coeff is not None:
+        dprint2("(Note) reusing numba coefficient for " + txt)
+        return coeff
 
     from petram.mfem_config import (numba_debug,
                                     get_allow_python_function_coefficient)
 
     numba_debug = False if myid != 0 else numba_debug
 
+    def done(coeff, mode, t1, warm=False):
+        elapsed = time.perf_counter() - t1
+        numba_coeff_cache.add_compile_time(elapsed, warm)
+        if warm:
+            dprint1("numba coefficient loaded from disk cache in " +
+                    "{:.3f}".format(elapsed) + "s")
+        else:
+            dprint1("numba coefficient compiled (" + mode +
+                    ") in " + "{:.3f}".format(elapsed) + "s")
+        if coeff is not None:
+            coeff = NumbaCoefficient(coeff)
+            numba_coeff_cache.put(memory_key, coeff)
+        return coeff
+
+    t1 = time.perf_counter()
+    func_txt = "\n".join(create_func())
+
     if numba_debug:
         print("(DEBUG) wrapper function\n", func_txt)
+
+    namespace = None
+    if memory_key is not None and set(kwargs).issubset(["shape"]):
+        namespace = module_globals(names, ind_vars + dep_names, g, l)
+    if namespace is not None:
+        try:
+            coeff, warm = numba_coeff_cache.compile(memory_key[0], kind,
+                                                    func_txt, namespace,
+                                                    len(ind_vars),
+                                                    return_complex,
+                                                    dependency,
+                                                    debug=numba_debug,
+                                                    **kwargs)
+        except BaseException:
+            # try again without disk cache below, which reports the error
+            dprint2("disk cache is not used for " + txt)
+            coeff = None
+        if coeff is not None:
+            return done(coeff, "nopython", t1, warm)
+
     exec(func_txt, g, l)
 
     try:
@@ -943,18 +994,13 @@ def _expr_to_numba_coeff(txt, jitter, ind_vars, conj, scale, g, l,
             print("!!!! Failed to compile with nonpython mode. (next) Try object mode")
 
     else:
-        return NumbaCoefficient(coeff)
+        return done(coeff, "nopython", t1)
 
     # for the moment suppress objmode creation
     # return None
 
     func_txt = "\n".join(create_func(True))
 
-    from petram.mfem_config import (numba_debug,
-                                    get_allow_python_function_coefficient)
-
-    numba_debug = False if myid != 0 else numba_debug
-
     if numba_debug:
         print("(DEBUG) wrapper function\n", func_txt)
 
@@ -971,14 +1017,14 @@ def _expr_to_numba_coeff(txt, jitter, ind_vars, conj, scale, g, l,
         traceback.print_exc()
 
         print("Can not JIT coefficient. No possible recoverly. ")
-        return None
+        return done(None, "failed", t1)
     except BaseException:
         import traceback
         traceback.print_exc()
         print("Can not JIT coefficient. No possible recovery.")
-        return None
+        return done(None, "failed", t1)
 
-    return NumbaCoefficient(coeff)
+    return done(coeff, "objmode", t1)
 
 
 def expr_to_numba_coeff(exprs, jitter, ind_vars, conj, scale, g, l, return_complex,
@@ -1073,23 +1119,51 @@ def expr_to_numba_coeff(exprs, jitter, ind_vars, conj, scale, g, l, return_compl
 
     if numba_debug:
         print("(DEBUG) wrapper function\n", func_txt)
-    exec(func_txt, g, l)
 
     params = {}
     params["isconst"] = isconst
     params["consts"] = consts
 
-    coeff = jitter(sdim=len(ind_vars),
-                   complex=return_complex,
-                   debug=numba_debug,
-                   shape=shape,
-                   dependency=deps,
-                   interface="c++",
-                   params=params,
-                   **kwargs)(l["_func_"])
+    from petram.helper.numba_cache import (numba_coeff_cache,
+                                           content_key,
+                                           dependency_signature,
+                                           simple_value_signature)
+    t1 = time.perf_counter()
+    coeff = None
+    if len(kwargs) == 0:
+        kind = "matrix" if jitter == mfem.jit.matrix else "vector"
+        key = content_key(func_txt, len(ind_vars), tuple(shape),
+                          bool(return_complex),
+                          simple_value_signature(isconst),
+                          simple_value_signature(consts),
+                          tuple([dependency_signature(d)[0] for d in deps]))
+        try:
+            coeff, warm = numba_coeff_cache.compile(key, kind, func_txt, {},
+                                                    len(ind_vars),
+                                                    return_complex, deps,
+                                                    shape=tuple(shape),
+                                                    interface="c++",
+                                                    params=params,
+                                                    debug=numba_debug)
+        except BaseException:
+            dprint2("disk cache is not used for " + str(exprs))
+            coeff = None
+
+    if coeff is None:
+        warm = False
+        exec(func_txt, g, l)
+        coeff = jitter(sdim=len(ind_vars),
+                       complex=return_complex,
+                       debug=numba_debug,
+                       shape=shape,
+                       dependency=deps,
+                       interface="c++",
+                       params=params,
+                       **kwargs)(l["_func_"])
+        del l["_func_"]
+    numba_coeff_cache.add_compile_time(time.perf_counter() - t1, warm)
 
     ret = NumbaCoefficient(coeff)
-    del l["_func_"]
     return ret
 
 
@@ -1110,6 +1110,9 @@ class PhysModule(Phys):
         # see WF_model
         v['generate_dt_fespace'] = False
         v = self.vt_order.attribute_set(v)
+
+        # full: matrix, partial/element: operator (iterative solver only)
+        v['assembly_level'] = 'full'
         return v
 
     def get_dependent_variables(self):
@@ -1137,22 +1140,26 @@ class PhysModule(Phys):
 
     def panel1_param(self):
         ll = self.vt_order.panel_param(self)
-        return [["mesh num.", self.mesh_idx, 400, {}],
-                ["element", self.element, 2, {}]] + ll
+        return ([["mesh num.", self.mesh_idx, 400, {}],
+                 ["element", self.element, 2, {}]] + ll +
+                [["assembly", self.assembly_level, 1,
+                  {"values": ["full", "partial", "element"]}]])
 
     def panel1_tip(self):
         ll = self.vt_order.panel_tip()
-        return ["index of mesh", "element type"] + ll
+        return (["index of mesh", "element type"] + ll +
+                ["assembly level (partial/element is used with iterative solvers)"])
 
     def get_panel1_value(self):
         ll = self.vt_order.get_panel_value(self)
-        return [self.mesh_idx, self.element] + ll
+        return [self.mesh_idx, self.element] + ll + [self.assembly_level]
 
     def import_panel1_value(self, v):
         self.mesh_idx = int(v[0])
         self.element = str(v[1])
         self.vt_order.import_panel_value(self, [v[2]])
-        return v[3:]
+        self.assembly_level = str(v[3])
+        return v[4:]
 
     def panel2_param(self):
         import wx
@@ -5,10 +5,23 @@
     Handle Complex Coefficint as a single coefficint
     These classes are derived from RealImagCoefficientGen.
 
+
+    Complex evaluation memo:
+      In complex physics, the real and imaginary parts of a complex
+      coefficient go to different forms (r_a and i_a), and each
+      form.Assemble evaluates the coefficient at every quadrature
+      point. Inside complex_assembly(), the part evaluated first
+      records the complex values, and the other part consumes them in
+      the same order. Thus, a Python complex coefficient (CCBase) is
+      evaluated once per quadrature point.
 '''
 import abc
+import weakref
 from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
 
+import numpy as np
 from numpy.linalg import inv, det
 
 from petram.mfem_config import use_parallel
@@ -30,6 +43,67 @@ import petram.debug
 dprint1, dprint2, dprint3 = petram.debug.init_dprints('PyComplexCoefficient')
 
 
+'''
+  Complex evaluation memo
+
+'''
+# evaluate complex coefficient once for real and imaginary forms
+use_complex_eval_memo = True
+# max number of values kept in the memo (total of all coefficients).
+# when it is full, coefficients are evaluated for each part as usual.
+complex_eval_memo_size = 100000
+
+_memo_active = False
+_memo_count = 0
+_memo_coeffs = weakref.WeakSet()
+_shared_coeffs = None
+
+
+@contextmanager
+def complex_assembly():
+    '''
+    scope where the complex evaluation memo is active.
+    complex coefficients generated in this scope with the same
+    arguments are shared between real and imaginary forms
+    (see shared_complex_coefficient).
+    '''
+    global _memo_active, _shared_coeffs, _memo_count
+    if not use_complex_eval_memo or _memo_active:
+        yield
+        return
+
+    _memo_active = True
+    _shared_coeffs = {}
+    try:
+        yield
+    finally:
+        _memo_active = False
+        _shared_coeffs = None
+        for c in list(_memo_coeffs):
+            c.clear_eval_memo()
+        _memo_coeffs.clear()
+        _memo_count = 0
+
+
+def shared_complex_coefficient(key, factory):
+    '''
+    return complex coefficient made by factory. in complex_assembly
+    scope, the same object is returned for the same key.
+    '''
+    if _shared_coeffs is None or key is None:
+        return factory()
+    if key not in _shared_coeffs:
+        _shared_coeffs[key] = factory()
+    return _shared_coeffs[key]
+
+
+def _eval_part(wrapper, T, ip):
+    coeff = wrapper.coeff
+    if _memo_active and isinstance(coeff, CCBase):
+        return coeff.eval_memo(wrapper, T, ip)
+    return coeff.eval(T, ip)
+
+
 '''
   Real/Imag Coefficient (mfem coefficients)
 
@@ -42,7 +116,7 @@ class PyRealCoefficient(mfem.PyCoefficient):
         mfem.PyCoefficient.__init__(self)
 
     def Eval(self, T, ip):
-        v = self.coeff.eval(T, ip)
+        v = _eval_part(self, T, ip)
         return v.real
 
 
@@ -52,7 +126,7 @@ class PyImagCoefficient(mfem.PyCoefficient):
         mfem.PyCoefficient.__init__(self)
 
     def Eval(self, T, ip):
-        v = self.coeff.eval(T, ip)
+        v = _eval_part(self, T, ip)
         return v.imag
 
 
@@ -62,7 +136,7 @@ class PyRealVectorCoefficient(mfem.VectorPyCoefficient):
         mfem.VectorPyCoefficient.__init__(self, coeff.vdim)
 
     def Eval(self, K, T, ip):
-        M = self.coeff.eval(T, ip)
+        M = _eval_part(self, T, ip)
         K.SetSize(M.shape[0])
         return K.Assign(M.real)
 
@@ -73,7 +147,7 @@ class PyImagVectorCoefficient(mfem.VectorPyCoefficient):
         mfem.VectorPyCoefficient.__init__(self, coeff.vdim)
 
     def Eval(self, K, T, ip):
-        M = self.coeff.eval(T, ip)
+        M = _eval_part(self, T, ip)
         K.SetSize(M.shape[0])
         return K.Assign(M.imag)
 
@@ -85,7 +159,7 @@ class PyRealMatrixCoefficient(mfem.MatrixPyCoefficient):
         mfem.MatrixPyCoefficient.__init__(self, coeff.height)
 
     def Eval(self, K, T, ip):
-        M = self.coeff.eval(T, ip)
+        M = _eval_part(self, T, ip)
         K.SetSize(M.shape[0], M.shape[1])
         return K.Assign(M.real)
 
@@ -97,7 +171,7 @@ class PyImagMatrixCoefficient(mfem.MatrixPyCoefficient):
         mfem.MatrixPyCoefficient.__init__(self, coeff.height)
 
     def Eval(self, K, T, ip):
-        M = self.coeff.eval(T, ip)
+        M = _eval_part(self, T, ip)
         K.SetSize(M.shape[0], M.shape[1])
         return K.Assign(M.imag)
 
@@ -666,24 +740,83 @@ class CCBase(RealImagCoefficientGen):
 
     def get_real_coefficient(self):
         if self.kind == 'scalar':
-            return PyRealCoefficient(self)
+            return self._add_part(PyRealCoefficient(self), 0)
         if self.kind == 'vector':
-            return PyRealVectorCoefficient(self)
+            return self._add_part(PyRealVectorCoefficient(self), 0)
         if self.kind == 'matrix':
-            return PyRealMatrixCoefficient(self)
+            return self._add_part(PyRealMatrixCoefficient(self), 0)
         assert False, "unsupported kind"
         return None
 
     def get_imag_coefficient(self):
         if self.kind == 'scalar':
-            return PyImagCoefficient(self)
+            return self._add_part(PyImagCoefficient(self), 1)
         if self.kind == 'vector':
-            return PyImagVectorCoefficient(self)
+            return self._add_part(PyImagVectorCoefficient(self), 1)
         if self.kind == 'matrix':
-            return PyImagMatrixCoefficient(self)
+            return self._add_part(PyImagMatrixCoefficient(self), 1)
         assert False, "unsupported kind"
         return None
 
+    def _add_part(self, part, idx):
+        '''
+        the first real and imaginary parts are paired for eval_memo
+        '''
+        if not hasattr(self, '_memo_parts'):
+            self._memo_parts = [None, None]
+        if self._memo_parts[idx] is None:
+            self._memo_parts[idx] = id(part)
+        return part
+
+    def eval_memo(self, part, T, ip):
+        '''
+        evaluate complex value for a real/imag part using the memo.
+        values recorded by one part of the pair are consumed by the
+        other in the same order. the point is checked, and the memo is
+        dropped if the order does not match.
+        '''
+        global _memo_count
+        parts = getattr(self, '_memo_parts', None)
+        if parts is None or None in parts or id(part) not in parts:
+            return self.eval(T, ip)
+
+        if not hasattr(self, '_memo'):
+            self.clear_eval_memo()
+        point = (T.ElementNo, ip.x, ip.y, ip.z)
+        memo = self._memo
+
+        if len(memo) > 0 and self._memo_writer != id(part):
+            p, v = memo.popleft()
+            _memo_count -= 1
+            if p == point:
+                return v
+            dprint2("complex eval memo: evaluation order does not match")
+            self.clear_eval_memo()
+            self._memo_full = True
+            return self.eval(T, ip)
+
+        v = self.eval(T, ip)
+        if self._memo_full:
+            return v
+        if _memo_count >= complex_eval_memo_size:
+            self._memo_full = True
+            return v
+        if isinstance(v, np.ndarray):
+            v = v.copy()
+        self._memo_writer = id(part)
+        memo.append((point, v))
+        _memo_count += 1
+        _memo_coeffs.add(self)
+        return v
+
+    def clear_eval_memo(self):
+        global _memo_count
+        if hasattr(self, '_memo'):
+            _memo_count = max(_memo_count - len(self._memo), 0)
+        self._memo = deque()
+        self._memo_writer = None
+        self._memo_full = False
+
     def get_realimag_coefficient(self, real):
         if real:
             return self.get_real_coefficient()
@@ -21,6 +21,13 @@ else:
 from petram.sol.evaluator_agent import EvaluatorAgent
 Geom = mfem.Geometry()
 
+import petram.debug as debug
+dprint1, dprint2, dprint3 = debug.init_dprints('BdrNodalEvaluator')
+
+# if True, expression is evaluated once over all points using
+# NumPy broadcasting. Otherwise, it is evaluated point by point.
+use_vectorized_eval = True
+
 
 def process_iverts2nodals(mesh, iverts):
     ''' 
@@ -61,8 +68,13 @@ def process_iverts2nodals(mesh, iverts):
 
     # idx of element needs to be evaluated
 
+    # flattened elvert2facevert used to scatter element nodal values
+    from petram.helper.variables import el2v_scatter_index
+    el2v_index = el2v_scatter_index(elvert2facevert)
+
     return {'ieles': np.array(ieles),
             'elvert2facevert': elvert2facevert,
+            'el2v_index': el2v_index,
             'locs': np.stack([mesh.GetVertexArray(k) for k in iverts_f]),
             'elvertloc': elvertloc,
             'elattr': np.array(elattr),
@@ -152,6 +164,51 @@ def get_emesh_idx(obj, exprs, solvars, phys):
         return ret
 
 
+def eval_code_at_points(code, var_g2, ll_name, ll_value, vectorize=None):
+    '''
+    evaluate compiled expression using values at many points
+
+    In the vectorized mode, the point axis of each value is moved to
+    the last axis so that component access (E[0], M[0, 1]) means the
+    same as in the per-point evaluation. The result is spot-checked
+    against the per-point evaluation, and when the expression can not
+    be broadcasted, it falls back to the per-point loop.
+
+    returns (value, mode). mode is either 'vectorized' or 'pointwise'
+    '''
+    if vectorize is None:
+        vectorize = use_vectorized_eval
+
+    size = len(ll_value[0])
+
+    def eval_point(i):
+        return np.asarray(eval(code, var_g2,
+                               dict(zip(ll_name, [v[i] for v in ll_value]))))
+
+    if vectorize and size > 1:
+        try:
+            l = {n: np.moveaxis(np.asarray(v), 0, -1)
+                 for n, v in zip(ll_name, ll_value)}
+            with np.errstate(all='ignore'):
+                val = np.asarray(eval(code, var_g2, l))
+
+            if val.ndim > 0 and val.shape[-1] == size:
+                val = np.moveaxis(val, -1, 0)
+                checks = sorted(set([0, size//2, size-1]))
+                refs = [eval_point(i) for i in checks]
+                if all(ref.shape == val[i].shape and
+                       np.allclose(ref, val[i], equal_nan=True)
+                       for i, ref in zip(checks, refs)):
+                    return np.ascontiguousarray(val), 'vectorized'
+        except Exception:
+            pass
+        dprint2("expression can not be broadcasted. using per-point loop")
+
+    val = np.array([eval(code, var_g2, dict(zip(ll_name, v)))
+                    for v in zip(*ll_value)])
+    return val, 'pointwise'
+
+
 def eval_at_nodals(obj, expr, solvars, phys, edge_evaluator=False):
     '''
     evaluate nodal valus based on preproceessed 
@@ -254,6 +311,8 @@ def eval_at_nodals(obj, expr, solvars, phys, edge_evaluator=False):
                                       ibele=obj.ibeles,
                                       elattr=obj.elattr,
                                       el2v=obj.elvert2facevert,
+                                      el2v_index=getattr(
+                                          obj, 'el2v_index', None),
                                       locs=obj.locs,
                                       elvertloc=obj.elvertloc,
                                       wverts=obj.wverts,
@@ -269,17 +328,21 @@ def eval_at_nodals(obj, expr, solvars, phys, edge_evaluator=False):
             var_g2[n] = g[n]
 
     if len(ll_value) > 0:
-        val = np.array([eval(code, var_g2, dict(zip(ll_name, v)))
-                        for v in zip(*ll_value)])
+        val, mode = eval_code_at_points(code, var_g2, ll_name, ll_value)
     else:
         # if expr does not involve Varialbe, evaluate code once
         # and generate an array
         val = np.array([eval(code, var_g2)]*len(obj.locs))
+        mode = 'constant'
+    obj.eval_mode = mode
+    dprint2("eval_at_nodals (" + mode + "): " + expr)
 
     return val
 
 
 class BdrNodalEvaluator(EvaluatorAgent):
+    supports_partition = True
+
     def __init__(self, battrs, decimate=1):
         super(BdrNodalEvaluator, self).__init__()
         self.battrs = battrs
@@ -313,6 +376,10 @@ class BdrNodalEvaluator(EvaluatorAgent):
         if self.decimate != 1:
             ibdrs = ibdrs[::self.decimate]
 
+        ibdrs = self.select_partition(ibdrs)
+        if len(ibdrs) == 0:
+            return
+
         self.ibeles = np.array(ibdrs)
 
         def get_vertices_array(i):
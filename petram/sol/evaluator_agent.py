@@ -3,14 +3,39 @@ from weakref import WeakKeyDictionary as WKD
 from weakref import WeakValueDictionary as WVD
 
 class EvaluatorAgent(object):
+    # if True, agent can evaluate a disjoint subset of its geometry
+    # (see set_partition)
+    supports_partition = False
+
     def __init__(self):
         object.__init__(self)
         self.mesh = None
         self.knowns = WKD()
         self.emesh_idx = -1
+        self.eval_mode = None
+        self.partition = None
         
     def forget_knowns(self):
         self.knowns = WKD()
+
+    def set_partition(self, myid, num_proc):
+        '''
+        let this agent handle only myid-th piece out of num_proc
+        of geometry (element, boundary element, points)
+        '''
+        self.partition = (myid, num_proc)
+
+    def select_partition(self, items):
+        '''
+        select a contiguous part of items assigned to this agent
+        '''
+        if self.partition is None:
+            return items
+        myid, num_proc = self.partition
+        m = len(items)
+        st = (m // num_proc) * myid + min(m % num_proc, myid)
+        et = st + m // num_proc + (1 if m % num_proc > myid else 0)
+        return items[st:et]
         
     def set_mesh(self, mesh):
         self.mesh = weakref.ref(mesh)
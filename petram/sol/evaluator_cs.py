@@ -9,10 +9,15 @@ import traceback
 import subprocess as sp
 import petram.helper.pickle_wrapper as pickle
 import binascii
+import zlib
 try:
    import bz2  as bzlib
 except ImportError:
    import zlib as bzlib   
+try:
+   import lz4.frame as lz4frame
+except ImportError:
+   lz4frame = None
 from weakref import WeakKeyDictionary as WKD
 from weakref import WeakValueDictionary as WVD
 
@@ -36,9 +41,101 @@ ON_POSIX = 'posix' in sys.builtin_module_names
 
 wait_time = 0.3
 
+#
+#  protocol 3 : length-prefixed binary frame
+#
+#     #PM3FRAME <codec> <length>\n  followed by <length> bytes of
+#     pickled data. codec is raw, zlib or lz4.
+#
+#  a frame header is a text line, so that text printed by the server
+#  (or C++ layer) between frames is passed through as before.
+#
+max_protocol = 3
+frame_header = b'#PM3FRAME'
+frame_pickle_protocol = 4
+frame_compression = 'lz4' if lz4frame is not None else 'zlib'
+compress_min_bytes = 64*1024
+
+def encode_frame(obj, compression=None):
+    data = pickle.dumps(obj, frame_pickle_protocol)
+    codec = 'raw'
+    compression = frame_compression if compression is None else compression
+    if compression and len(data) >= compress_min_bytes:
+        if compression == 'lz4' and lz4frame is not None:
+            data = lz4frame.compress(data)
+            codec = 'lz4'
+        else:
+            data = zlib.compress(data, 1)
+            codec = 'zlib'
+    header = frame_header + b' ' + codec.encode() + b' ' + str(len(data)).encode()
+    return header + b'\n' + data
+
+def decode_frame(codec, data):
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    elif codec == 'lz4':
+        if lz4frame is None:
+            assert False, "lz4 compressed frame received but lz4 is not available"
+        data = lz4frame.decompress(data)
+    elif codec != 'raw':
+        assert False, "Unknown frame codec: " + codec
+    return data
+
+def parse_frame_header(line):
+    '''
+    returns (codec, length) if line is a frame header, otherwise None
+    '''
+    if not line.startswith(frame_header):
+        return None
+    items = line.split()
+    return items[1].decode(), int(items[2])
+
+def read_exactly(stream, size):
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if len(chunk) == 0:
+            raise EOFError("stream closed while reading a frame")
+        chunks.append(chunk)
+        size = size - len(chunk)
+    return b''.join(chunks)
+
+def read_frame(stream, text_callback=None):
+    '''
+    read one frame from a binary stream. text lines found before the
+    frame is given to text_callback. returns None at EOF.
+    '''
+    while True:
+        line = stream.readline()
+        if len(line) == 0:
+            return None
+        header = parse_frame_header(line)
+        if header is None:
+            if text_callback is not None:
+                text_callback(_to_text(line))
+            continue
+        codec, size = header
+        return pickle.loads(decode_frame(codec, read_exactly(stream, size)))
+
+def write_frame(stream, obj, compression=None):
+    stream.write(encode_frame(obj, compression=compression))
+    stream.flush()
+
+def _to_text(line):
+    # pipes are binary in protocol 3 (and in the local mode)
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    return line.replace('\r\n', '\n')
+
+def write_text(p, txt):
+    if getattr(p, 'evalsvr_binary', False):
+        txt = txt.encode('utf-8')
+    p.stdin.write(txt)
+    p.stdin.flush()
+
 def enqueue_output(p, queue, prompt):
     while True:
-        line = p.stdout.readline()
+        line = _to_text(p.stdout.readline())
         #print("line", line)
         
         if len(line) == 0:
@@ -54,8 +151,7 @@ def enqueue_output(p, queue, prompt):
 def enqueue_output2(p, queue, prompt):
     # this assumes recievein two data (size and data)
     while True:
-        line = p.stdout.readline()
-        #line = line.decode('utf-8')
+        line = _to_text(p.stdout.readline())
         if len(line) == 0:
             time.sleep(wait_time)
             continue
@@ -72,13 +168,14 @@ def enqueue_output2(p, queue, prompt):
                 ### Error string from C++ layer may show up here!?
                 print("Unexpected text received", line)   
     line2 = p.stdout.read(size+1)
-    line2 = binascii.a2b_hex(line2[:-1].encode())
+    if not isinstance(line2, bytes):
+        line2 = line2.encode()
+    line2 = binascii.a2b_hex(line2[:-1])
     if use_zlib:
         line2 = bzlib.decompress(line2)
     queue.put(line2)
     while True:
-        line = p.stdout.readline()
-        #line = line.decode('utf-8')        
+        line = _to_text(p.stdout.readline())
         if len(line) == 0:
             time.sleep(wait_time)
             continue
@@ -88,9 +185,38 @@ def enqueue_output2(p, queue, prompt):
          assert False, "I don't get prompt!??: " + line
     queue.put("??????")
 
-def run_and_wait_for_prompt(p, prompt, verbose=True, withsize=False):    
+def enqueue_output3(p, queue, prompt):
+    # this assumes recieving one frame followed by prompt.
+    # text lines are passed as they come and the frame data is
+    # queued last.
+    payload = None
+    while True:
+        line = p.stdout.readline()
+        if len(line) == 0:
+            if p.poll() is not None:
+                break
+            time.sleep(wait_time)
+            continue
+        header = parse_frame_header(line)
+        if header is not None:
+            codec, size = header
+            payload = decode_frame(codec, read_exactly(p.stdout, size))
+            continue
+        line = _to_text(line)
+        if line == prompt + '\n':
+            break
+        queue.put(line)
+    if payload is None:
+        assert False, "I don't get response frame!??"
+    queue.put(payload)
+    queue.put("??????")
+
+def run_and_wait_for_prompt(p, prompt, verbose=True, withsize=False,
+                            withframe=False):
     q = Queue()
-    if withsize:
+    if withframe:
+        t = Thread(target=enqueue_output3, args=(p, q, prompt))
+    elif withsize:
         t = Thread(target=enqueue_output2, args=(p, q, prompt))
     else:
         t = Thread(target=enqueue_output, args=(p, q, prompt))
@@ -133,18 +259,33 @@ def run_with_timeout(timeout, default, f, *args, **kwargs):
     finally:
         timeout_timer.cancel()
         
-def wait_for_prompt(p, prompt = '?', verbose = True, withsize=False):
+def wait_for_prompt(p, prompt = '?', verbose = True, withsize=False,
+                    withframe=False):
     return run_and_wait_for_prompt(p, prompt,
                                    verbose=verbose,
-                                   withsize=withsize)
+                                   withsize=withsize,
+                                   withframe=withframe)
         
 def start_connection(host='localhost',
                      num_proc=2,
                      user='',
                      soldir='',
                      ssh_opts=None,
-                     mp_debug=False):
-   
+                     mp_debug=False,
+                     protocol=None,
+                     local=False):
+    '''
+    protocol : highest protocol to request. protocol 3 uses binary
+               pipes (ssh -T, since a pty would alter the binary data).
+               without a pty, the remote server does not get SIGHUP
+               when the connection drops. so protocol 3 is used with
+               ssh only when it is requested.
+               None : 2 with ssh (-t, text), max_protocol in local mode
+    local    : run the server as a local subprocess (no ssh)
+    '''
+    if protocol is None:
+        protocol = max_protocol if local else 2
+
     if user != '':
        user = user+'@'
 
@@ -154,26 +295,44 @@ def start_connection(host='localhost',
     #            stdout=sp.PIPE,
     #            universal_newlines = True)    
     #ans = p.stdout.readlines()[0].strip()
-    command = "$PetraM/bin/launch_evalsvr.sh"
-    if soldir != '':
-        command = 'cd ' + soldir + ';' + command
-    print(command)
-    p = sp.Popen(['ssh'] + opts + ['-t', user + host, command],
+    binary = protocol >= 3 or local
+    if local:
+        command = [sys.executable, '-u', '-c',
+                   'from petram.sol.evaluator_cs import run_evaluator_server;' +
+                   'run_evaluator_server()']
+        cwd = os.path.expanduser(soldir) if soldir != '' else None
+        print(' '.join(command))
+    else:
+        command = "$PetraM/bin/launch_evalsvr.sh"
+        if soldir != '':
+            command = 'cd ' + soldir + ';' + command
+        print(command)
+        command = ['ssh'] + opts + ['-T' if binary else '-t', user + host, command]
+        cwd = None
+    p = sp.Popen(command,
                  stdin = sp.PIPE,
                  stdout=sp.PIPE, stderr=sp.STDOUT,
                  close_fds = ON_POSIX,
-                 universal_newlines = True)
+                 cwd = cwd,
+                 universal_newlines = not binary)
+    p.evalsvr_binary = binary
 
     data, alive = wait_for_prompt(p, prompt = 'num_proc?')
-    if data[-1].startswith("protocol"):
-       p.evalsvr_protocol = int(data[-1].split(':')[-1])
+    if len(data) > 0 and data[-1].startswith("protocol"):
+       server_protocol = int(data[-1].split(':')[-1])
     else:
-       p.evalsvr_protocol = 1
+       server_protocol = 1
 
-    txt = str(num_proc)+',' + str(mp_debug) + '\n'
+    txt = str(num_proc)+',' + str(mp_debug)
+    if server_protocol >= 3:
+       # older servers expect only two fields
+       p.evalsvr_protocol = min(protocol, server_protocol)
+       txt = txt + ',' + str(p.evalsvr_protocol)
+    else:
+       p.evalsvr_protocol = server_protocol
+    txt = txt + '\n'
     print("protcoal/debug flat",  txt)
-    p.stdin.write(txt)
-    p.stdin.flush()
+    write_text(p, txt)
     out, alive = wait_for_prompt(p)
     return p
 
@@ -183,9 +342,9 @@ def connection_test(host = 'localhost'):
     '''
     p = start_connection(host = host, num_proc = 2)
     for i in range(5):
-       p.stdin.write('test'+str(i)+'\n')
+       write_text(p, 'test'+str(i)+'\n')
        out, alive = wait_for_prompt(p)
-    p.stdin.write('e\n')
+    write_text(p, 'e\n')
     out, alive = wait_for_prompt(p)
     
             
@@ -232,7 +391,9 @@ class EvaluatorClient(Evaluator):
                  soldir='',
                  user='',
                  ssh_opts=None,
-                 mp_debug=False):
+                 mp_debug=False,
+                 protocol=None,
+                 local=False):
        
         self.init_done = False        
         self.soldir = soldir
@@ -243,7 +404,9 @@ class EvaluatorClient(Evaluator):
                                   user=user,
                                   soldir=soldir,
                                   ssh_opts=ssh_opts,
-                                  mp_debug=mp_debug)
+                                  mp_debug=mp_debug,
+                                  protocol=protocol,
+                                  local=local)
         self.failed = False
 
     def __del__(self):
@@ -260,21 +423,27 @@ class EvaluatorClient(Evaluator):
         prompt = kparams.pop("prompt", "?")
         nowait = kparams.pop("nowait", False)
         command = [name, params, kparams]
-        data = binascii.b2a_hex(pickle.dumps(command))
         print("Sending request", command)
-        self.p.stdin.write(data.decode('utf-8') + '\n')
-        self.p.stdin.flush()
+        if self.p.evalsvr_protocol >= 3:
+            # requests and responses (including terminate_all) are frames
+            self.p.stdin.write(encode_frame(command))
+            self.p.stdin.flush()
+            protocol = self.p.evalsvr_protocol
+        else:
+            data = binascii.b2a_hex(pickle.dumps(command))
+            write_text(self.p, data.decode('utf-8') + '\n')
+            protocol = 1 if force_protocol1 else self.p.evalsvr_protocol
 
         if nowait:
            return
-        protocol = 1 if force_protocol1 else self.p.evalsvr_protocol
 
         import threading
         print("calling wait for prompt", threading.current_thread())
         output, alive = wait_for_prompt(self.p,
                                         prompt=prompt, 
                                         verbose = verbose,
-                                        withsize = protocol > 1)
+                                        withsize = protocol == 2,
+                                        withframe = protocol >= 3)
         if not alive:
            self.p = None
            return
@@ -386,3 +555,100 @@ class EvaluatorClient(Evaluator):
         
     
 
+def run_evaluator_server(stdin=None, stdout=None, protocol=max_protocol):
+    '''
+    server side of EvaluatorClient. reads requests from stdin and
+    writes responses to stdout, until terminate_all or EOF.
+
+       handshake:  protocol:N, num_proc?, <- num_proc,mp_debug[,protocol]
+       protocol 1: request/response are hex lines
+       protocol 2: response is size line + hex data
+       protocol 3: request/response are frames (see encode_frame)
+    '''
+    stdin = sys.stdin.buffer if stdin is None else stdin
+    stdout = sys.stdout.buffer if stdout is None else stdout
+
+    def send_text(txt):
+        sys.stdout.flush()
+        stdout.write(txt.encode('utf-8'))
+        stdout.flush()
+
+    def send_response(result, protocol):
+        sys.stdout.flush()
+        if protocol >= 3:
+            write_frame(stdout, result)
+            return
+        data = pickle.dumps(result, 2)
+        if protocol == 2:
+            size_txt = ''
+            if len(data) > compress_min_bytes:
+                data = bzlib.compress(data)
+                size_txt = 'z'
+            data = binascii.b2a_hex(data)
+            send_text(size_txt + str(len(data)) + '\n')
+        else:
+            data = binascii.b2a_hex(data)
+        stdout.write(data + b'\n')
+        stdout.flush()
+
+    def read_request(protocol):
+        if protocol >= 3:
+            return read_frame(stdin)
+        while True:
+            line = stdin.readline()
+            if len(line) == 0:
+                return None
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                return pickle.loads(binascii.a2b_hex(line))
+            except (binascii.Error, ValueError):
+                print("Unexpected text received", line)
+
+    send_text('protocol:' + str(protocol) + '\n')
+    send_text('num_proc?\n')
+    items = _to_text(stdin.readline()).strip().split(',')
+    nproc = int(items[0])
+    mp_debug = len(items) > 1 and items[1].strip() == 'True'
+    # a client not sending the third field does not know protocol 3
+    protocol = min(protocol, int(items[2]) if len(items) > 2 else 2)
+
+    svr = EvaluatorServer(nproc=nproc,
+                          logfile='log' if mp_debug else 'queue')
+
+    def flush_worker_text():
+        if svr.text_queue is None:
+            return
+        while True:
+            try:
+                txt = svr.text_queue.get_nowait()
+            except Empty:
+                break
+            if len(txt.strip()) > 0:
+                print(txt)
+
+    send_text('?\n')
+    while True:
+        command = read_request(protocol)
+        if command is None:
+            svr.terminate_all()
+            break
+        name, params, kparams = command
+        try:
+            if name.startswith('_'):
+                assert False, "Not allowed: " + name
+            result = ('ok', getattr(svr, name)(*params, **kparams))
+        except BaseException:
+            result = ('error', traceback.format_exception(*sys.exc_info()))
+        if name == 'terminate_all':
+            # older clients expect protocol 1 response for terminate_all
+            send_response(result, protocol if protocol >= 3 else 1)
+            send_text('byebye\n')
+            break
+        flush_worker_text()
+        send_response(result, protocol)
+        send_text('?\n')
+
+if __name__ == '__main__':
+    run_evaluator_server()
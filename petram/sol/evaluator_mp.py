@@ -18,8 +18,19 @@ else:
     import mfem.ser as mfem
 
 import multiprocessing as mp
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
 from petram.sol.evaluators import Evaluator, EvaluatorCommon
 
+# when True, workers place the arrays of eval results in a shared memory
+# block and send only small descriptors through result queue.
+use_shared_memory = shared_memory is not None
+# results smaller than this (bytes) are sent through the queue as before.
+shared_memory_min_bytes = 1024*1024
+
 def data_partition(m, num_proc, myid):
     min_nrows  = m // num_proc
     extra_rows = m % num_proc
@@ -28,6 +39,126 @@ def data_partition(m, num_proc, myid):
     nrows   = end_row - start_row
     return start_row, end_row
 
+def _map_leaves(obj, func):
+    if isinstance(obj, list):
+        return [_map_leaves(x, func) for x in obj]
+    if isinstance(obj, tuple):
+        return tuple([_map_leaves(x, func) for x in obj])
+    return func(obj)
+
+def _aligned(nbytes, align=64):
+    return ((nbytes + align - 1)//align)*align
+
+class SharedArray(object):
+    '''
+    descriptor of an array placed in a shared memory block
+    '''
+    def __init__(self, name, shape, dtype, offset):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.offset = offset
+
+def put_in_shared_memory(value):
+    '''
+    copy arrays in (nested list/tuple) value to a shared memory block
+    and replace them by SharedArray descriptors.
+    '''
+    if not use_shared_memory:
+        return value
+
+    arrays = []
+    def collect(x):
+        if isinstance(x, np.ndarray) and not x.dtype.hasobject:
+            arrays.append(x)
+        return x
+    _map_leaves(value, collect)
+
+    nbytes = sum([_aligned(x.nbytes) for x in arrays])
+    if nbytes < shared_memory_min_bytes:
+        return value
+
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    offset = [0]
+    def place(x):
+        if not isinstance(x, np.ndarray) or x.dtype.hasobject:
+            return x
+        dest = np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf,
+                          offset=offset[0])
+        dest[...] = x
+        desc = SharedArray(shm.name, x.shape, x.dtype.str, offset[0])
+        offset[0] = offset[0] + _aligned(x.nbytes)
+        return desc
+    try:
+        value = _map_leaves(value, place)
+    except BaseException:
+        # nobody will read this block
+        shm.close()
+        shm.unlink()
+        raise
+
+    # parent unlinks the block after reading it.
+    shm.close()
+    return value
+
+class SharedArrayReader(object):
+    '''
+    attach shared memory blocks written by workers and make arrays
+    as views of them (no copy).
+    '''
+    def __init__(self):
+        self.blocks = {}
+        # uint8 array over each block. an array is a view of a block
+        # if it shares memory with it. (the base of such view is the
+        # mmap of the block, not shm.buf)
+        self.block_arrays = {}
+
+    def resolve(self, value):
+        def attach(x):
+            if not isinstance(x, SharedArray):
+                return x
+            if x.name not in self.blocks:
+                shm = shared_memory.SharedMemory(name=x.name)
+                self.blocks[x.name] = shm
+                self.block_arrays[x.name] = np.ndarray(shm.size,
+                                                       dtype=np.uint8,
+                                                       buffer=shm.buf)
+            return np.ndarray(x.shape, dtype=np.dtype(x.dtype),
+                              buffer=self.blocks[x.name].buf,
+                              offset=x.offset)
+        return _map_leaves(value, attach)
+
+    def _is_shared(self, x):
+        for block in self.block_arrays.values():
+            if np.may_share_memory(x, block):
+                return True
+        return False
+
+    def detach(self, value):
+        '''
+        copy arrays which still refer shared memory
+        '''
+        def copy(x):
+            if isinstance(x, np.ndarray) and self._is_shared(x):
+                return x.copy()
+            return x
+        return _map_leaves(value, copy)
+
+    def release(self):
+        self.block_arrays = {}
+        for shm in self.blocks.values():
+            try:
+                shm.close()
+            except BufferError:
+                # a view is still alive somewhere. the memory is
+                # freed when it is gone.
+                pass
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.blocks = {}
+
 class BroadCastQueue(object):
    def __init__(self, num):
        self.queue = [None]*num
@@ -60,7 +191,7 @@ class BroadCastQueue(object):
    
 class EvaluatorMPChild(EvaluatorCommon, mp.Process):
     def __init__(self, task_queue, result_queue, myid, rank,
-                 logfile = False, text_queue = None):
+                 logfile = False, text_queue = None, decomposition = True):
 
         mp.Process.__init__(self)
         EvaluatorCommon.__init__(self)
@@ -74,6 +205,10 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
         #self.logfile = 'log'
         self.use_stringio = False
         self.solfiles = None
+        # when there are fewer solfiles than workers, all workers read
+        # the same files and evaluate a disjoint part of geometry
+        self.decomposition = decomposition
+        self.partition = None
         
         ## enable it when checking performance        
         self.use_profiler = False
@@ -182,6 +317,11 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
                     ps.print_stats()
 
 
+                if task[0] in [7, 10]:
+                    try:
+                        value = put_in_shared_memory(value)
+                    except BaseException:
+                        traceback.print_exc()
                 if task[0] in [2, 7, 8, 10, 11]:
                     self.result_queue.put(value)
                     
@@ -198,8 +338,13 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
         self.result_queue.close()
         
     def set_solfiles(self, solfiles):
-        st, et = data_partition(len(solfiles.set), self.rank, self.myid)
-        s = solfiles[st:et]
+        if self.decomposition and len(solfiles.set) < self.rank:
+            self.partition = (self.myid, self.rank)
+            s = solfiles
+        else:
+            self.partition = None
+            st, et = data_partition(len(solfiles.set), self.rank, self.myid)
+            s = solfiles[st:et]
         if len(s) > 0:
             self.solfiles_real = s
             self.solfiles = s
@@ -227,6 +372,23 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
             
         super(EvaluatorMPChild, self).set_model(s.model)
 
+    def make_agents(self, name, params, **kwargs):
+        super(EvaluatorMPChild, self).make_agents(name, params, **kwargs)
+        for key in six.iterkeys(self.agents):
+            for o in self.agents[key]:
+                if self.partition is not None and o.supports_partition:
+                    o.set_partition(*self.partition)
+                else:
+                    o.partition = None
+
+    def skip_agent(self, o):
+        '''
+        in decomposition mode, agents which can not evaluate a part of
+        geometry run only on the first worker.
+        '''
+        return (self.partition is not None and not o.supports_partition
+                and self.myid != 0)
+
     def call_preprocesss_geometry(self, attr, **kwargs):
         solvars = self.load_solfiles()
         for key in six.iterkeys(self.agents):
@@ -248,6 +410,9 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
             attrs.append(key)                                  
             evaluators = self.agents[key]
             for o, solvar in zip(evaluators, solvars): # scan over sol files
+                if self.skip_agent(o):
+                    data[-1].append((None, None, None))
+                    continue
                 try:
                      v, c, a = o.eval(expr, solvar, phys, **kwargs)
                 except:
@@ -289,6 +454,8 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
         evaluators = self.agents[key]
         
         for o, solvar in zip(evaluators, solvars): # scan over sol files
+           if self.skip_agent(o):
+               continue
            try:
                v, c, a = o.eval(expr, solvar, phys, **kwargs)
            except:
@@ -340,6 +507,8 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
         for key in six.iterkeys(self.agents): # scan over battr
             evaluators = self.agents[key]
             for o, solvar in zip(evaluators, solvars): # scan over sol files
+                if self.skip_agent(o):
+                    continue
                 try:
                      v = o.eval_integral(expr, solvar, phys, **kwargs)
                 except:
@@ -362,7 +531,7 @@ class EvaluatorMPChild(EvaluatorCommon, mp.Process):
         
 
 class EvaluatorMP(Evaluator):
-    def __init__(self, nproc = 2, logfile = False):
+    def __init__(self, nproc = 2, logfile = False, decomposition = True):
         super(EvaluatorMP, self).__init__()
         print("new evaluator MP", nproc)
         self.init_done = False        
@@ -381,7 +550,8 @@ class EvaluatorMP(Evaluator):
         for i in range(nproc):
             w = EvaluatorMPChild(self.tasks[i], self.results, i, nproc,
                                  logfile = logfile,
-                                 text_queue = self.text_queue)
+                                 text_queue = self.text_queue,
+                                 decomposition = decomposition)
             self.workers[i] = w
             time.sleep(0.1)
         for w in self.workers:
@@ -484,6 +654,16 @@ class EvaluatorMP(Evaluator):
         for x in range(len(self.workers)):
             self.results.task_done()
 
+        reader = SharedArrayReader()
+        try:
+            data, attrs = self._merge_eval_results(reader.resolve(res),
+                                                   merge_flag1, merge_flag2)
+            data, attrs = reader.detach((data, attrs))
+        finally:
+            reader.release()
+        return data, attrs
+
+    def _merge_eval_results(self, res, merge_flag1, merge_flag2):
         for v, c, a in res: # handle (myid, error, message)
             if c is None and v is not None and a is not None:
                 assert False, a
@@ -582,6 +762,15 @@ class EvaluatorMP(Evaluator):
         for x in range(len(self.workers)):
             self.results.task_done()
 
+        reader = SharedArrayReader()
+        try:
+            ret = self._merge_pointcloud_results(reader.resolve(res))
+            ret = reader.detach(ret)
+        finally:
+            reader.release()
+        return ret
+
+    def _merge_pointcloud_results(self, res):
         res = [x for x in res if x[-1] is not None]
 
         if len(res) == 0:
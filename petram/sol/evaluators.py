@@ -176,9 +176,8 @@ class EvaluatorCommon(Evaluator):
                 gf_var = solvars[0][name]
                 break
 
-            if gf_var is not None and hasattr(gf_var, "deriv_args"):
-                gf_real, gf_imag = gf_var.deriv_args
-                eidx = gf_real._emesh_idx if gf_real is not None else gf_imag._emesh_idx
+            if gf_var is not None and hasattr(type(gf_var), "deriv_args"):
+                eidx = gf_var.get_emesh_idx()[0]
                 phys_root[phys]._emesh_idx = eidx
             else:
                 # For this variable, correnspoinding GridFunction does not exists.
@@ -286,11 +285,13 @@ def_config = {'use_mp': False,
               'use_cs': False,
               'mp_worker': 2,
               'mp_debug': False,
+              'mp_decomposition': True,
               'cs_worker': 4,
               'cs_server': 'localhost',
               'cs_soldir': '',
               'cs_solsubdir': '',
-              'cs_user': ''}
+              'cs_user': '',
+              'cs_protocol': None}  # 3 for binary frames over ssh -T
 
 
 def build_evaluator(params,
@@ -314,7 +315,9 @@ def build_evaluator(params,
     elif config['use_mp']:
         logfile = 'log' if config['mp_debug'] else False
         evaluator = EvaluatorMP(nproc=config['mp_worker'],
-                                logfile=logfile)
+                                logfile=logfile,
+                                decomposition=config.get('mp_decomposition',
+                                                         True))
     elif config['use_cs']:
         solpath = os.path.join(config['cs_soldir'],
                                config['cs_solsubdir'])
@@ -323,7 +326,8 @@ def build_evaluator(params,
                                     soldir=solpath,
                                     user=config['cs_user'],
                                     ssh_opts=config['cs_ssh_opts'],
-                                    mp_debug=config['mp_debug'])
+                                    mp_debug=config['mp_debug'],
+                                    protocol=config.get('cs_protocol', None))
     else:
         raise ValueError("Unknown evaluator mode")
     evaluator.set_model(mfem_model)
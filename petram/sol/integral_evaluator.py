@@ -21,86 +21,127 @@ else:
 from petram.sol.evaluator_agent import EvaluatorAgent
 Geom = mfem.Geometry()
 
-def do_integration(expr, solvars, phys, mesh, kind, attrs,
-                   order, num):
-    from petram.helper.variables import (Variable,
-                                         var_g,
-                                         NativeCoefficientGenBase,
-                                         CoefficientVariable)
-    from petram.phys.coefficient import SCoeff
-
-    code = compile(expr, '<string>', 'eval')
-    names = code.co_names
-
-    g = {}
-    #print solvars.keys()
-    for key in phys._global_ns.keys():
-       g[key] = phys._global_ns[key]
-    for key in solvars.keys():
-       g[key] = solvars[key]
-
-    l = var_g.copy()
-
-    ind_vars = ','.join(phys.get_independent_variables())
-
-    if kind == 'Domain':
-        size = max(max(mesh.attributes.ToList()), max(attrs))
-    else:
-        size = max(max(mesh.bdr_attributes.ToList()), max(attrs))
-        
-    arr = [0]*(size)
-    for k in attrs:
-        arr[k-1] = 1
-    flag = mfem.intArray(arr)
-
-    s = SCoeff(expr, ind_vars, l, g, return_complex=False)
-
-    ## note L2 does not work for boundary....:D
-    if kind == 'Domain':
-        fec = mfem.L2_FECollection(order, mesh.Dimension())
-    else:
-        fec = mfem.H1_FECollection(order, mesh.Dimension())
-
-    fes = mfem.FiniteElementSpace(mesh, fec)
-    one = mfem.ConstantCoefficient(1)
-
-    gf = mfem.GridFunction(fes)
-    gf.Assign(0.0)
-
-    if kind == 'Domain':
-        gf.ProjectCoefficient(mfem.RestrictedCoefficient(s, flag))
-    else:
-        gf.ProjectBdrCoefficient(mfem.RestrictedCoefficient(s, flag), flag)
-
-    b = mfem.LinearForm(fes)
-    one = mfem.ConstantCoefficient(1)
-    if kind == 'Domain':
-        itg = mfem.DomainLFIntegrator(one)
-        b.AddDomainIntegrator(itg)
-    else:
-        itg = mfem.BoundaryLFIntegrator(one)
-        b.AddBoundaryIntegrator(itg)
-
-    b.Assemble()
-
-    from petram.engine import SerialEngine
-    en = SerialEngine()
-    ans = mfem.InnerProduct(en.x2X(gf), en.b2B(b))
-    
-    if not np.isfinite(ans):
-        print("not finite", ans, arr)
-        print(size, mesh.bdr_attributes.ToList())
-        from mfem.common.chypre import LF2PyVec, PyVec2PyMat, Array2PyVec, IdentityPyMat
-        #print(list(gf.GetDataArray()))
-        print(len(gf.GetDataArray()), np.sum(gf.GetDataArray()))
-        print(np.sum(list(b.GetDataArray())))
-    return ans
+class QuadraturePoints(object):
+    '''
+    quadrature points on elements (Domain) or boundary elements
+    (Boundary) of given attributes.
+
+    each point is given as a (volume) element id and an integration
+    point on it, so that Variable.point_values can be used.
+    weights include detJ.
+    '''
+    def __init__(self, mesh, kind, attrs, order, partition=None):
+        self.knowns = WKD()
+        self.eval_mode = None
+
+        sdim = mesh.SpaceDimension()
+        attrs = set(attrs)
+        if kind == 'Domain':
+            ielements = [i for i in range(mesh.GetNE())
+                         if mesh.GetAttribute(i) in attrs]
+        else:
+            ielements = [i for i in range(mesh.GetNBE())
+                         if mesh.GetBdrAttribute(i) in attrs]
+        if partition is not None:
+            ielements = partition(ielements)
+
+        locs = []
+        weights = []
+        elem_ids = []
+        int_points = []
+
+        for i in ielements:
+            if kind == 'Domain':
+                T = mesh.GetElementTransformation(i)
+                geom = mesh.GetElementBaseGeometry(i)
+            else:
+                T = mesh.GetBdrElementTransformation(i)
+                geom = mesh.GetBdrElementBaseGeometry(i)
+                # boundary points are evaluated on the adjacent element
+                ftr = mesh.GetBdrFaceTransformations(i)
+
+            intorder = 2*order + T.OrderW()
+            ir = mfem.IntRules.Get(geom, intorder)
+            for j in range(ir.GetNPoints()):
+                ip = ir.IntPoint(j)
+                T.SetIntPoint(ip)
+                locs.append(np.array(T.Transform(ip)))
+                weights.append(ip.weight * T.Weight())
+                if kind == 'Domain':
+                    elem_ids.append(i)
+                    int_points.append(ip)
+                else:
+                    eip = mfem.IntegrationPoint()
+                    ftr.Loc1.Transform(ip, eip)
+                    elem_ids.append(ftr.Elem1No)
+                    int_points.append(eip)
+
+        self.counts = len(weights)
+        self.locs = np.array(locs).reshape(-1, sdim)
+        self.weights = np.array(weights)
+        self.elem_ids = elem_ids
+        self.int_points = int_points
+        self.attrs = np.array([mesh.GetAttribute(i) for i in elem_ids],
+                              dtype=int)
+
+    def integrate(self, expr, solvars, phys, mesh):
+        from petram.sol.pointcloud_evaluator import eval_expr_at_points
+
+        if self.counts == 0:
+            return 0.0
+        val, mode = eval_expr_at_points(expr, solvars, phys, self.knowns,
+                                        counts=self.counts,
+                                        locs=self.locs,
+                                        attrs=self.attrs,
+                                        elem_ids=self.elem_ids,
+                                        mesh=mesh,
+                                        int_points=self.int_points)
+        self.eval_mode = mode
+        val = np.asarray(val)
+        if np.iscomplexobj(val):
+            # same as SCoeff(return_complex=False) used before
+            val = val.real
+        ans = np.tensordot(self.weights, val, axes=(0, 0))
+        if not np.all(np.isfinite(ans)):
+            print("not finite", ans, mode)
+        return ans
+
 
 class IntegralEvaluator(EvaluatorAgent):
+    supports_partition = True
+
     def __init__(self, battrs, decimate=1):
         super(IntegralEvaluator, self).__init__()
         self.battrs = battrs
         self.decimate = decimate
+        # (emesh_idx, kind, attrs, order) -> QuadraturePoints
+        self.quadratures = {}
+
+    def set_mesh(self, mesh):
+        super(IntegralEvaluator, self).set_mesh(mesh)
+        self.quadratures = {}
+
+    def forget_knowns(self):
+        super(IntegralEvaluator, self).forget_knowns()
+        for q in self.quadratures.values():
+            q.knowns = WKD()
+
+    def get_quadrature(self, emesh_idx, kind, attrs, order):
+        mesh = self.mesh()[emesh_idx]
+        if isinstance(attrs, str):
+            # 'all' : every domain (boundary) attribute of the mesh
+            if attrs != 'all':
+                assert False, "attrs must be 'all' or a list of attributes: " + attrs
+            if kind == 'Domain':
+                attrs = mesh.attributes.ToList()
+            else:
+                attrs = mesh.bdr_attributes.ToList()
+
+        key = (emesh_idx, kind, tuple(sorted(attrs)), order)
+        if key not in self.quadratures:
+            self.quadratures[key] = QuadraturePoints(mesh, kind, attrs, order,
+                                                     partition=self.select_partition)
+        return self.quadratures[key]
 
     def eval_integral(self, expr, solvars, phys,
                       kind='domain', attrs='all', order=2, num=-1):
@@ -113,6 +154,8 @@ class IntegralEvaluator(EvaluatorAgent):
             assert False, "expression involves multiple mesh (emesh length != 1)"
 
         mesh = self.mesh()[emesh_idx[0]]
-        itg = do_integration(expr, solvars, phys, mesh, kind, attrs, order, num)
+        quad = self.get_quadrature(emesh_idx[0], kind, attrs, order)
+        itg = quad.integrate(expr, solvars, phys, mesh)
+        self.eval_mode = quad.eval_mode
 
         return itg
@@ -15,9 +15,129 @@ else:
 from petram.sol.evaluator_agent import EvaluatorAgent
 from petram.sol.bdr_nodal_evaluator import process_iverts2nodals
 from petram.sol.bdr_nodal_evaluator import eval_at_nodals, get_emesh_idx
+from petram.sol.bdr_nodal_evaluator import eval_code_at_points
+
+
+def eval_expr_at_points(expr, solvars, phys, knowns, counts=None, locs=None,
+                        attrs=None, elem_ids=None, mesh=None, int_points=None):
+    '''
+    evaluate expression at points given by (elem_ids, int_points).
+    points whose attrs is -1 are skipped.
+
+    returns (value, mode) (see eval_code_at_points)
+    '''
+    from petram.helper.variables import (Variable,
+                                         var_g,
+                                         NativeCoefficientGenBase,
+                                         CoefficientVariable,
+                                         NumbaCoefficientVariable)
+
+    variables = []
+    code = compile(expr, '<string>', 'eval')
+    names = code.co_names
+
+    g = {}
+    # print solvars.keys()
+    for key in phys._global_ns.keys():
+        g[key] = phys._global_ns[key]
+    for key in solvars.keys():
+        g[key] = solvars[key]
+
+    ll_name = []
+    ll_value = []
+    var_g2 = var_g.copy()
+
+    new_names = []
+    name_translation = {}
+
+    all_names = list(names[:])
+
+    def get_names(names):
+        for n in names:
+            if (n in g and isinstance(g[n], Variable)):
+                new_names = g[n].get_names()
+                for x in new_names:
+                    all_names.append(x)
+                get_names(new_names)
+    get_names(names)
+
+    for n in all_names:
+        if (n in g and isinstance(g[n], NativeCoefficientGenBase)):
+            g[n+"_coeff"] = CoefficientVariable(g[n], g)
+            new_names.append(n+"_coeff")
+            name_translation[n+"_coeff"] = n
+
+        elif (n in g and isinstance(g[n], NumbaCoefficientVariable)):
+            ind_vars = [xx.strip() for xx in phys.ind_vars.split(',')]
+            if g[n].has_dependency():
+                g[n].forget_jitted_coefficient()
+            g[n].set_coeff(ind_vars, g)
+            new_names.append(n)
+            name_translation[n] = n
+
+        elif (n in g and isinstance(g[n], Variable)):
+            for x in g[n].dependency:
+                new_names.append(x)
+                name_translation[x] = x
+
+            for x in g[n].grad:
+                new_names.append('grad'+x)
+                name_translation['grad'+x] = 'grad'+x
+                if 'grad'+x not in g:
+                    g['grad'+x] = g[x].generate_grad_variable()
+
+            for x in g[n].curl:
+                new_names.append('curl'+x)
+                name_translation['curl'+x] = 'curl'+x
+                if 'curl'+x not in g:
+                    g['curl'+x] = g[x].generate_curl_variable()
+
+            for x in g[n].div:
+                new_names.append('div'+x)
+                name_translation['div'+x] = 'div'+x
+                if 'div'+x not in g:
+                    g['div'+x] = g[x].generate_div_variable()
+
+            new_names.append(n)
+            name_translation[n] = n
+
+        elif n in g:
+            new_names.append(n)
+            name_translation[n] = n
+
+    for n in new_names:
+        if (n in g and isinstance(g[n], Variable)):
+            if not g[n] in knowns:
+                knowns[g[n]] = g[n].point_values(counts=counts,
+                                                 locs=locs,
+                                                 attrs=attrs,
+                                                 elem_ids=elem_ids,
+                                                 mesh=mesh,
+                                                 int_points=int_points,
+                                                 g=g,
+                                                 knowns=knowns)
+
+            #ll[n] = knowns[g[n]]
+            ll_name.append(name_translation[n])
+            ll_value.append(knowns[g[n]])
+        elif (n in g):
+            var_g2[n] = g[n]
+
+    if len(ll_value) > 0:
+        val, mode = eval_code_at_points(code, var_g2, ll_name, ll_value)
+    else:
+        # if expr does not involve Varialbe, evaluate code once
+        # and generate an array
+        val = np.array([eval(code, var_g2)]*len(locs))
+        mode = 'constant'
+
+    return val, mode
+
 
 
 class PointcloudEvaluator(EvaluatorAgent):
+    supports_partition = True
+
     def __init__(self, attrs, pc_type=None, pc_param=None):
         '''
            attrs = [1,2,3]
@@ -141,16 +261,28 @@ class PointcloudEvaluator(EvaluatorAgent):
                 self.points = ptx.reshape(-1, self.ans_points.shape[-1])
                 self.subset = subset
 
-        if out_of_range:
+        # search only points assigned to this agent
+        ipoints = self.select_partition(np.arange(len(self.points)))
+
+        if out_of_range or len(ipoints) == 0:
             counts = 0
             elem_ids = np.zeros(len(self.points), dtype=int)-1
             int_points = [None]*len(self.points)
             print("skipping mesh")
         else:
-            print("Chekcing " + str(len(self.points)) + " points")
-            counts, elem_ids, int_points = mesh.FindPoints(
-                self.points, warn=False)
+            print("Chekcing " + str(len(ipoints)) + " points")
+            counts, elem_ids0, int_points0 = mesh.FindPoints(
+                self.points[ipoints], warn=False)
             print("FindPoints found " + str(counts) + " points")
+            if len(ipoints) == len(self.points):
+                elem_ids, int_points = elem_ids0, int_points0
+            else:
+                elem_ids = np.zeros(len(self.points), dtype=int)-1
+                int_points = [None]*len(self.points)
+                elem_ids[ipoints] = elem_ids0
+                elem_ids = elem_ids.tolist()
+                for i, ip in zip(ipoints, int_points0):
+                    int_points[i] = ip
         attrs = [mesh.GetAttribute(id) if id != -1 else -1 for id in elem_ids]
         attrs = np.array([i if i in self.attrs else -1 for i in attrs])
 
@@ -171,112 +303,14 @@ class PointcloudEvaluator(EvaluatorAgent):
         self.knowns = WKD()
 
     def eval_at_points(self, expr, solvars, phys):
-        from petram.helper.variables import (Variable,
-                                             var_g,
-                                             NativeCoefficientGenBase,
-                                             CoefficientVariable,
-                                             NumbaCoefficientVariable)
-
-        variables = []
-        code = compile(expr, '<string>', 'eval')
-        names = code.co_names
-
-        g = {}
-        # print solvars.keys()
-        for key in phys._global_ns.keys():
-            g[key] = phys._global_ns[key]
-        for key in solvars.keys():
-            g[key] = solvars[key]
-
-        ll_name = []
-        ll_value = []
-        var_g2 = var_g.copy()
-
-        new_names = []
-        name_translation = {}
-
-        all_names = list(names[:])
-
-        def get_names(names):
-            for n in names:
-                if (n in g and isinstance(g[n], Variable)):
-                    new_names = g[n].get_names()
-                    for x in new_names:
-                        all_names.append(x)
-                    get_names(new_names)
-        get_names(names)
-
-        for n in all_names:
-            if (n in g and isinstance(g[n], NativeCoefficientGenBase)):
-                g[n+"_coeff"] = CoefficientVariable(g[n], g)
-                new_names.append(n+"_coeff")
-                name_translation[n+"_coeff"] = n
-
-            elif (n in g and isinstance(g[n], NumbaCoefficientVariable)):
-                ind_vars = [xx.strip() for xx in phys.ind_vars.split(',')]
-                if g[n].has_dependency():
-                    g[n].forget_jitted_coefficient()
-                g[n].set_coeff(ind_vars, g)
-                new_names.append(n)
-                name_translation[n] = n
-
-            elif (n in g and isinstance(g[n], Variable)):
-                for x in g[n].dependency:
-                    new_names.append(x)
-                    name_translation[x] = x
-
-                for x in g[n].grad:
-                    new_names.append('grad'+x)
-                    name_translation['grad'+x] = 'grad'+x
-                    if 'grad'+x not in g:
-                        g['grad'+x] = g[x].generate_grad_variable()
-
-                for x in g[n].curl:
-                    new_names.append('curl'+x)
-                    name_translation['curl'+x] = 'curl'+x
-                    if 'curl'+x not in g:
-                        g['curl'+x] = g[x].generate_curl_variable()
-
-                for x in g[n].div:
-                    new_names.append('div'+x)
-                    name_translation['div'+x] = 'div'+x
-                    if 'div'+x not in g:
-                        g['div'+x] = g[x].generate_div_variable()
-
-                new_names.append(n)
-                name_translation[n] = n
-
-            elif n in g:
-                new_names.append(n)
-                name_translation[n] = n
-
-        for n in new_names:
-            if (n in g and isinstance(g[n], Variable)):
-                if not g[n] in self.knowns:
-                    self.knowns[g[n]] = g[n].point_values(counts=self.counts,
-                                                          locs=self.locs,
-                                                          attrs=self.masked_attrs,
-                                                          elem_ids=self.elem_ids,
-                                                          mesh=self.mesh()[
-                                                              self.emesh_idx],
-                                                          int_points=self.int_points,
-                                                          g=g,
-                                                          knowns=self.knowns)
-
-                #ll[n] = self.knowns[g[n]]
-                ll_name.append(name_translation[n])
-                ll_value.append(self.knowns[g[n]])
-            elif (n in g):
-                var_g2[n] = g[n]
-
-        if len(ll_value) > 0:
-            val = np.array([eval(code, var_g2, dict(zip(ll_name, v)))
-                            for v in zip(*ll_value)])
-        else:
-            # if expr does not involve Varialbe, evaluate code once
-            # and generate an array
-            val = np.array([eval(code, var_g2)]*len(self.locs))
-
+        val, mode = eval_expr_at_points(expr, solvars, phys, self.knowns,
+                                        counts=self.counts,
+                                        locs=self.locs,
+                                        attrs=self.masked_attrs,
+                                        elem_ids=self.elem_ids,
+                                        mesh=self.mesh()[self.emesh_idx],
+                                        int_points=self.int_points)
+        self.eval_mode = mode
         return val
 
     def eval(self, expr, solvars, phys):
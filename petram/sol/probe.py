@@ -1,5 +1,6 @@
 import numpy as np
 import os
+import json
 
 from petram.mfem_config import use_parallel
 if use_parallel:
@@ -11,6 +12,13 @@ else:
     myid = 0
     smyid = ''
 
+# format 2 : binary (append-only)
+#    format : 2\n
+#    {"xnames": [...], "xdtype": "<f8", "xsize": n,
+#     "ydtype": "<c16", "ysize": m}\n
+#    followed by fixed size records of (x[n], y[m])
+default_format = 2
+
 
 def list_probes(dir):
     od = os.getcwd()
@@ -27,8 +35,17 @@ def list_probes(dir):
 
 
 def load_probe(name):
+    # format 2 file is binary after the first line.
+    with open(name, 'rb') as fid:
+        format = int(fid.readline().decode().split(':')[-1])
+
+    if format == 2:
+        xdata, ydata, names = load_format_2(name)
+        xdata = {n: xdata[k] for k, n in enumerate(names)}
+        return xdata, ydata
+
     fid = open(name, 'r')
-    format = int(fid.readline().split(':')[-1])
+    fid.readline()
 
     if format == 0:
         value = load_format_0(fid)
@@ -80,6 +97,43 @@ def load_format_1(fid):
     return xdata, ydata, xnames
 
 
+def _record_dtype(header):
+    return np.dtype([('x', header["xdtype"], (header["xsize"],)),
+                     ('y', header["ydtype"], (header["ysize"],))])
+
+
+def read_header_2(name):
+    '''
+    returns (header, offset to the first record)
+    '''
+    with open(name, 'rb') as fid:
+        fid.readline()
+        header = json.loads(fid.readline().decode())
+        offset = fid.tell()
+    return header, offset
+
+
+def load_format_2(name):
+    '''
+    memory-map records. a record partially written at the end
+    is ignored.
+    '''
+    header, offset = read_header_2(name)
+    dtype = _record_dtype(header)
+
+    size = (os.path.getsize(name) - offset)//dtype.itemsize
+    if size == 0:
+        data = np.zeros(0, dtype=dtype)
+    else:
+        data = np.memmap(name, dtype=dtype, mode='r', offset=offset,
+                         shape=(size,))
+
+    xdata = data['x'].transpose()
+    ydata = data['y'].transpose()
+
+    return xdata, ydata, header["xnames"]
+
+
 class Probe(object):
     def __new__(cls, *args, **kargs):
         root_only = kargs.pop("root_only", False)
@@ -100,18 +154,36 @@ class Probe(object):
         self.idx = idx
         self.finalized = False
 
-    def write_file(self, filename=None, format=1, nosmyid=False):
+        # stream = True : write each new value to file (format 2)
+        self.stream = kwargs.pop("stream", False)
+        self._written = None    # (filename, header, number of rows)
+
+    def get_filename(self, nosmyid=False):
+        if nosmyid:
+            return 'probe_'+self.name
+        else:
+            return 'probe_'+self.name + smyid
+
+    def write_file(self, filename=None, format=None, nosmyid=False):
+        if filename is None:
+            filename = self.get_filename(nosmyid=nosmyid)
+        if format is None:
+            format = default_format
+
+        if format == 2:
+            if self.write_format_2(filename):
+                return
+            # x/y are not numbers. fall back to text
+            format = 1
+
         valid = self.finalize()
         if not valid:
             return
 
-        if filename is None:
-            if nosmyid:
-                filename = 'probe_'+self.name
-            else:
-                filename = 'probe_'+self.name + smyid
-
-        fid = open(filename, 'w')
+        self._written = None
+        # the file may be memory-mapped by a reader (format 2)
+        tmp = filename + '.' + str(os.getpid()) + '.tmp'
+        fid = open(tmp, 'w')
 
         if format == 0:
             fid.write("format : 0\n")
@@ -125,14 +197,114 @@ class Probe(object):
             txt2 = ', '.join([str(xx) for xx in x])
             fid.write(txt1 + ', ' + txt2 + "\n")
         fid.close()
+        os.replace(tmp, filename)
+
+    def make_header_2(self, t, sig, header=None):
+        '''
+        header for rows (t, sig). if header is given, it is extended
+        to accomodate the rows.
+        '''
+        try:
+            x = np.vstack(t)
+        except ValueError:
+            return None
+        if (x.dtype.kind not in 'biufc' or
+                any([y.dtype.kind not in 'biufc' for y in sig])):
+            return None
+
+        iscomplex = np.any([np.iscomplexobj(y) for y in sig])
+        ysize = max([int(np.prod(y.shape)) for y in sig])
+        xdtype = complex if x.dtype.kind == 'c' else float
+        ydtype = complex if iscomplex else float
+
+        new_header = {"xnames": list(self.xnames),
+                      "xdtype": np.dtype(xdtype).str,
+                      "xsize": int(x.shape[1]),
+                      "ydtype": np.dtype(ydtype).str,
+                      "ysize": ysize}
+        if header is None:
+            return new_header
+        if header["xsize"] != new_header["xsize"]:
+            return None
+        for k in ("xdtype", "ydtype"):
+            if header[k] == np.dtype(complex).str:
+                new_header[k] = header[k]
+        new_header["ysize"] = max(header["ysize"], ysize)
+        return new_header
+
+    def write_format_2(self, filename):
+        '''
+        write rows not written yet. the file is rewritten
+        if the row size or dtype changed.
+        returns False if data can not be written in format 2.
+        '''
+        if len(self.sig) == 0:
+            return True
+
+        nrows = 0
+        header = None
+        if (self._written is not None and
+                self._written[0] == os.path.abspath(filename) and
+                os.path.exists(filename)):
+            nrows = self._written[2]
+            header = self._written[1]
+
+        if nrows == len(self.sig):
+            return True
+
+        new_header = self.make_header_2(self.t[nrows:], self.sig[nrows:],
+                                        header=header)
+        if new_header is None or new_header != header:
+            # start from the begining
+            nrows = 0
+            header = self.make_header_2(self.t, self.sig)
+            if header is None:
+                return False
+            if header["ysize"] == 0:
+                return True
+
+        dtype = _record_dtype(header)
+        rows = np.zeros(len(self.sig) - nrows, dtype=dtype)
+        rows['x'] = np.vstack(self.t[nrows:])
+        rows['y'] = np.nan
+        for k, y in enumerate(self.sig[nrows:]):
+            rows['y'][k, :y.size] = y.flatten()
+
+        if nrows == 0:
+            # readers may hold memmap of the file. truncating it under
+            # them causes SIGBUS. a new file replaces it instead.
+            tmp = filename + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp, 'wb') as fid:
+                fid.write(b"format : 2\n")
+                fid.write(json.dumps(header).encode() + b"\n")
+                fid.write(rows.tobytes())
+            os.replace(tmp, filename)
+        else:
+            with open(filename, 'ab') as fid:
+                fid.write(rows.tobytes())
+
+        self._written = (os.path.abspath(filename), header, len(self.sig))
+        return True
+
+    def flush(self):
+        '''
+        write new values (format 2)
+        '''
+        self.write_file(format=2)
 
     def append_sol(self, sol, t=0.0):
         self.sig.append(np.atleast_1d(sol[self.idx].toarray().flatten()))
         self.t.append(np.atleast_1d(t))
+        self.finalized = False
+        if self.stream:
+            self.flush()
 
     def append_value(self, value, t=0.0):
         self.sig.append(np.atleast_1d(value))
         self.t.append(np.atleast_1d(t))
+        self.finalized = False
+        if self.stream:
+            self.flush()
 
     def current_value(self, sol):
         return np.atleast_1d(sol[self.idx].toarray().flatten())
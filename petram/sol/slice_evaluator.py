@@ -17,6 +17,8 @@ from petram.sol.bdr_nodal_evaluator import process_iverts2nodals
 from petram.sol.bdr_nodal_evaluator import eval_at_nodals, get_emesh_idx
 
 class SliceEvaluator(EvaluatorAgent):
+    supports_partition = True
+
     def __init__(self, attrs, plane = None):
         '''
            attrs = [1,2,3]
@@ -50,6 +52,7 @@ class SliceEvaluator(EvaluatorAgent):
         if np.sum([len(xx) for xx in x]) == 0: return
 
         ialleles = np.hstack(x).astype(int).flatten()
+        ialleles = self.select_partition(ialleles)
         ieles = []
         num_tri = 0
         tri_iverts = []
@@ -3,6 +3,7 @@ from __future__ import print_function
 import os
 import six
 import numpy as np
+from weakref import WeakValueDictionary as WVD
 
 
 class Solfiles(object):
@@ -86,7 +87,100 @@ class Solfiles(object):
 
 
 class MeshDict(dict):
-    pass
+    '''
+    emesh_idx -> mfem.Mesh
+
+    meshes are read from file on first access
+    '''
+
+    def __init__(self, files):
+        dict.__init__(self, {i: None for i in files})
+        self._files = files
+
+    def __getitem__(self, idx):
+        m = dict.__getitem__(self, idx)
+        if m is None:
+            m = load_mesh(self._files[idx])
+            m._emesh_idx = idx
+            dict.__setitem__(self, idx, m)
+        return m
+
+    def get(self, idx, default=None):
+        if idx in self:
+            return self[idx]
+        return default
+
+    def values(self):
+        return [self[i] for i in self]
+
+    def items(self):
+        return [(i, self[i]) for i in self]
+
+    def is_loaded(self, idx):
+        return dict.__getitem__(self, idx) is not None
+
+
+def load_mesh(path):
+    import mfem.ser as mfem
+
+    fix_orientation = False  #false
+    generate_edge = 1       #1
+    refine = 0              #1
+    # what is this refine = 0 !?
+    return mfem.Mesh(str(path), generate_edge, refine, fix_orientation)
+
+
+class LazyGridFunction(object):
+    '''
+    GridFunction in a solset, read from file on first use.
+
+    load() returns the GridFunction. the loaded GridFunction is shared
+    through a weak cache in Solsets, thus it is read again only after
+    all users (solvars) are gone. other attributes are forwarded to
+    the GridFunction, which is then kept by this object (an object
+    returned from GridFunction, such as FESpace, may depend on it).
+    '''
+    is_lazy_gridfunction = True
+
+    def __init__(self, solsets, meshes, emesh_idx, path):
+        self._solsets = solsets
+        self._meshes = meshes
+        self._emesh_idx = emesh_idx
+        self.path = path
+        # piece in a single file solution (see petram.helper.solfile)
+        self._key = (str(path), getattr(path, 'piece', None))
+        self._gf = None
+
+    def __repr__(self):
+        return "LazyGridFunction(" + str(self.path) + ")"
+
+    def is_loaded(self):
+        return self._key in self._solsets.gf_cache
+
+    def load(self):
+        from petram.helper.solfile import read_gridfunction
+
+        cache = self._solsets.gf_cache
+        gf = cache.get(self._key, None)
+        if gf is None:
+            mesh = self._meshes[self._emesh_idx]
+            gf = read_gridfunction(mesh, self.path)
+            gf._emesh_idx = self._emesh_idx
+            gf._mesh_link = mesh
+            cache[self._key] = gf
+        return gf
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        self._gf = self.load()
+        return getattr(self._gf, name)
+
+
+def resolve_gridfunction(gf):
+    if getattr(type(gf), 'is_lazy_gridfunction', False):
+        return gf.load()
+    return gf
 
 
 class Solsets(object):
@@ -94,6 +188,8 @@ class Solsets(object):
     Solsets: bundle of GridFunctions
 
       methes: names, meshes, gfr, gfi
+
+      meshes and GridFunctions are loaded when they are used first.
     '''
 
     def __init__(self, solfiles, refine=0):
@@ -103,40 +199,20 @@ class Solsets(object):
         solfiles = solfiles.set
         object.__init__(self)
         self.set = []
-        import mfem.ser as mfem
+        self.gf_cache = WVD()
 
-        fix_orientation = False  #false
-        generate_edge = 1       #1
-        refine = 0              #1
-        
         for meshes, solf, in solfiles:
             idx = [fname2idx(x) for x in meshes]
-            meshes = {
-                i: mfem.Mesh(
-                    str(x),
-                    generate_edge,
-                    refine,
-                    fix_orientation) for i, x in zip(
-                    idx, meshes)}
-            meshes = MeshDict(meshes)  # to make dict weakref-able
-            # what is this refine = 0 !?
-            for i in idx:
-                # meshes[i].ReorientTetMesh()
-                meshes[i]._emesh_idx = i
+            meshes = MeshDict({i: x for i, x in zip(idx, meshes)})
             s = {}
             for key in six.iterkeys(solf):
                 fr, fi = solf[key]
                 i = fname2idx(fr)
-                m = meshes[i]
 
-                solr = (mfem.GridFunction(m, str(fr))
+                solr = (LazyGridFunction(self, meshes, i, fr)
                         if fr is not None else None)
-                soli = (mfem.GridFunction(m, str(fi))
+                soli = (LazyGridFunction(self, meshes, i, fi)
                         if fi is not None else None)
-                if solr is not None:
-                    solr._emesh_idx = i
-                if soli is not None:
-                    soli._emesh_idx = i
 
                 s[key] = (solr, soli)
             self.set.append((meshes, s))
@@ -159,14 +235,15 @@ class Solsets(object):
         return tuple(set(ret))
 
     def gfr(self, name):
-        return [x[1][name][0] for x in self.set]
+        return [resolve_gridfunction(x[1][name][0]) for x in self.set]
 
     def gfi(self, name):
-        return [x[1][name][1] for x in self.set]
+        return [resolve_gridfunction(x[1][name][1]) for x in self.set]
 
 
 def find_solfiles(path, idx=None):
     import os
+    from petram.helper.solfile import find_solfile, aggregated_suffix
 
     files = os.listdir(path)
     mfiles = [x for x in files if x.startswith('solmesh')]
@@ -198,14 +275,17 @@ def find_solfiles(path, idx=None):
                  x.endswith(s)]
         solis = [x for x in solifile if (len(x.split('.')) == 1 and s == '') or
                  x.endswith(s)]
+        # single file per field (all ranks) is used if the file for
+        # the rank does not exist
+        solrs = solrs + [x for x in solrfile
+                         if x.endswith(aggregated_suffix)]
         names = ['_'.join(x.split('.')[0].split('_')[1:]) for x in solrs]
+        names = list(dict.fromkeys(names))
 
         sol = {}
         for n in names:
-            solr = (os.path.join(path, 'solr_' + n + s)
-                    if ('solr_' + n + s) in solrfile else None)
-            soli = (os.path.join(path, 'soli_' + n + s)
-                    if ('soli_' + n + s) in solifile else None)
+            solr = find_solfile(os.path.join(path, 'solr_' + n), s)
+            soli = find_solfile(os.path.join(path, 'soli_' + n), s)
 
             if solr is None:
                 continue
@@ -0,0 +1,165 @@
+'''
+   factorization_cache
+
+   LRU cache of assembled blocks and factorized linear solvers used by
+   time-domain solvers. Entries are keyed by time step (or its level in
+   adaptive stepping).
+
+   The size of each entry is estimated on each rank from the solver
+   (factor_memory hook, such as INFO(9) of MUMPS) or from nnz of the
+   local operator. The least recently used entries are dropped when
+   the total exceeds the memory budget or the number of entries
+   exceeds max_entries.
+
+   In parallel, the per-rank sizes are reduced (max) over ranks, so
+   that the budget bounds the memory of the largest rank and all ranks
+   drop the same entries.
+'''
+from collections import OrderedDict
+
+import petram.debug as debug
+dprint1, dprint2, dprint3 = debug.init_dprints("FactorizationCache")
+
+# factor size is estimated as fill_factor * size of operator,
+# when the linear solver does not tell it.
+default_fill_factor = 10
+
+
+def estimate_operator_size(AA):
+    '''
+    memory size (bytes) of an assembled operator. returns 0 if unknown
+    '''
+    nnz = getattr(AA, 'nnz', None)
+    if nnz is None and hasattr(AA, 'NNZ'):
+        nnz = AA.NNZ()
+    if nnz is None:
+        return 0
+    if callable(nnz):
+        nnz = nnz()
+    dtype = getattr(AA, 'dtype', None)
+    itemsize = dtype.itemsize if dtype is not None else 8
+    # value + row/col index
+    return int(nnz) * (itemsize + 8)
+
+
+def estimate_factor_size(solver, AA=None):
+    if solver is not None and hasattr(solver, 'factor_memory'):
+        size = solver.factor_memory()
+        if size is not None:
+            return int(size)
+    if AA is None:
+        return 0
+    return default_fill_factor * estimate_operator_size(AA)
+
+
+class CacheEntry():
+    def __init__(self, blocks=None):
+        self.blocks = blocks
+        self.solver = None
+        self.size = 0
+
+
+class FactorizationCache():
+    def __init__(self, max_memory=0, max_entries=0, min_entries=1,
+                 name=''):
+        '''
+        max_memory : memory budget in MB (0: no limit)
+        max_entries : maximum number of entries (0: no limit)
+        min_entries : number of most recently used entries which are
+                      never dropped (entries in use in the current step)
+        '''
+        self.max_memory = float(max_memory) * 1024 * 1024
+        self.max_entries = int(max_entries)
+        self.min_entries = max(int(min_entries), 1)
+        self.name = name
+
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''
+        returns CacheEntry (or None) and marks it most recently used
+        '''
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, blocks=None):
+        '''
+        add a new entry (assembled blocks)
+        '''
+        entry = CacheEntry(blocks)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.evict()
+        return entry
+
+    def set_solver(self, key, solver, AA=None):
+        '''
+        set factorized solver to the entry. AA is used to estimate
+        the factor size when solver does not provide it.
+        '''
+        if key in self.entries:
+            entry = self.entries[key]
+            self.entries.move_to_end(key)
+        else:
+            entry = self.put(key)
+        entry.solver = solver
+        entry.size = _global_max(estimate_factor_size(solver, AA=AA))
+        dprint2("factor size (" + str(key) + ") : " +
+                "{:.1f}".format(entry.size / 1024. / 1024.) + "MB")
+        self.evict()
+        return entry
+
+    @property
+    def memory(self):
+        return sum([e.size for e in self.entries.values()])
+
+    def evict(self):
+        def exceeded():
+            if (self.max_entries > 0 and
+                    len(self.entries) > self.max_entries):
+                return True
+            if self.max_memory > 0 and self.memory > self.max_memory:
+                return True
+            return False
+
+        while len(self.entries) > self.min_entries and exceeded():
+            key, entry = self.entries.popitem(last=False)
+            dprint1("dropping cached factorization (" + str(key) + ")")
+            entry.solver = None
+            entry.blocks = None
+            self.evictions += 1
+
+    def clear(self):
+        self.entries = OrderedDict()
+
+    def format_stats(self):
+        return ("factorization cache " + self.name + ": hits=" +
+                str(self.hits) + " misses=" + str(self.misses) +
+                " evictions=" + str(self.evictions) +
+                " entries=" + str(len(self.entries)) +
+                " memory=" + "{:.1f}".format(self.memory / 1024. / 1024.) +
+                "MB")
+
+    def report(self):
+        dprint1(self.format_stats())
+
+
+def _global_max(value):
+    from petram.mfem_config import use_parallel
+    if use_parallel:
+        from mpi4py import MPI
+        value = MPI.COMM_WORLD.allreduce(value, op=MPI.MAX)
+    return value
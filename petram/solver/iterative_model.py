@@ -112,7 +112,12 @@ class Iterative(LinearSolverModel, NS_mixin):
                     "text": "Reduce linear system when possible"}],
                 [None, (self.merge_real_imag, (self.use_block_symmetric,)),
                  27, ({"text": "Use ComplexOperator"}, {"elp": mm},)],
-                ["use dist, SOL (dev.)", self.use_dist_sol, 3, {"text": ""}], ]
+                ["use dist, SOL (dev.)", self.use_dist_sol, 3, {"text": ""}],
+                [None, self.use_rhs_projection, 3,
+                    {"text": "reuse solutions for multiple RHS"}],
+                ["recycled vectors", self.recycle_dim, 400, {}],
+                ["initial guess", self.extrapolation, 1,
+                    {"values": ["zero", "linear", "quadratic"]}], ]
 
     def get_panel1_value(self):
         # this will set _mat_weight
@@ -154,7 +159,10 @@ class Iterative(LinearSolverModel, NS_mixin):
                  self.write_mat, self.assert_no_convergence,
                  self.use_ls_reducer,
                  (self.merge_real_imag, [self.use_block_symmetric, ]),
-                 self.use_dist_sol)
+                 self.use_dist_sol,
+                 self.use_rhs_projection,
+                 self.recycle_dim,
+                 self.extrapolation)
 
         return value
 
@@ -191,6 +199,9 @@ class Iterative(LinearSolverModel, NS_mixin):
         self.merge_real_imag = bool(v[5][0])
         self.use_block_symmetric = bool(v[5][1][0])
         self.use_dist_sol = bool(v[6])
+        self.use_rhs_projection = bool(v[7])
+        self.recycle_dim = int(v[8])
+        self.extrapolation = str(v[9])
 
     def attribute_set(self, v):
         v = super(Iterative, self).attribute_set(v)
@@ -219,6 +230,12 @@ class Iterative(LinearSolverModel, NS_mixin):
         v['adv_prc'] = ''
         v['merge_real_imag'] = False
         v['use_block_symmetric'] = False
+        # initial guess of RHS projected on the previous solutions
+        v['use_rhs_projection'] = False
+        # number of solution vectors kept over Mult calls (0: off)
+        v['recycle_dim'] = 0
+        # initial guess extrapolated in time from previous solutions
+        v['extrapolation'] = 'zero'
         return v
 
     def verify_setting(self):
@@ -344,6 +361,9 @@ class IterativeSolver(LinearSolver):
         self.abstol = abstol
         self.reltol = reltol
         self.kdim = kdim
+        self.recycle_space = None   # SolutionSpace kept over Mult calls
+        self.history = []           # (t, solution) for extrapolation
+        self.last_iterations = 0
         LinearSolver.__init__(self, gui, engine)
 
     def SetOperator(self, opr, dist=False, name=None):
@@ -372,6 +392,9 @@ class IterativeSolver(LinearSolver):
 
             self.reducer = None
 
+        if self.recycle_space is not None:
+            self.recycle_space.update_operator(self.matvec)
+
     def Mult(self, b, x=None, case_base=0):
         if use_parallel:
             return self.solve_parallel(self.A, b, x)
@@ -526,6 +549,164 @@ class IterativeSolver(LinearSolver):
                 self.gui.set_solve_error(
                     (True, "No Convergence: " + self.gui.name()))
                 assert False, "No convergence"
+        return max_iter
+
+    def new_solution_space(self, num_rhs):
+        '''
+        SolutionSpace used to make the initial guess of a RHS from the
+        solutions of the previous RHS (same operator). With recycling,
+        the space is kept over Mult calls.
+        '''
+        from petram.solver.krylov_recycle import SolutionSpace
+        comm = MPI.COMM_WORLD if use_parallel else None
+
+        recycle_dim = int(getattr(self.gui, 'recycle_dim', 0))
+        if recycle_dim > 0:
+            if self.recycle_space is None:
+                self.recycle_space = SolutionSpace(max_vectors=recycle_dim,
+                                                   comm=comm)
+            return self.recycle_space
+
+        if num_rhs < 2 or not self.gui.use_rhs_projection:
+            return None
+        return SolutionSpace(max_vectors=self.kdim, comm=comm)
+
+    def matvec(self, x):
+        ax = mfem.Vector(len(x))
+        self.A.Mult(mfem.Vector(x), ax)
+        return ax.GetDataArray().copy()
+
+    def current_time(self):
+        try:
+            return float(self.engine.model['General']._global_ns['t'])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None
+
+    def extrapolated_guess(self, size):
+        order = {'linear': 1,
+                 'quadratic': 2}.get(getattr(self.gui, 'extrapolation', ''), 0)
+        t = self.current_time()
+        if order == 0 or t is None:
+            return None
+        # only solutions at earlier times are used. an entry at t or
+        # later comes from another solve at the same time (stage, sub
+        # step) or from a rejected step.
+        history = [h for h in self.history if h[0] < t]
+        if len(history) < order + 1:
+            dprint1("extrapolation skipped (t=" + str(t) + "): " +
+                    str(len(history)) + " solution(s) at earlier time")
+            return None
+
+        from petram.solver.krylov_recycle import extrapolate
+        x = extrapolate(history, t, order=order)
+        if x is None or x.size != size:
+            dprint1("extrapolation skipped (t=" + str(t) + ")")
+            return None
+        return x
+
+    def store_history(self, xx):
+        t = self.current_time()
+        if getattr(self.gui, 'extrapolation', 'zero') == 'zero' or t is None:
+            return
+        self.history = [h for h in self.history if h[0] < t][-2:]
+        self.history.append((t, xx.GetDataArray().copy()))
+
+    def solver_norm(self, solver, v):
+        '''
+        norm of residual v used by the stopping test of solver.
+        None if it is not known (SLI).
+        '''
+        solver_type = self.gui.solver_type.split(" ")[-1]
+        prc = getattr(solver, '_prc', None)
+        if (solver_type in ['FGMRES', 'BiCGSTAB'] or
+                (prc is None and solver_type in ['CG', 'GMRES', 'MINRES'])):
+            return np.sqrt(abs(self.global_dot(v, v)))
+        if solver_type not in ['CG', 'GMRES', 'MINRES']:
+            return None
+
+        mv = mfem.Vector(len(v))
+        prc.Mult(mfem.Vector(v), mv)
+        mv = mv.GetDataArray()
+        if solver_type == 'GMRES':
+            # left preconditioned: |M r|
+            return np.sqrt(abs(self.global_dot(mv, mv)))
+        # CG, MINRES: sqrt(r^t M r)
+        return np.sqrt(abs(self.global_dot(v, mv)))
+
+    def set_projected_guess(self, space, solver, bb, xx, use_history=False,
+                            x_given=False):
+        '''
+        set initial guess to xx. since MFEM Krylov solvers measure
+        rel. tol. from the initial residual, it is scaled so that the
+        solution is as accurate as the one from the zero initial guess.
+        the ratio is computed in the norm used by the solver (for
+        GMRES/CG it is the preconditioned residual).
+
+        if x_given, xx (given by caller) is used as the base of the guess
+        '''
+        b = bb.GetDataArray()
+        x0 = self.extrapolated_guess(b.size) if use_history else None
+        if x0 is None and x_given:
+            x0 = xx.GetDataArray().copy()
+
+        if space is not None:
+            if x0 is None:
+                x0, _relres = space.initial_guess(b)
+            else:
+                dx, _relres = space.initial_guess(b - self.matvec(x0))
+                if dx is not None:
+                    x0 = x0 + dx
+
+        if x0 is None:
+            solver.iterative_mode = False
+            solver.SetRelTol(self.reltol)
+            return 1.0
+
+        xx.Assign(x0)
+        solver.iterative_mode = True
+
+        r = b - self.matvec(x0)
+        rnorm = self.solver_norm(solver, r)
+        bnorm = self.solver_norm(solver, b)
+        if rnorm is None or not bnorm > 0:
+            # don't know how solver measures the residual. keep rel. tol.
+            solver.SetRelTol(self.reltol)
+            bnorm = np.sqrt(abs(self.global_dot(b, b)))
+            rnorm = np.sqrt(abs(self.global_dot(r, r)))
+            return rnorm / bnorm if bnorm > 0 else 1.0
+
+        relres = rnorm / bnorm
+        solver.SetRelTol(min(self.reltol / max(relres, 1e-300), 1.0))
+        return relres
+
+    def global_dot(self, a, b):
+        value = np.vdot(a, b)
+        if use_parallel:
+            value = MPI.COMM_WORLD.allreduce(value, op=MPI.SUM)
+        return value
+
+    def add_to_solution_space(self, space, xx):
+        if space is not None:
+            x = xx.GetDataArray()
+            space.add(x, self.matvec(x))
+
+    def history_enabled(self, num_rhs):
+        return (num_rhs == 1 and
+                getattr(self.gui, 'extrapolation', 'zero') != 'zero')
+
+    def report_rhs_iterations(self, counts, relres):
+        if len(counts) == 1:
+            dprint1("iterations=" + str(counts[0]) +
+                    ", residual of initial guess=" +
+                    "{:.3e}".format(relres[0]))
+            return
+        for k, (it, r) in enumerate(zip(counts, relres)):
+            dprint1("RHS(" + str(k) + ") iterations=" + str(it) +
+                    ", residual of projected guess=" + "{:.3e}".format(r))
+        saved = counts[0] * len(counts) - sum(counts)
+        dprint1("total iterations=" + str(sum(counts)) +
+                " (saved " + str(saved) + " compared to solving all RHS "
+                "like the first one)")
 
     def solve_parallel(self, A, b, x=None):
         if self.gui.write_mat:
@@ -542,6 +723,16 @@ class IterativeSolver(LinearSolver):
 
         from petram.helper.mpi_recipes import gather_vector
         offset = A.RowOffsets()
+
+        space = None
+        use_history = False
+        if not self.gui.use_ls_reducer:
+            space = self.new_solution_space(len(b))
+            use_history = self.history_enabled(len(b))
+            iterative_mode = self.solver.iterative_mode
+        counts = []
+        relres = []
+
         for bb in b:
             rows = MPI.COMM_WORLD.allgather(np.int32(bb.Size()))
             #rowstarts = np.hstack((0, np.cumsum(rows)))
@@ -559,8 +750,17 @@ class IterativeSolver(LinearSolver):
                     self.gui.set_solve_error(
                         (True, "No Convergence: " + self.gui.name()))
                     assert False, "No convergence"
+            elif space is not None or use_history:
+                relres.append(self.set_projected_guess(space, self.solver,
+                                                       bb, xx,
+                                                       use_history=use_history,
+                                                       x_given=x is not None))
+                counts.append(self.call_mult(self.solver, bb, xx))
+                self.add_to_solution_space(space, xx)
+                if use_history:
+                    self.store_history(xx)
             else:
-                self.call_mult(self.solver, bb, xx)
+                counts.append(self.call_mult(self.solver, bb, xx))
 
             s = []
             if distributed_sol:
@@ -585,6 +785,12 @@ class IterativeSolver(LinearSolver):
                 if myid == 0:
                     sol.append(np.hstack(s))
 
+        if space is not None or use_history:
+            self.solver.iterative_mode = iterative_mode
+            self.solver.SetRelTol(self.reltol)
+            self.report_rhs_iterations(counts, relres)
+        self.last_iterations = sum(counts)
+
         if myid != 0 and not distributed_sol:
             return None
 
@@ -600,6 +806,12 @@ class IterativeSolver(LinearSolver):
 
         sol = []
 
+        space = self.new_solution_space(len(b))
+        use_history = self.history_enabled(len(b))
+        iterative_mode = solver.iterative_mode
+        counts = []
+        relres = []
+
         for bb in b:
             if x is None:
                 xx = mfem.Vector(bb.Size())
@@ -610,8 +822,21 @@ class IterativeSolver(LinearSolver):
                 #   print x.GetBlock(j).Size()
                 #   print x.GetBlock(j).GetDataArray()
                 #assert False, "must implement this"
-            self.call_mult(solver, bb, xx)
+            if space is not None or use_history:
+                relres.append(self.set_projected_guess(space, solver, bb, xx,
+                                                       use_history=use_history,
+                                                       x_given=x is not None))
+            counts.append(self.call_mult(solver, bb, xx))
+            self.add_to_solution_space(space, xx)
+            if use_history:
+                self.store_history(xx)
 
             sol.append(xx.GetDataArray().copy())
+
+        if space is not None or use_history:
+            solver.iterative_mode = iterative_mode
+            solver.SetRelTol(self.reltol)
+            self.report_rhs_iterations(counts, relres)
+        self.last_iterations = sum(counts)
         sol = np.transpose(np.vstack(sol))
         return sol
@@ -0,0 +1,131 @@
+'''
+   krylov_recycle
+
+   reuse of previous solutions in Krylov solves with the same operator.
+
+   SolutionSpace keeps previous solutions Z and an orthonormal basis Q
+   of A Z (A Z = Q). For a new right hand side b, the initial guess
+      x0 = Z Q^t b
+   minimizes |b - A x0| over span(Z). The Krylov solver then works only
+   on the residual b - Q Q^t b, i.e. the part of b which is not
+   represented by the previous solutions (projection/deflation of the
+   RHS, as used in GCRO-type methods).
+
+   The space can be kept over successive solves (time steps, Newton
+   iterations). When the operator changes, update_operator recomputes
+   Q from Z with the new operator (recycling).
+
+   extrapolate makes an initial guess from solutions at previous times
+   (linear or quadratic in time).
+
+   vectors are numpy arrays (local data). In parallel, inner products
+   are reduced over comm.
+'''
+import numpy as np
+
+import petram.debug as debug
+dprint1, dprint2, dprint3 = debug.init_dprints("KrylovRecycle")
+
+
+class SolutionSpace():
+    def __init__(self, max_vectors=20, comm=None):
+        self.max_vectors = max(int(max_vectors), 1)
+        self.comm = comm
+        self.Z = []
+        self.Q = []
+
+    def __len__(self):
+        return len(self.Q)
+
+    def clear(self):
+        self.Z = []
+        self.Q = []
+
+    def dot(self, a, b):
+        value = np.vdot(a, b)
+        if self.comm is not None:
+            from mpi4py import MPI
+            value = self.comm.allreduce(value, op=MPI.SUM)
+        return value
+
+    def norm(self, a):
+        return np.sqrt(abs(self.dot(a, a)))
+
+    def initial_guess(self, b):
+        '''
+        returns (x0, |b - A x0|/|b|). x0 is None when the space is empty
+        or b is zero.
+        '''
+        b = np.asarray(b)
+        bnorm = self.norm(b)
+        if len(self.Q) == 0 or bnorm == 0.0:
+            return None, 1.0
+
+        x0 = np.zeros(b.shape, dtype=np.result_type(b, self.Z[0]))
+        r = b.copy()
+        for z, q in zip(self.Z, self.Q):
+            c = self.dot(q, r)
+            x0 += c * z
+            r -= c * q
+        return x0, self.norm(r) / bnorm
+
+    def update_operator(self, matvec):
+        '''
+        rebuild Q for a new operator. matvec(z) returns A z.
+        '''
+        Z = self.Z
+        self.clear()
+        for z in Z:
+            self.add(z, matvec(z))
+
+    def add(self, x, Ax, tol=1e-10):
+        '''
+        add solution x (and A x) to the space. x is not added if A x is
+        (numerically) in the space already.
+        '''
+        z = np.array(x, copy=True)
+        q = np.array(Ax, copy=True)
+        norm0 = self.norm(q)
+        if norm0 == 0.0:
+            return False
+
+        # modified Gram-Schmidt, twice
+        for _k in range(2):
+            for zz, qq in zip(self.Z, self.Q):
+                c = self.dot(qq, q)
+                q -= c * qq
+                z -= c * zz
+        norm = self.norm(q)
+        if norm < tol * norm0:
+            return False
+
+        if len(self.Q) >= self.max_vectors:
+            # dropping a column keeps Q orthonormal and A Z = Q
+            self.Z.pop(0)
+            self.Q.pop(0)
+        self.Z.append(z / norm)
+        self.Q.append(q / norm)
+        return True
+
+
+def extrapolate(history, t, order=1):
+    '''
+    extrapolate solution at time t from history [(t_k, x_k), ...]
+    using Lagrange polynomial of given order (1: linear, 2: quadratic).
+    returns None if history is too short or times are not increasing.
+    '''
+    history = history[-(order + 1):]
+    if len(history) < order + 1:
+        return None
+    ts = [h[0] for h in history] + [t]
+    if any([t2 <= t1 for t1, t2 in zip(ts[:-1], ts[1:])]):
+        return None
+
+    x = np.zeros(history[0][1].shape, dtype=history[0][1].dtype)
+    for i, (ti, xi) in enumerate(history):
+        w = 1.0
+        for j, (tj, _xj) in enumerate(history):
+            if i != j:
+                w *= (t - tj) / (ti - tj)
+        x += w * xi
+    return x
@@ -8,11 +8,13 @@ from petram.solver.solver_model import SolverInstance
 from petram.model import Model
 from petram.solver.solver_model import Solver, SolverInstance
 from petram.solver.std_solver_model import StdSolver
+from petram.helper.operator_block import FormOperator, diagonal_smoother
 
 from petram.mfem_config import use_parallel
 if use_parallel:
     from petram.helper.mpi_recipes import *
     import mfem.par as mfem
+    from mpi4py import MPI
 else:
     import mfem.ser as mfem
 
@@ -75,6 +77,8 @@ class MGSolver(StdSolver):
         v["refinement_type"] = "P(order)"
         v["presmoother_count"] = "1"
         v["postsmoother_count"] = "1"
+        # fine level smoother (GMRES, Chebyshev, l1Jacobi)
+        v["smoother_type"] = "GMRES"
         return v
 
     def panel1_param(self):
@@ -83,7 +87,9 @@ class MGSolver(StdSolver):
                         {"values": ["P(order)", "H(mesh)"]}],
                        ["number of levels", "", 0, {}],
                        ["pre-smoother #count", "", 0, {}],
-                       ["post-smoother #count", "", 0, {}], ])
+                       ["post-smoother #count", "", 0, {}],
+                       ["smoother", self.smoother_type, 1,
+                        {"values": ["GMRES", "Chebyshev", "l1Jacobi"]}], ])
         return panels
 
     def get_panel1_value(self):
@@ -92,14 +98,16 @@ class MGSolver(StdSolver):
         value.append(self.refinement_levels)
         value.append(self.presmoother_count)
         value.append(self.postsmoother_count)
+        value.append(self.smoother_type)
         return value
 
     def import_panel1_value(self, v):
-        super(MGSolver, self).import_panel1_value(v[:-4])
-        self.refinement_type = v[-4]
-        self.refinement_levels = v[-3]
-        self.presmoother_count = v[-2]
-        self.postsmoother_count = v[-1]
+        super(MGSolver, self).import_panel1_value(v[:-5])
+        self.refinement_type = v[-5]
+        self.refinement_levels = v[-4]
+        self.presmoother_count = v[-3]
+        self.postsmoother_count = v[-2]
+        self.smoother_type = v[-1]
 
     def allocate_solver_instance(self, engine):
         if self.clear_wdir:
@@ -333,16 +341,24 @@ class MGInstance(SolverInstance):
             # def SetOperator(self, x):
             #     mfem.GMRESSolver.SetOperator(self, x)
 
-        solver1 = MyGMRESSolver()
-        solver1.SetRelTol(ls0.gui.reltol)
-        solver1.SetAbsTol(0.0)
-        solver1.SetMaxIter(50)
-        solver1.SetPrintLevel(ls0.gui.log_level)
-        solver1.SetOperator(ls1.A)
+        smoother_type = getattr(self.gui, "smoother_type", "GMRES")
+        if smoother_type == "GMRES":
+            if use_parallel:
+                solver1 = mfem.GMRESSolver(MPI.COMM_WORLD)
+            else:
+                solver1 = MyGMRESSolver()
+            solver1.SetRelTol(ls0.gui.reltol)
+            solver1.SetAbsTol(0.0)
+            solver1.SetMaxIter(50)
+            solver1.SetPrintLevel(ls0.gui.log_level)
+            solver1.SetOperator(ls1.A)
+        else:
+            # engine.level_idx is at the fine level here
+            solver1 = genearate_smoother(engine, 1, ls1.A,
+                                         smoother_type=smoother_type)
 
         P_matrix = fill_prolongation_operator(engine, 0, ls1.A)
         prolongations = [P_matrix]
-        #smoothers = [ls0.solver, genearate_smoother(engine, 0, ls1.A)]
         smoothers = [ls0.solver, solver1]
         operators = [ls0.A, ls1.A]
 
@@ -442,7 +458,6 @@ class MGInstance(SolverInstance):
         mg.solver.Mult(BB[0], XX)
 
         '''
-        np.save('saved_block_vector_input', BB[0].GetDataArray())
         if ls1.gui.maxiter > 0:
             ls1.solver.SetPreconditioner(mg.solver)
             solall = ls1.Mult(BB, XX)
@@ -450,8 +465,6 @@ class MGInstance(SolverInstance):
             mg.solver.Mult(BB[0], XX)
             solall = np.transpose(np.vstack([XX.GetDataArray()]))
 
-        np.save('saved_block_vector_mg', XX.GetDataArray())
-
         # check fine level linear system...
         #solall = ls1.Mult(BB, XX)
 
@@ -507,7 +520,6 @@ def fill_prolongation_operator(engine, level, blk_opr):
     hights = A.get_local_row_heights()
     widths = A.get_local_col_widths()
 
-    print(hights, widths)
     cols = [0]
     rows = [0]
 
@@ -520,8 +532,8 @@ def fill_prolongation_operator(engine, level, blk_opr):
 
         if use_complex_opr:
             mat = blk_opr._linked_op[(offset, offset)]
-            conv = mat.GetConvention()
-            conv == (1 if mfem.ComplexOperator.HERMITIAN else -1)
+            conv = (1 if mat.GetConvention() == mfem.ComplexOperator.HERMITIAN
+                    else -1)
         else:
             conv = 1
 
@@ -535,7 +547,7 @@ def fill_prolongation_operator(engine, level, blk_opr):
                 tmp_cols.append(P.Width())
                 tmp_rows.append(P.Height())
                 if conv == -1:
-                    oo2 = mfem.ScaleOperator(P, -1)
+                    oo2 = mfem.ScaledOperator(P, -1)
                     oo2._opr = P
                     tmp_diags.append(oo2)
                 else:
@@ -550,7 +562,7 @@ def fill_prolongation_operator(engine, level, blk_opr):
                 tmp_rows.append(widths[offset])
                 oo = mfem.IdentityOperator(widths[offset])
                 if conv == -1:
-                    oo2 = mfem.ScaleOperator(oo, -1)
+                    oo2 = mfem.ScaledOperator(oo, -1)
                     oo2._opr = oo
                     tmp_diags.append(oo2)
                 else:
@@ -586,11 +598,63 @@ def fill_prolongation_operator(engine, level, blk_opr):
     return P
 
 
-def genearate_smoother(engine, level, blk_opr):
-    from petram.engine import ParallelEngine
-    assert not isinstance(
-        engine, ParallelEngine), "Parallel is not supported"
-
+def get_diag_operator(blk_opr, k):
+    '''
+    k-th diagonal block of BlockOperator (SparseMatrix in serial,
+    HypreParMatrix in parallel)
+    '''
+    if hasattr(blk_opr, "_linked_op"):
+        try:
+            return blk_opr._linked_op[(k, k)]
+        except KeyError:
+            pass
+    blk = blk_opr.GetBlock(k, k)
+    if use_parallel:
+        return mfem.Opr2HypreParMat(blk)
+    else:
+        return mfem.Opr2SparseMat(blk)
+
+
+def generate_block_smoother(mat, ess_tdof, smoother_type="Chebyshev",
+                            order=2):
+    '''
+    smoother for one diagonal block
+       Chebyshev : OperatorChebyshevSmoother (order) using the
+                   diagonal of mat
+       l1Jacobi  : HypreSmoother (parallel) / DSmoother (serial)
+    '''
+    if isinstance(mat, FormOperator):
+        # partial assembly: only diagonal is available
+        return diagonal_smoother(mat, smoother_type, order=order)
+
+    if smoother_type == "l1Jacobi":
+        if use_parallel:
+            smoother = mfem.HypreSmoother(mat, mfem.HypreSmoother.l1Jacobi)
+        else:
+            smoother = mfem.DSmoother(mat, 1)
+        smoother._linked_mat = mat
+        return smoother
+
+    diag = mfem.Vector(mat.Height())
+    mat.GetDiag(diag)
+    if use_parallel:
+        # max eigenvalue is estimated by power iteration over all ranks
+        smoother = mfem.OperatorChebyshevSmoother(mat, diag, ess_tdof,
+                                                  order, MPI.COMM_WORLD)
+    else:
+        smoother = mfem.OperatorChebyshevSmoother(mat, diag, ess_tdof,
+                                                  order)
+    smoother._linked_data = (mat, diag, ess_tdof)
+    return smoother
+
+
+def genearate_smoother(engine, level, blk_opr, smoother_type="Chebyshev",
+                       order=2):
+    '''
+    block diagonal smoother of blk_opr (operator at the current
+    engine.level_idx). works in serial (SparseMatrix blocks) and in
+    parallel (HypreParMatrix blocks, local ess. true dofs).
+    '''
     engine.access_idx = 0
     P = None
     diags = []
@@ -604,66 +668,57 @@ def genearate_smoother(engine, level, blk_opr):
     for dep_var in engine.r_dep_vars:
         offset = engine.r_dep_var_offset(dep_var)
 
+        if use_complex_opr:
+            mat = blk_opr._linked_op[(offset, offset)]
+            conv = (1 if mat.GetConvention() == mfem.ComplexOperator.HERMITIAN
+                    else -1)
+        else:
+            conv = 1
+
         tmp_cols = []
         tmp_diags = []
         if engine.r_isFESvar(dep_var):
-            ess_tdof = mfem.intArray(engine.ess_tdofs[dep_var])
-            ess_tdofs.append(ess_tdofs)
-            opr = A[offset, offset]
+            ess_tdof = mfem.intArray(engine.ess_tdofs[dep_var][0])
+            ess_tdofs.append(ess_tdof)
 
             if use_complex_opr:
-                mat = blk_opr._linked_op[(offset, offset)]
-                conv = mat.GetConvention()
-                conv == 1 if mfem.ComplexOperator.HERMITIAN else -1
                 mat1 = mat._real_operator
-                mat2 = mat._imag_operator
+                mat2 = None
+            elif A.complex:
+                mat1 = get_diag_operator(blk_opr, offset*2)
+                mat2 = get_diag_operator(blk_opr, offset*2 + 1)
             else:
-                conv = 1
-                if A.complex:
-                    mat1 = blk_opr.GetBlock(offset*2, offset*2)
-                    mat2 = blk_opr.GetBlock(offset*2 + 1, offset*2 + 1)
-                else:
-                    mat1 = blk_opr.GetBlock(offset, offset)
+                mat1 = get_diag_operator(blk_opr, offset)
+
+            rsmoother = generate_block_smoother(mat1, ess_tdof,
+                                                smoother_type=smoother_type,
+                                                order=order)
+            tmp_cols.append(mat1.Height())
+            tmp_diags.append(rsmoother)
 
             if A.complex:
-                dd = opr.diagonal()
-                diag = mfem.Vector(list(dd.real))
-                print("real", dd.real)
-                rsmoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                           diag,
-                                                           ess_tdof,
-                                                           2)
-                dd = opr.diagonal()*conv
-                diag = mfem.Vector(list(dd.real))
-                print("imag", dd.imag)
-                ismoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                           diag,
-                                                           ess_tdof,
-                                                           2)
-                tmp_cols.append(opr.shape[0])
-                tmp_cols.append(opr.shape[0])
-                tmp_diags.append(rsmoother)
+                if mat2 is not None:
+                    ismoother = generate_block_smoother(mat2, ess_tdof,
+                                                        smoother_type=smoother_type,
+                                                        order=order)
+                elif conv == -1:
+                    # imaginary row is -(real part)
+                    ismoother = mfem.ScaledOperator(rsmoother, -1)
+                    ismoother._opr = rsmoother
+                else:
+                    ismoother = rsmoother
+                tmp_cols.append(mat1.Height())
                 tmp_diags.append(ismoother)
 
-            else:
-                dd = opr.diagonal()
-                diag = mfem.Vector(list(dd))
-                smoother = mfem.OperatorChebyshevSmoother(mat1,
-                                                          diag,
-                                                          ess_tdof,
-                                                          2)
-                tmp_diags.append(smoother)
-                tmp_cols.append(opr.shape[0])
-
         else:
-            print("Non FESvar", dep_var, offset)
+            dprint1("Non FESvar", dep_var, offset)
             tmp_cols.append(widths[offset])
             tmp_diags.append(mfem.IdentityOperator(widths[offset]))
             if A.complex:
                 tmp_cols.append(widths[offset])
                 oo = mfem.IdentityOperator(widths[offset])
                 if conv == -1:
-                    oo2 = mfem.ScaleOperator(oo, -1)
+                    oo2 = mfem.ScaledOperator(oo, -1)
                     oo2._opr = oo
                     tmp_diags.append(oo2)
                 else:
@@ -677,6 +732,7 @@ def genearate_smoother(engine, level, blk_opr):
             smoother.SetDiagonalBlock(0, tmp_diags[0])
             smoother.SetDiagonalBlock(1, tmp_diags[1])
             smoother._smoother = tmp_diags
+            smoother._offsets = blockOffsets
             cols.append(tmp_cols[1]*2)
             diags.append(smoother)
         else:
@@ -690,5 +746,6 @@ def genearate_smoother(engine, level, blk_opr):
     for i, d in enumerate(diags):
         P.SetDiagonalBlock(i,  d)
     P._diags = diags
+    P._offsets = co
     P._ess_tdofs = ess_tdofs
     return P
@@ -297,6 +297,23 @@ class MUMPSSolver(LinearSolver):
                 os.makedirs(path)
         return prefix, path
 
+    def factor_memory(self):
+        '''
+        size of LU factors on this rank in bytes (from INFO(9)).
+        returns None if it is not available
+        '''
+        s = getattr(self, 's', None)
+        if s is None or not hasattr(s, 'get_info'):
+            return None
+        n = s.get_info(9)
+        if n < 0:
+            # negative value is in millions
+            n = -n * 1000000
+        itemsize = 16 if self.is_complex else 8
+        if self.gui.use_single_precision:
+            itemsize = itemsize // 2
+        return n * itemsize
+
     def set_silent(self, silent):
         self.silent = silent
 
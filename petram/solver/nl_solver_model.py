@@ -7,6 +7,7 @@ import mfem.common.chypre as chypre
 import petram.helper.block_matrix as bm
 from petram.solver.solver_model import SolverInstance
 import os
+import time
 import numpy as np
 from scipy.sparse import coo_matrix
 
@@ -395,7 +396,10 @@ class NonlinearBaseSolver(SolverInstance):
         else:
             XX = None
 
+        wall0 = time.perf_counter()
         solall = linearsolver.Mult(BB, x=XX, case_base=0)
+        self.record_linearsolver_stats(time.perf_counter() - wall0,
+                                       t=self.kiter)
 
         #linearsolver.SetOperator(AA, dist = engine.is_matrix_distributed)
         #solall = linearsolver.Mult(BB, case_base=0)
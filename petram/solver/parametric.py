@@ -1,4 +1,5 @@
 import os
+import json
 import traceback
 import gc
 
@@ -21,6 +22,84 @@ else:
     import mfem.ser as mfem
     nicePrint = dprint1
 
+
+class CaseProgress():
+    '''
+    status of each case in the full-assembly scan.
+
+    it is saved after every case, so that a scan which was interrupted
+    or had failed cases can be resumed. A case is skipped in resumed run
+    only when it is recorded as done with the same parameter and its
+    case directory still exists.
+    '''
+
+    def __init__(self, filename, params, resume=False):
+        self.filename = filename
+        self.params = [repr(x) for x in params]
+        self.status = ['pending'] * len(self.params)
+        self.errors = [''] * len(self.params)
+        if resume:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as fid:
+                record = json.load(fid)
+        except (OSError, ValueError):
+            dprint1("failed to read parametric progress", self.filename)
+            return
+        for kcase, case in enumerate(record.get("cases", [])):
+            if kcase >= len(self.params):
+                break
+            if (case["param"] == self.params[kcase] and
+                case["status"] == "done" and
+                    os.path.isdir('case_' + str(kcase))):
+                self.status[kcase] = 'done'
+        dprint1("resuming parametric scan: " +
+                str(self.status.count('done')) + " cases done")
+
+    def set(self, kcase, error):
+        if error == '':
+            self.status[kcase] = 'done'
+        else:
+            self.status[kcase] = 'failed'
+        self.errors[kcase] = error
+
+    def save(self):
+        if use_parallel and MPI.COMM_WORLD.rank != 0:
+            return
+        record = {"cases": [{"param": p, "status": s, "error": e}
+                            for p, s, e in zip(self.params,
+                                               self.status,
+                                               self.errors)]}
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(record, fid, indent=1)
+        os.replace(tmp, self.filename)
+
+    def pending_cases(self):
+        return [k for k, s in enumerate(self.status) if s != 'done']
+
+    def failed_cases(self):
+        return [k for k, s in enumerate(self.status) if s == 'failed']
+
+
+# (parametric, engine, solvers, scanner) inherited by forked case workers
+_case_pool_args = None
+_worker_is_first = True
+
+
+def _run_case_in_worker(kcase):
+    global _worker_is_first
+    obj, engine, solvers, scanner = _case_pool_args
+    error = obj._run_case(engine, solvers, scanner, kcase,
+                          is_first=_worker_is_first)
+    _worker_is_first = error != ''
+    return error
+
+
 class Parametric(SolveStep, NS_mixin):
     '''
     parametric sweep of some model paramter
@@ -51,6 +130,9 @@ class Parametric(SolveStep, NS_mixin):
                     "text": "run geometry generator"}],
                 [None,  self.use_mesh_gen,  3, {"text": "run mesh generator"}],
                 [None,  self.use_profiler,  3, {"text": "use profiler"}],
+                ["case workers",  self.num_case_workers,  400, {}],
+                [None,  self.resume_cases,  3, {
+                    "text": "resume (skip finished cases)"}],
                 ]
 
     def get_panel1_value(self):
@@ -69,9 +151,15 @@ class Parametric(SolveStep, NS_mixin):
                 self.clear_wdir,
                 self.use_geom_gen,
                 self.use_mesh_gen,
-                self.use_profiler,)
+                self.use_profiler,
+                self.num_case_workers,
+                self.resume_cases,)
 
     def import_panel1_value(self, v):
+        self.num_case_workers = int(v[-2])
+        self.resume_cases = bool(v[-1])
+        v = v[:-2]
+
         self.init_setting = str(v[0])
         self.postprocess_sol = v[1]
         self.phys_model = str(v[2])
@@ -102,6 +190,10 @@ class Parametric(SolveStep, NS_mixin):
         v['scanner'] = 'Scan("a", [1,2,3])'
         v['save_separate_mesh'] = False
         v['clear_wdir'] = True
+        # number of processes to run full-assembly cases
+        # (1: run in this process, 0: use all cores)
+        v['num_case_workers'] = 1
+        v['resume_cases'] = False
 
         return v
 
@@ -192,24 +284,43 @@ class Parametric(SolveStep, NS_mixin):
         self.case_dirs.append(path)
         return od
 
-    def _run_full_assembly(self, engine, solvers, scanner, is_first=True):
-
+    def progress_file(self):
+        return "parametric_progress_" + self.fullpath() + ".json"
+
+    def get_num_case_workers(self, num_cases):
+        if use_parallel:
+            if self.num_case_workers != 1:
+                dprint1("case workers are not used in parallel run. " +
+                        "cases are solved one by one using all processes")
+            return 1
+        num = self.num_case_workers
+        if num <= 0:
+            num = os.cpu_count()
+        return max(min(num, num_cases), 1)
+
+    def _run_case(self, engine, solvers, scanner, kcase, is_first=True):
+        '''
+        run one case of full-assembly scan.
+        returns error message ('' if the case finished normally)
+        '''
+        od = os.getcwd()
         postprocess = self.get_pp_setting()
-        for kcase, case in enumerate(scanner):
-            is_first0 = True
+        try:
+            self.set_solve_error((False, ""))
+            scanner.set_case(kcase)
 
-            od = self.go_case_dir(engine, kcase, True)
+            self.go_case_dir(engine, kcase, True)
 
             is_new_mesh = self.check_and_run_geom_mesh_gens(engine)
 
             if is_new_mesh or is_first:
                 engine.preprocess_modeldata()
-                is_first = False
 
             self.prepare_form_sol_variables(engine)
 
             self.init(engine)
 
+            is_first0 = True
             for ksolver, s in enumerate(solvers):
                 is_first0 = s.run(engine, is_first=is_first0)
                 engine.add_FESvariable_to_NS(self.get_phys())
@@ -219,7 +330,94 @@ class Parametric(SolveStep, NS_mixin):
                             self.solve_error[1])
 
             engine.run_postprocess(postprocess, name=self.name())
+            error = self.solve_error[1] if self.solve_error[0] else ''
+        except Exception:
+            error = traceback.format_exc()
+            if use_parallel:
+                # other ranks may be waiting in a collective call of
+                # assembly/solve, which this rank never enters. there is
+                # no point all ranks are guaranteed to reach, so stop here.
+                print("Parametric case " + str(kcase) + " failed on rank " +
+                      str(MPI.COMM_WORLD.rank) + "\n" + error)
+                MPI.COMM_WORLD.Abort(1)
+            dprint1("Parametric case " + str(kcase) + " failed\n" + error)
+        finally:
             os.chdir(od)
+        return error
+
+    def _run_cases_pool(self, engine, solvers, scanner, cases, progress,
+                        num_workers):
+        '''
+        run cases in a pool of forked processes. each worker inherits
+        the model and its own copy of engine, and runs cases one by one.
+
+        results are passed to the parent only through files in the case
+        directories (solutions, probes, progress file). engine of the
+        parent process does not hold solution of any case after this.
+        A following step needs to load it using InitSetting.
+        '''
+        global _case_pool_args
+
+        import multiprocessing as mp
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        dprint1("running " + str(len(cases)) + " cases using " +
+                str(num_workers) + " processes")
+
+        _case_pool_args = (self, engine, solvers, scanner)
+        try:
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     mp_context=mp.get_context('fork')) as executor:
+                futures = {executor.submit(_run_case_in_worker, kcase): kcase
+                           for kcase in cases}
+                for f in as_completed(futures):
+                    kcase = futures[f]
+                    try:
+                        error = f.result()
+                    except Exception:
+                        # worker process died (BrokenProcessPool)
+                        error = traceback.format_exc()
+                    progress.set(kcase, error)
+                    progress.save()
+        finally:
+            _case_pool_args = None
+
+        dprint1("(Note) case solutions are kept only in case directories. " +
+                "engine does not hold the last case solution")
+
+    def _run_full_assembly(self, engine, solvers, scanner, is_first=True):
+
+        progress = CaseProgress(self.progress_file(),
+                                scanner.list_data(),
+                                resume=self.resume_cases)
+        cases = progress.pending_cases()
+
+        num_workers = self.get_num_case_workers(len(cases))
+        if num_workers > 1:
+            self._run_cases_pool(engine, solvers, scanner, cases, progress,
+                                 num_workers)
+        else:
+            for kcase in cases:
+                error = self._run_case(engine, solvers, scanner, kcase,
+                                       is_first=is_first)
+                if use_parallel:
+                    # all ranks reach here (exceptions abort the job),
+                    # errors are solver errors reported by each rank.
+                    errors = MPI.COMM_WORLD.allgather(error)
+                    error = '\n'.join([x for x in errors if x != ''])
+                progress.set(kcase, error)
+                progress.save()
+
+                # engine may be left in a broken state
+                is_first = error != ''
+
+        od = os.getcwd()
+        self.case_dirs = [os.path.join(od, 'case_' + str(kcase))
+                          for kcase in range(len(scanner))]
+        self.failed_cases = progress.failed_cases()
+        if len(self.failed_cases) > 0:
+            dprint1("Parametric failed cases: " + str(self.failed_cases) +
+                    " (see " + self.progress_file() + ")")
 
     def _run_rhs_assembly(self, engine, solvers, scanner, is_first=True):
         self.prepare_form_sol_variables(engine)
@@ -348,6 +546,12 @@ class Parametric(SolveStep, NS_mixin):
 
         od = os.getcwd()
 
+        failed = getattr(self, 'failed_cases', [])
+        params = [x for k, x in enumerate(params) if k not in failed]
+        dirs = [x for k, x in enumerate(dirs) if k not in failed]
+        if len(dirs) == 0:
+            return
+
         filenames, probenames = list_probes(dirs[0])
 
         names = scanner.names
@@ -382,10 +586,12 @@ class Parametric(SolveStep, NS_mixin):
         # is_first is not used
         #
         dprint1("Parametric Scan (assemly_methd=", self.assembly_method, ")")
-        if self.clear_wdir:
+        resume = self.resume_cases and self.assembly_method == 0
+        if self.clear_wdir and not resume:
             engine.remove_solfiles()
 
-        engine.remove_case_dirs()
+        if not resume:
+            engine.remove_case_dirs()
 
         scanner = self.get_scanner()
         if scanner is None:
@@ -394,6 +600,7 @@ class Parametric(SolveStep, NS_mixin):
         solvers = self.set_scanner_physmodel(scanner)
 
         self.case_dirs = []
+        self.failed_cases = []
         if self.assembly_method == 0:
             self._run_full_assembly(
                 engine, solvers, scanner, is_first=is_first)
@@ -39,15 +39,22 @@ class DefaultParametricScanner(object):
         if self.idx == self.max:
             raise StopIteration
 
-        data = self._data[self.idx]
+        self.set_case(self.idx)
+        return self.idx
+
+    def set_case(self, idx):
+        '''
+        apply the parameter of idx-th case. this is what __next__ does,
+        and is used to run cases out of order (such as in a process pool)
+        '''
+        data = self._data[idx]
         dprint0("==== Entering next parameter:", data, "(" +
-                str(self.idx+1) + "/" + str(self.max) + ")")
+                str(idx+1) + "/" + str(self.max) + ")")
         dprint1(format_memory_usage())
 
         self.apply_param(data)
 
-        self.idx = self.idx + 1
-        return self.idx
+        self.idx = idx + 1
 
     def list_data(self):
         return list(self._data)
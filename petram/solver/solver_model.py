@@ -471,9 +471,14 @@ class SolveStep(SolverBase):
 
         solvers = self.get_active_solvers()
 
+        from petram.mfem_config import get_use_phase_profiler
+        profiler = engine.profiler
+        profiler.enabled = get_use_phase_profiler() or self.use_profiler
+
         is_new_mesh = self.check_and_run_geom_mesh_gens(engine)
         if is_first or is_new_mesh:
-            engine.preprocess_modeldata()
+            with profiler.phase("preprocess_modeldata"):
+                engine.preprocess_modeldata()
 
         # initialize and assemble
         # in run method..
@@ -499,7 +504,8 @@ class SolveStep(SolverBase):
 
         is_first = True
         for solver in solvers:
-            is_first = solver.run(engine, is_first=is_first)
+            with profiler.phase(solver.name()):
+                is_first = solver.run(engine, is_first=is_first)
             engine.add_FESvariable_to_NS(self.get_phys())
             engine.store_x()
             if self.solve_error[0]:
@@ -527,6 +533,10 @@ class SolveStep(SolverBase):
         else:
             wc = "Default"
         dprint1("Resettiing warning mode :", wc)
+
+        profiler.write_report(basename="profile_" + self.name())
+        profiler.reset()
+
         dprint1("Exiting SolveStep " + self.name())
         return False
 
@@ -626,6 +636,27 @@ class Solver(SolverBase):
                 solvers.append(x)
         return solvers
 
+    def is_matrix_free_allowed(self):
+        '''
+        partial/element assembly (matrix-free operator) can be used
+        only when all linear solvers are Krylov solvers (Iterative,
+        KrylovModel, and those used in MGSolver).
+        not allowed in parallel runs until that path is tested.
+        '''
+        from petram.mfem_config import use_parallel
+        if use_parallel:
+            dprint1("matrix-free operator is not used in parallel runs")
+            return False
+
+        from petram.solver.iterative_model import Iterative
+        from petram.solver.krylov import KrylovModel
+
+        solvers = [x for x in self.walk()
+                   if x.is_enabled() and isinstance(x, LinearSolverModel)]
+        if len(solvers) == 0:
+            return False
+        return all([isinstance(x, (Iterative, KrylovModel)) for x in solvers])
+
     def get_num_matrix(self, phys_target=None):
         raise NotImplementedError(
             "bug should not need this method")
@@ -674,6 +705,7 @@ class SolverInstance(ABC):
         self.linearsolver = None      # Actual LinearSolver
         self.probe = []
         self.linearsolver_model = None
+        self.ls_record = []     # (t, iterations, wall time) of linear solves
 
         self._ls_type = self.gui.get_solve_root().get_linearsystem_type_from_modeltree()
         self._phys_real = self.gui.get_solve_root().is_allphys_real()
@@ -747,7 +779,7 @@ class SolverInstance(ABC):
 
     def save_solution(self, ksol=0, skip_mesh=False,
                       mesh_only=False, save_parmesh=False,
-                      save_mesh_linkdir=None):
+                      save_mesh_linkdir=None, writer=None):
 
         engine = self.engine
         phys_target = self.get_phys()
@@ -765,13 +797,34 @@ class SolverInstance(ABC):
                                     skip_mesh=skip_mesh,
                                     mesh_only=False,
                                     save_parmesh=save_parmesh,
-                                    save_mesh_linkdir=save_mesh_linkdir)
+                                    save_mesh_linkdir=save_mesh_linkdir,
+                                    writer=writer)
             engine.save_extra_to_file(extra_data)
         #engine.is_initialzied = False
 
     def save_probe(self):
         for p in self.probe:
             p.write_file()
+        self.save_linearsolver_probe()
+
+    def record_linearsolver_stats(self, walltime, t=0.0):
+        '''
+        record number of iterations and wall time of the last
+        linear solve (written as probe <solver name>_linearsolver)
+        '''
+        iterations = getattr(self.linearsolver, 'last_iterations', 0)
+        self.ls_record.append((t, iterations, walltime))
+
+    def save_linearsolver_probe(self):
+        if len(self.ls_record) == 0:
+            return
+        from petram.sol.probe import Probe
+        p = Probe(self.gui.name() + '_linearsolver', root_only=True)
+        if p is None:
+            return
+        for t, iterations, walltime in self.ls_record:
+            p.append_value([iterations, walltime], t=t)
+        p.write_file(nosmyid=True)
 
     def set_linearsolver_model(self):
         solver = self.gui.get_active_solver()
@@ -1002,6 +1055,15 @@ class LinearSolver(ABC):
     '''
     is_iterative = True
 
+    def __init_subclass__(cls, **kwargs):
+        # measure SetOperator (factorization) and Mult of all solvers
+        # in engine.profiler
+        super().__init_subclass__(**kwargs)
+        for name in ('SetOperator', 'Mult'):
+            if name in cls.__dict__:
+                setattr(cls, name, _profiled_solver_method(
+                    cls.__dict__[name], name))
+
     def __init__(self, gui, engine):
         self.gui = gui
         self.engine = engine
@@ -1024,6 +1086,19 @@ class LinearSolver(ABC):
         self._skip_solve = val
 
 
+def _profiled_solver_method(method, name):
+    from functools import wraps
+
+    @wraps(method)
+    def wrapped(self, *args, **kwargs):
+        profiler = getattr(getattr(self, 'engine', None), 'profiler', None)
+        if profiler is None:
+            return method(self, *args, **kwargs)
+        with profiler.phase(name):
+            return method(self, *args, **kwargs)
+    return wrapped
+
+
 def convert_realblocks_to_complex(solall, M, merge_real_imag):
     if merge_real_imag:
         return real_to_complex_merged(solall, M)
@@ -3,6 +3,8 @@ from petram.solver.solver_model import TimeDependentSolverInstance
 from petram.solver.std_solver_model import StdSolver
 
 import os
+from time import perf_counter
+
 import numpy as np
 
 from petram.model import Model
@@ -44,12 +46,25 @@ class TimeDomain(Solver):
         v['ts_method'] = "Backward Euler"
         v['abe_minstep'] = 0.01
         v['abe_maxstep'] = 1.0
+        v['time_step_bdf2'] = 0.01
+        v['time_step_sdirk'] = 0.01
+        v['asd_minstep'] = 0.01
+        v['asd_maxstep'] = 1.0
+        v['asd_tol'] = 1e-3
         v['use_dwc_cp'] = False   # check point
         v['dwc_cp_name'] = ''
         v['dwc_cp_arg'] = ''
         v['use_dwc_ts'] = False   # every time step
         v['dwc_ts_name'] = ''
         v['dwc_ts_arg'] = ''
+        # bound of factorization cache (0: no limit). By default, only
+        # the factorization in use is kept.
+        v['factor_cache_mb'] = 0
+        v['factor_cache_entries'] = 1
+        # checkpoints link to the mesh written once in working dir
+        v['cp_link_mesh'] = False
+        # checkpoint solutions are written in background
+        v['cp_async'] = False
 
         super(TimeDomain, self).attribute_set(v)
         return v
@@ -58,6 +73,9 @@ class TimeDomain(Solver):
         elp_be = [["dt", "", 0, {}], ]
         elp_abe = [["min. dt", "", 0, {}],
                    ["max. dt", "", 0, {}], ]
+        elp_asd = [["min. dt", "", 0, {}],
+                   ["max. dt", "", 0, {}],
+                   ["rel. tol.", "", 0, {}], ]
         ret_cp = [["dwc",   self.dwc_cp_name,   0, {}],
                   ["args.",   self.dwc_cp_arg,   0, {}], ]
         value_cp = [self.dwc_cp_name, self.dwc_cp_arg]
@@ -72,11 +90,17 @@ class TimeDomain(Solver):
             [None, None, 34, ({'text': 'method', 'choices': ["Backward Euler",
                                                              "CrankNicolson",
                                                              "Forward Euler",
-                                                             "Adaptive BE"], 'call_fit':False},
+                                                             "Adaptive BE",
+                                                             "BDF2",
+                                                             "SDIRK2",
+                                                             "Adaptive SDIRK2"], 'call_fit':False},
+                              {'elp': elp_be},
+                              {'elp': elp_be},
                               {'elp': elp_be},
+                              {'elp': elp_abe},
                               {'elp': elp_be},
                               {'elp': elp_be},
-                              {'elp': elp_abe},)],
+                              {'elp': elp_asd},)],
             [None, [False, value_cp], 27, [{'text': 'Use DWC (check point)'},
                                            {'elp': ret_cp}]],
             [None, [False, value_ts], 27, [{'text': 'Use DWC (time stepping)'},
@@ -90,7 +114,13 @@ class TimeDomain(Solver):
             [None,
              self.save_parmesh,  3, {"text": "save parallel mesh"}],
             [None,
-             self.use_profiler,  3, {"text": "use profiler"}], ]
+             self.use_profiler,  3, {"text": "use profiler"}],
+            ["factor cache (MB)", self.factor_cache_mb, 300, {}],
+            ["factor cache (#)", self.factor_cache_entries, 400, {}],
+            [None,
+             self.cp_link_mesh,  3, {"text": "checkpoints link to mesh file"}],
+            [None,
+             self.cp_async,  3, {"text": "write checkpoints in background"}], ]
 
     def get_panel1_value(self):
         st_et_nt = ", ".join([str(x) for x in self.st_et_nt])
@@ -103,6 +133,10 @@ class TimeDomain(Solver):
              [str(self.time_step_cnk), ],
              [str(self.time_step_fe), ],
              [str(self.abe_minstep), str(self.abe_maxstep), ],
+             [str(self.time_step_bdf2), ],
+             [str(self.time_step_sdirk), ],
+             [str(self.asd_minstep), str(self.asd_maxstep),
+              str(self.asd_tol), ],
              ],
             [self.use_dwc_cp, [self.dwc_cp_name, self.dwc_cp_arg, ]],
             [self.use_dwc_ts, [self.dwc_ts_name, self.dwc_ts_arg, ]],
@@ -110,7 +144,11 @@ class TimeDomain(Solver):
             self.init_only,
             self.assemble_real,
             self.save_parmesh,
-            self.use_profiler,)
+            self.use_profiler,
+            self.factor_cache_mb,
+            self.factor_cache_entries,
+            self.cp_link_mesh,
+            self.cp_async,)
 
     def import_panel1_value(self, v):
         #self.init_setting = str(v[0])
@@ -124,6 +162,10 @@ class TimeDomain(Solver):
         self.assemble_real = v[8]
         self.save_parmesh = v[9]
         self.use_profiler = v[10]
+        self.factor_cache_mb = float(v[11])
+        self.factor_cache_entries = int(v[12])
+        self.cp_link_mesh = v[13]
+        self.cp_async = v[14]
 
         self.ts_method = str(v[3][0])
         self.time_step = str(v[3][1][0])
@@ -131,6 +173,11 @@ class TimeDomain(Solver):
         self.time_step_fe = str(v[3][3][0])
         self.abe_minstep = float(v[3][4][0])
         self.abe_maxstep = float(v[3][4][1])
+        self.time_step_bdf2 = str(v[3][5][0])
+        self.time_step_sdirk = str(v[3][6][0])
+        self.asd_minstep = float(v[3][7][0])
+        self.asd_maxstep = float(v[3][7][1])
+        self.asd_tol = float(v[3][7][2])
         self.use_dwc_cp = v[4][0]
         self.dwc_cp_name = v[4][1][0]
         self.dwc_cp_arg = v[4][1][1]
@@ -209,6 +256,25 @@ class TimeDomain(Solver):
             instance = FirstOrderBackwardEulerAT(self, engine)
             instance.set_timestep(self.abe_minstep)
             instance.set_maxtimestep(self.abe_maxstep)
+
+        elif self.ts_method == "BDF2":
+            instance = BDF2(self, engine)
+            time_step = self.eval_text_in_global(self.time_step_bdf2)
+            dprint1("time step configuration: " +
+                    str(self.time_step_bdf2) + ':' + str(time_step))
+            instance.set_timestep(TimeStep(time_step))
+
+        elif self.ts_method == "SDIRK2":
+            instance = SDIRK2(self, engine)
+            time_step = self.eval_text_in_global(self.time_step_sdirk)
+            dprint1("time step configuration: " +
+                    str(self.time_step_sdirk) + ':' + str(time_step))
+            instance.set_timestep(TimeStep(time_step))
+
+        elif self.ts_method == "Adaptive SDIRK2":
+            instance = SDIRK2(self, engine)
+            instance.set_timestep(TimeStep(self.asd_minstep))
+            instance.set_adaptive(self.asd_maxstep, self.asd_tol)
         else:
             assert False, "unknown stepping method: " + self.ts_method
 
@@ -220,6 +286,16 @@ class TimeDomain(Solver):
         instance.sol = engine.sol
         instance.time = st
 
+        if self.cp_link_mesh:
+            # mesh does not change during time stepping. it is saved
+            # once here, and checkpoint directories link to it.
+            instance.save_solution(mesh_only=True,
+                                   save_parmesh=self.save_parmesh)
+            instance.mesh_linkdir = os.getcwd()
+        if self.cp_async:
+            from petram.helper.background_writer import BackgroundWriter
+            instance.writer = BackgroundWriter()
+
         if self.init_only:
             instance.write_checkpoint_solution()
 
@@ -255,6 +331,7 @@ class TimeDomain(Solver):
                                     args=self.dwc_ts_arg,
                                     time=instance.time)
                 if self.use_dwc_cp and cp_written:
+                    instance.wait_checkpoint_writes()
                     engine.call_dwc(self.get_phys_range(),
                                     method="checkpoint",
                                     callername=self.name(),
@@ -269,14 +346,25 @@ class TimeDomain(Solver):
                                   ':'+str(instance.time)+"\n")
                         fid.flush()
 
+        instance.close_checkpoint_writer()
+
+        mesh_saved = instance.mesh_linkdir is not None
         instance.save_solution(ksol=0,
-                               skip_mesh=False,
+                               skip_mesh=mesh_saved,
                                mesh_only=False,
-                               save_parmesh=self.save_parmesh)
+                               save_parmesh=(self.save_parmesh and
+                                             not mesh_saved))
         instance.save_probe()
         if fid is not None:
             fid.close()
 
+        if instance.fcache.hits + instance.fcache.misses > 0:
+            instance.fcache.report()
+        if isinstance(instance, ImplicitStageSolver):
+            dprint1("time steps=" + str(instance.counter) +
+                    " linear solves=" + str(instance.num_solve) +
+                    " factorizations=" + str(instance.fcache.misses))
+
         return is_first
 
 
@@ -291,6 +379,33 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
         self.assembled = False
         self.counter = 0
         self._dt_used_in_assemble = 0.0
+        self._fcache_enabled = None
+        self.fcache = self.allocate_factorization_cache()
+        self.mesh_linkdir = None
+        self.writer = None
+
+    def allocate_factorization_cache(self, min_entries=1):
+        from petram.solver.factorization_cache import FactorizationCache
+        return FactorizationCache(max_memory=self.gui.factor_cache_mb,
+                                  max_entries=self.gui.factor_cache_entries,
+                                  min_entries=min_entries,
+                                  name=self.gui.name())
+
+    @property
+    def fcache_enabled(self):
+        '''
+        factorization for each time step is reused only when
+        the operator does not depend on time.
+        '''
+        if self._fcache_enabled is None:
+            self._fcache_enabled = True
+            for phys in self.get_phys():
+                for mm in phys.walk():
+                    if mm.enabled and mm.isTimeDependent:
+                        self._fcache_enabled = False
+            if not self._fcache_enabled:
+                dprint1("time dependent operator: factorization is not cached")
+        return self._fcache_enabled
 
     @property
     def time_step(self):
@@ -367,8 +482,10 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
 
         if (self.counter == 0 and is_first):
             M_changed = True
+            dt_changed = True
         else:
-            if self._dt_used_in_assemble != self.time_step:
+            dt_changed = self._dt_used_in_assemble != self.time_step
+            if dt_changed:
                 engine.set_update_flag('UpdateAll')
             else:
                 engine.set_update_flag('TimeDependent')
@@ -393,6 +510,17 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
             self.icheckpoint += 1
 
         depvars = [x for i, x in enumerate(depvars) if mask[0][i]]
+        if M_changed and self.fcache_enabled:
+            if not dt_changed:
+                # operator changed while keeping time step
+                self.fcache.clear()
+            entry = self.fcache.get(self.time_step)
+            if entry is not None and entry.solver is not None:
+                self.linearsolver = entry.solver
+                M_changed = False
+            else:
+                self.linearsolver = None
+
         if self.linearsolver is None:
             is_complex = self.gui.is_complex()
             self.linearsolver = self.linearsolver_model.allocate_solver(
@@ -402,13 +530,19 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
         if M_changed:
             self.linearsolver.SetOperator(AA, dist=engine.is_matrix_distributed,
                                           name=depvars)
+            if self.fcache_enabled:
+                self.fcache.set_solver(self.time_step, self.linearsolver,
+                                       AA=AA)
 
         if self.linearsolver.is_iterative:
             XX = engine.finalize_x(X[-1], RHS, mask, not self.phys_real,
                                    format=self.ls_type)
         else:
             XX = None
+        wall0 = perf_counter()
         solall = self.linearsolver.Mult(BB, x=XX, case_base=engine.case_base)
+        self.record_linearsolver_stats(perf_counter() - wall0,
+                                       t=self.time + float(self.time_step))
         engine.case_base += len(BB)
 
         if not self.phys_real and self.assemble_real:
@@ -417,6 +551,16 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
 
         #A.reformat_central_mat(solall, 0, X[0], mask)
         self.reformat_mat(A, self._AA, solall, 0, X[0], mask)
+
+        return self.advance(X, self.time_step)
+
+    def advance(self, X, dt):
+        '''
+        finish a time step. X[0] is the new solution and X[-1] is
+        the solution at the previous time.
+        '''
+        engine = self.engine
+
         # this apply interpolation operator
         sol, sol_extra = engine.split_sol_array(X[0])
 
@@ -424,13 +568,13 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
             offset1 = engine.dep_var_offset(name)       # vt
             offset2 = engine.dep_var_offset(name[:-1])  # v
             X[0][offset1, 0] = (X[0][offset2, 0]-X[-1]
-                                [offset2, 0])*(1./self.time_step)
+                                [offset2, 0])*(1./dt)
 
         for child in self.child_instance:
             # for now update_operator is True only for the first run.
             child.solve(update_operator=(self.counter == 0))
 
-        self.time = self.time + self.time_step
+        self.time = self.time + dt
 
         self.counter += 1
         for p in self.probe:
@@ -467,10 +611,24 @@ class FirstOrderBackwardEuler(TimeDependentSolverInstance):
         self.engine.mkdir(path)
         os.chdir(path)
         self.engine.cleancwd()
-        self.save_solution()
+        if self.mesh_linkdir is None:
+            self.save_solution(writer=self.writer)
+        else:
+            linkdir = os.path.relpath(self.mesh_linkdir, path)
+            self.save_solution(save_mesh_linkdir=linkdir,
+                               writer=self.writer)
         self.engine.symlink('../model.pmfm', 'model.pmfm')
         os.chdir(od)
 
+    def wait_checkpoint_writes(self):
+        if self.writer is not None:
+            self.writer.wait()
+
+    def close_checkpoint_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
 
 class CrankNicolson(FirstOrderBackwardEuler):
     def compute_A(self, M, B, X, mask_M, mask_B):
@@ -513,8 +671,8 @@ class FirstOrderForwardEuler(FirstOrderBackwardEuler):
 class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
     def __init__(self, gui, engine):
         FirstOrderBackwardEuler.__init__(self, gui, engine)
-        self.linearsolver = {}
-        self.blocks1 = {}
+        # assembled blocks and factorization for each time step level
+        self.fcache = self.allocate_factorization_cache(min_entries=2)
         self.sol1 = None
         self.sol2 = None
         self._time_step1 = 0
@@ -549,13 +707,14 @@ class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
         if idt is None:
             idt = 0
             flag = True
-        self.blocks1[idt] = self.engine.run_assemble_blocks(self.compute_A,
-                                                            self.compute_rhs,
-                                                            inplace=False)[0]
+        blocks = self.engine.run_assemble_blocks(self.compute_A,
+                                                 self.compute_rhs,
+                                                 inplace=False)[0]
         # if flag:
         #    self.blocks = self.blocks1[0]
         # else:
         #    self.blocks = None
+        return self.fcache.put(idt, blocks=blocks)
 
     def step(self, is_first):
         dprint1("Entering step", self.time_step1)
@@ -566,14 +725,15 @@ class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
             idt = self._time_step1 if mode == 0 else self._time_step2
             dt = self.time_step1 if mode == 0 else self.time_step2
             self.time_step = dt
-            if not idt in self.blocks1:
-                self.assemble(idt=idt)
-                A, X, RHS, Ae, B, M, depvars = self.blocks1[idt]
+            entry = self.fcache.get(idt)
+            if entry is None:
+                entry = self.assemble(idt=idt)
+                A, X, RHS, Ae, B, M, depvars = entry.blocks
                 BB = engine.finalize_rhs([RHS], A, X[-1], mask,
                                          not self.phys_real,
                                          format=self.ls_type, verbose=False)
             else:
-                A, X, RHS, Ae, B, M, depvars = self.blocks1[idt]
+                A, X, RHS, Ae, B, M, depvars = entry.blocks
                 if self.counter != 0 or recompute_rhs:
                     # recompute RHS
                     RHS = self.compute_rhs(M, B, [sol])
@@ -582,7 +742,7 @@ class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
                 BB = engine.finalize_rhs([RHS], A, X[-1], mask,
                                          not self.phys_real,
                                          format=self.ls_type, verbose=False)
-            if not idt in self.linearsolver:
+            if entry.solver is None:
                 AA = engine.finalize_matrix(A, mask,
                                             not self.phys_real,
                                             format=self.ls_type, verbose=False)
@@ -591,11 +751,13 @@ class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
                     datatype = 'Z' if (AA.dtype == 'complex') else 'D'
                 else:
                     datatype = 'D'
-                self.linearsolver[idt] = self.linearsolver_model.allocate_solver(datatype,
-                                                                                 engine)
-                self.linearsolver[idt].SetOperator(AA,
-                                                   dist=engine.is_matrix_distributed,
-                                                   name=depvars)
+                solver = self.linearsolver_model.allocate_solver(datatype,
+                                                                 engine)
+                solver.SetOperator(AA,
+                                   dist=engine.is_matrix_distributed,
+                                   name=depvars)
+                self.fcache.set_solver(idt, solver, AA=AA)
+            self.linearsolver = entry.solver
 
             return A, BB, X
 
@@ -607,7 +769,7 @@ class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
             assert False, "pre_assmeble must have been called"
 
         A, BB, X = get_A_BB(0, self.sol1)
-        solall = self.linearsolver[self._time_step1].Mult(BB)
+        solall = self.linearsolver.Mult(BB)
 
         self.reformat_mat(A, self._AA, solall, 0, X[0], mask)
         sol1 = X[0]
@@ -615,14 +777,14 @@ class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
         print("check sample1 (0)", [p.current_value(sol1) for p in self.probe])
 
         A, BB, X = get_A_BB(1, self.sol2)
-        solall2 = self.linearsolver[self._time_step2].Mult(BB)
+        solall2 = self.linearsolver.Mult(BB)
         self.reformat_mat(A, self._AA, solall2, 0, X[0], mask)
         sol2 = X[0]
         #sol2 = A.reformat_central_mat(solall2, 0)
         print("check sample2 (1)", [p.current_value(sol2) for p in self.probe])
 
         A, BB, X = get_A_BB(1, sol2, recompute_rhs=True)
-        solall2 = self.linearsolver[self._time_step2].Mult(BB)
+        solall2 = self.linearsolver.Mult(BB)
         self.reformat_mat(A, self._AA, solall, 0, X[0], mask)
         sol2 = X[0]
         #sol2 = A.reformat_central_mat(solall2, 0)
@@ -688,3 +850,272 @@ class FirstOrderBackwardEulerAT(FirstOrderBackwardEuler):
                 dprint1("delta is small, but restricted by max time step")
 
         return self.time >= self.et, checkpoint_written
+
+
+def block_vector_normsq(v):
+    '''
+    squared norm of block vector (None blocks are skipped)
+    '''
+    value = 0.0
+    for i in range(v.shape[0]):
+        b = v[i, 0]
+        if b is None:
+            continue
+        vec = b.toarray()
+        value += np.abs(np.sum(vec*np.conj(vec)))
+
+    from petram.mfem_config import use_parallel
+    if use_parallel:
+        from mpi4py import MPI
+        value = MPI.COMM_WORLD.allreduce(value)
+    return value
+
+
+class ImplicitStageSolver(FirstOrderBackwardEuler):
+    '''
+    base of implicit integrators whose stage (or step) is written as
+
+        M[1] c (U - v) + M[0] U = B(t)
+
+    c (mass_coeff) is kept the same for all stages of a step, so that
+    one factorization is used for all stages and it is reused (cached
+    by c) when the same step size comes back.
+    '''
+
+    def __init__(self, gui, engine):
+        FirstOrderBackwardEuler.__init__(self, gui, engine)
+        self.mass_coeff = 1.0
+        self.rhs_base = None
+        self.num_solve = 0
+        self._coeff_used_in_A = None
+
+    def compute_A(self, M, B, X, mask_M, mask_B):
+        # A (and Ae) depends on mass_coeff. It is formed again from M
+        # when c changed, even if no term was re-assembled.
+        isAnew = np.any(mask_M) or self.mass_coeff != self._coeff_used_in_A
+        A = M[0] + M[1]*self.mass_coeff
+        self._coeff_used_in_A = self.mass_coeff
+        return A, isAnew
+
+    def compute_rhs(self, M, B, X):
+        v = self.engine.sol if self.rhs_base is None else self.rhs_base
+        MM = M[1]*self.mass_coeff
+        RHS = MM.dot(v) + B
+        return RHS
+
+    def solve_stage(self, t, coeff, v, is_first=False):
+        '''
+        solve a stage at time t. The solution is stored in X[0] and
+        its copy is returned.
+
+        is_first : use the blocks assembled before the time stepping.
+                   (coeff and v must be the ones used in the assembly)
+        '''
+        engine = self.engine
+        mask = self.blk_mask
+        engine.copy_block_mask(mask)
+
+        t0 = self.time
+        self.time = t
+        self.mass_coeff = coeff
+        self.rhs_base = v
+
+        if is_first:
+            M_changed = True
+        else:
+            engine.set_update_flag('TimeDependent')
+            engine.run_apply_essential(self.get_phys(), self.get_phys_range(),
+                                       update=True)
+            engine.run_fill_X_block(update=True)
+            self.pre_assemble(update=True)
+            M_changed = self.assemble(update=True)
+
+        A, X, RHS, Ae, B, M, depvars = self.blocks
+        depvars = [x for i, x in enumerate(depvars) if mask[0][i]]
+
+        if M_changed:
+            # operator itself changed (time dependent terms).
+            # factorizations can not be reused
+            self.fcache.clear()
+
+        entry = self.fcache.get(coeff)
+        if entry is None or entry.solver is None:
+            AA = engine.finalize_matrix(A, mask,
+                                        not self.phys_real, format=self.ls_type,
+                                        verbose=False)
+            self._AA = AA
+            is_complex = self.gui.is_complex()
+            self.linearsolver = self.linearsolver_model.allocate_solver(
+                is_complex, engine)
+            self.linearsolver.SetOperator(AA, dist=engine.is_matrix_distributed,
+                                          name=depvars)
+            self.fcache.set_solver(coeff, self.linearsolver, AA=AA)
+        else:
+            self.linearsolver = entry.solver
+
+        BB = engine.finalize_rhs([RHS], A, X[-1], mask,
+                                 not self.phys_real, format=self.ls_type,
+                                 verbose=False)
+        if self.linearsolver.is_iterative:
+            XX = engine.finalize_x(X[-1], RHS, mask, not self.phys_real,
+                                   format=self.ls_type)
+        else:
+            XX = None
+        wall0 = perf_counter()
+        solall = self.linearsolver.Mult(BB, x=XX, case_base=engine.case_base)
+        self.record_linearsolver_stats(perf_counter() - wall0, t=self.time)
+        engine.case_base += len(BB)
+        self.num_solve += 1
+
+        self.reformat_mat(A, self._AA, solall, 0, X[0], mask)
+
+        self.time = t0
+        self.rhs_base = None
+
+        return X[0]*1.0
+
+    def write_initial_checkpoint(self):
+        self.sol = self.engine.sol
+        self.write_checkpoint_solution()
+        self.icheckpoint += 1
+
+
+class BDF2(ImplicitStageSolver):
+    '''
+    second order backward differentiation formula (variable step).
+    the first step is Backward Euler.
+
+      a0 u_n+1 - a1 u_n + a2 u_n-1 = dt (B - M[0] u_n+1)/M[1]
+      w = dt/dt_prev, a0 = (1+2w)/(1+w), a1 = 1+w, a2 = w^2/(1+w)
+    '''
+
+    def __init__(self, gui, engine):
+        ImplicitStageSolver.__init__(self, gui, engine)
+        self.sol_prev = None
+        self.dt_prev = None
+
+    def set_timestep(self, time_step):
+        super(BDF2, self).set_timestep(time_step)
+        self.mass_coeff = 1./float(self.time_step)
+
+    def step(self, is_first):
+        engine = self.engine
+        is_first = self.counter == 0 and is_first
+        if self.counter == 0:
+            self.write_initial_checkpoint()
+
+        dt = float(self.time_step)
+        sol = engine.sol*1.0
+
+        if self.sol_prev is None:
+            coeff = 1./dt
+            v = sol
+        else:
+            w = dt/self.dt_prev
+            a0 = (1. + 2.*w)/(1. + w)
+            a1 = 1. + w
+            a2 = w*w/(1. + w)
+            coeff = a0/dt
+            v = (sol*a1 - self.sol_prev*a2)*(1./a0)
+
+        self.solve_stage(self.time + dt, coeff, v, is_first=is_first)
+
+        self.sol_prev = sol
+        self.dt_prev = dt
+
+        return self.advance(self.blocks[1], dt)
+
+
+class SDIRK2(ImplicitStageSolver):
+    '''
+    two stage, L-stable SDIRK (Alexander) with an embedded first
+    order error estimate.
+
+       gamma = 1 - 1/sqrt(2)
+       U1 = u_n + dt gamma k1
+       U2 = u_n + dt (1-gamma) k1 + dt gamma k2,    u_n+1 = U2
+       err = dt gamma (k2 - k1)
+
+    Both stages use M[0] + M[1]/(gamma dt). In adaptive mode, dt is
+    chosen from min_dt * 2^n so that factorizations are reused.
+    '''
+    gamma = 1. - 1./np.sqrt(2.)
+
+    def __init__(self, gui, engine):
+        ImplicitStageSolver.__init__(self, gui, engine)
+        self.adaptive = False
+        self.level = 0
+        self.sol_n = None
+        self.num_reject = 0
+
+    def set_timestep(self, time_step):
+        super(SDIRK2, self).set_timestep(time_step)
+        self.mass_coeff = 1./float(self.time_step)/self.gamma
+
+    def set_adaptive(self, max_timestep, tolerance):
+        self.adaptive = True
+        self.max_timestep = float(max_timestep)
+        self.tolerance = float(tolerance)
+        self.max_level = 0
+        while (self._time_step(0) * 2**(self.max_level+1) <=
+               self.max_timestep*(1+1e-10)):
+            self.max_level += 1
+
+    @property
+    def time_step(self):
+        if self.adaptive:
+            return self._time_step(0) * 2**self.level
+        return self._time_step(self.counter)
+
+    def error_ratio(self, err, sol):
+        '''
+        |err| / (tolerance |sol|)
+        '''
+        norm = np.sqrt(block_vector_normsq(sol))
+        e = np.sqrt(block_vector_normsq(err))
+        if norm == 0.0:
+            norm = 1.0
+        return e/(self.tolerance*norm)
+
+    def step(self, is_first):
+        engine = self.engine
+        is_first = self.counter == 0 and is_first and self.sol_n is None
+        if self.counter == 0 and self.sol_n is None:
+            self.write_initial_checkpoint()
+
+        if self.sol_n is None:
+            self.sol_n = engine.sol*1.0
+        sol = self.sol_n
+
+        dt = float(self.time_step)
+        g = self.gamma
+        coeff = 1./dt/g
+
+        U1 = self.solve_stage(self.time + g*dt, coeff, sol, is_first=is_first)
+        k1 = (U1 - sol)*coeff
+        v = sol + k1*((1. - g)*dt)
+        U2 = self.solve_stage(self.time + dt, coeff, v)
+
+        if self.adaptive:
+            k2 = (U2 - v)*coeff
+            ratio = self.error_ratio((k2 - k1)*(g*dt), U2)
+            dprint1("SDIRK2 dt=" + str(dt) + ", error ratio=" + str(ratio))
+
+            if ratio > 1.0 and self.level > 0:
+                # reject. error is O(dt^2)
+                dlevel = max(int(np.ceil(np.log(ratio)/np.log(4.))), 1)
+                self.level = max(self.level - dlevel, 0)
+                self.num_reject += 1
+                dprint1("step rejected. next dt=" + str(self.time_step))
+                return False, False
+            if ratio > 1.0:
+                dprint1("error may be too large, but restricted by min time step")
+
+        self.sol_n = None
+        finished, checkpoint_written = self.advance(self.blocks[1], dt)
+
+        if self.adaptive and ratio < 0.2 and self.level < self.max_level:
+            self.level += 1
+            dprint1("next dt=" + str(self.time_step))
+
+        return finished, checkpoint_written
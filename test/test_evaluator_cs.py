@@ -0,0 +1,45 @@
+'''
+ testing EvaluatorClient against a local server
+
+   handshake, request/response frames and terminate_all
+'''
+from petram.sol.evaluator_cs import EvaluatorClient, max_protocol
+
+
+def call_server(client, name, *params, **kparams):
+    return client._EvaluatorClient__call_server(name, *params, **kparams)
+
+
+def check_server(protocol, expected):
+    client = EvaluatorClient(nproc=1, local=True, protocol=protocol)
+    assert client.p.evalsvr_protocol == expected
+
+    # large argument is sent compressed (protocol 3)
+    assert client.set_phys_path('x' * 200000) is None
+
+    # error is sent back as a response
+    message = ''
+    try:
+        call_server(client, 'no_such_method')
+    except AssertionError as e:
+        message = str(e)
+    assert 'no_such_method' in message
+
+    p = client.p
+    client.terminate_all()
+    assert p.wait(timeout=30) is not None
+    client.p = None
+
+
+def test_local_server():
+    check_server(None, max_protocol)
+
+
+def test_local_server_protocol2():
+    check_server(2, 2)
+
+
+if __name__ == '__main__':
+    test_local_server()
+    test_local_server_protocol2()
+    print("OK")
@@ -0,0 +1,79 @@
+'''
+ testing shared memory transport of EvaluatorMP results
+
+   put_in_shared_memory -> resolve -> detach -> release, then the
+   result must be readable (arrays must not refer the released block)
+'''
+import numpy as np
+
+import petram.sol.evaluator_mp as evaluator_mp
+from petram.sol.evaluator_mp import (put_in_shared_memory,
+                                     SharedArrayReader,
+                                     SharedArray)
+
+
+def make_value(n=200000):
+    ptx = np.arange(3*n, dtype=float).reshape(-1, 3)
+    data = np.arange(n, dtype=complex)
+    attrs = np.full(n, -1, dtype=int)
+    return (ptx, data, attrs)
+
+
+def test_detach_before_release():
+    value = put_in_shared_memory(make_value())
+    assert all([isinstance(x, SharedArray) for x in value])
+
+    reader = SharedArrayReader()
+    try:
+        res = reader.resolve(value)
+        # pointcloud merge returns the arrays of the first worker
+        # and fills them in place.
+        ptx, data, attrs = res
+        attrs[:10] = 1
+        ret = reader.detach((ptx[:, 0], data, attrs))
+    finally:
+        reader.release()
+    del res, ptx, data, attrs
+
+    ref = make_value()
+    assert np.all(ret[0] == ref[0][:, 0])
+    assert np.all(ret[1] == ref[1])
+    assert np.all(ret[2][:10] == 1) and np.all(ret[2][10:] == -1)
+
+
+class SmallArray(np.ndarray):
+    # under-reports its size, so that it does not fit in the block
+    nbytes = property(lambda self: 0)
+
+
+def test_block_freed_on_error():
+    created = []
+    org = evaluator_mp.shared_memory.SharedMemory
+
+    class Recorder(org):
+        def __init__(self, *args, **kwargs):
+            org.__init__(self, *args, **kwargs)
+            created.append(self.name)
+
+    value = [np.zeros(200000), np.zeros(10).view(SmallArray)]
+    evaluator_mp.shared_memory.SharedMemory = Recorder
+    try:
+        put_in_shared_memory(value)
+        assert False, "placing SmallArray should fail"
+    except TypeError:
+        pass
+    finally:
+        evaluator_mp.shared_memory.SharedMemory = org
+
+    assert len(created) == 1
+    try:
+        org(name=created[0]).close()
+        assert False, "shared memory block is not freed"
+    except FileNotFoundError:
+        pass
+
+
+if __name__ == '__main__':
+    test_detach_before_release()
+    test_block_freed_on_error()
+    print("OK")